@@ -0,0 +1,193 @@
+"""POS 分析資料（Parquet 欄式鏡像 + DuckDB 報表）
+
+把新的銷售與明細依 id 的 high-water mark 增量附加到資料庫旁 analytics/ 目錄下、
+依月份分割的 Parquet 檔；熱銷商品、類別毛利、時段與客單件數報表只讀這些檔案，
+以 DuckDB 向量化執行，不會碰到交易用的 pos.db。
+
+同步只讀取 high-water mark 之後的資料列（主鍵範圍查詢），可在營業中或打烊後執行：
+    python manage.py analytics-sync
+
+需要安裝 pyarrow（寫入）與 duckdb（報表）。
+"""
+import glob
+import json
+import os
+import shutil
+import time
+
+import database
+
+# 分析檔目錄（相對於資料庫所在目錄）
+ANALYTICS_DIR = "analytics"
+STATE_FILE = "state.json"
+# 每批讀取與寫入的列數
+SYNC_CHUNK_SIZE = 50000
+# 熱銷商品預設顯示的商品數
+TOP_PRODUCTS = 20
+
+# 分析檔欄位：名稱 -> [(欄位, 型別), ...]，順序同 database.ANALYTICS_QUERIES（不含月份，月份即目錄）
+COLUMNS = {
+    "sales": [("id", "int"), ("created_at", "str"), ("hour", "int"), ("payment_method", "str"),
+              ("member_id", "int"), ("subtotal", "float"), ("discount", "float"), ("total", "float")],
+    "sale_items": [("id", "int"), ("sale_id", "int"), ("created_at", "str"), ("hour", "int"),
+                   ("product_id", "int"), ("product_name", "str"), ("category", "str"), ("quantity", "int"),
+                   ("unit_price", "float"), ("subtotal", "float"), ("cost", "float")],
+}
+
+
+def _directory():
+    return os.path.join(os.path.dirname(os.path.abspath(database.DB_PATH)), ANALYTICS_DIR)
+
+
+def _read_state():
+    try:
+        with open(os.path.join(_directory(), STATE_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_state(state):
+    """原子寫入同步狀態：先寫暫存檔再 rename"""
+    path = os.path.join(_directory(), STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _write_chunk(name, rows):
+    """把一批資料列依月份寫成 Parquet 檔
+
+    檔名取該批第一個 id：同步中斷後從同一個 high-water mark 重跑會覆寫相同檔案，不會重複。
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("分析資料需要安裝 pyarrow")
+
+    types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string()}
+    schema = pa.schema([(column, types[kind]) for column, kind in COLUMNS[name]])
+    part = f"part-{rows[0][0]:012d}.parquet"
+    # 回放或補登的銷售會讓不同月份的 id 交錯，先依月份收集，每批每個月份只寫一個檔案
+    months = {}
+    for row in rows:
+        months.setdefault(row[1], []).append((row[0],) + tuple(row)[2:])
+    for month, group in months.items():
+        arrays = [pa.array([row[i] for row in group], type=field.type) for i, field in enumerate(schema)]
+        directory = os.path.join(_directory(), name, f"month={month}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, part)
+        pq.write_table(pa.Table.from_arrays(arrays, schema=schema), path + ".tmp", compression="zstd")
+        os.replace(path + ".tmp", path)
+
+
+def sync(chunk_size=SYNC_CHUNK_SIZE, progress=None):
+    """把 high-water mark 之後的銷售與明細附加到分析檔，回傳 {名稱: 新增筆數}
+
+    每批寫完才推進 high-water mark；progress(名稱, 已同步筆數) 於每批後呼叫。
+    """
+    os.makedirs(_directory(), exist_ok=True)
+    state = _read_state()
+    counts = {}
+    for name in COLUMNS:
+        count = 0
+        for rows in database.iter_analytics(name, state.get(name, 0), chunk_size):
+            _write_chunk(name, rows)
+            count += len(rows)
+            state[name] = rows[-1][0]
+            _write_state(state)
+            if progress:
+                progress(name, count)
+        counts[name] = count
+    state["synced_at"] = time.time()
+    _write_state(state)
+    return counts
+
+
+def rebuild(progress=None):
+    """刪除所有分析檔並從頭同步（例如歷史資料被修正後）"""
+    shutil.rmtree(_directory(), ignore_errors=True)
+    return sync(progress=progress)
+
+
+def status():
+    """同步狀態：{"sales", "sale_items"（high-water mark）, "synced_at", "files", "bytes"}"""
+    state = _read_state()
+    files = glob.glob(os.path.join(_directory(), "*", "month=*", "*.parquet"))
+    return {"sales": state.get("sales", 0), "sale_items": state.get("sale_items", 0),
+            "synced_at": state.get("synced_at"), "files": len(files),
+            "bytes": sum(os.path.getsize(path) for path in files)}
+
+
+# ---------- 報表（只讀 Parquet） ----------
+
+def _query(sql, start=None, end=None, params=()):
+    """在 DuckDB 執行報表查詢並回傳 DataFrame
+
+    sql 中的 {sales} / {sale_items} 代換為 Parquet 掃描，{where} 為日期條件
+    （'YYYY-MM-DD'，含當日；月份目錄條件讓 DuckDB 略過不相關的檔案）。
+    """
+    try:
+        import duckdb
+    except ImportError:
+        raise RuntimeError("分析報表需要安裝 duckdb")
+
+    sources = {}
+    for name in COLUMNS:
+        pattern = os.path.join(_directory(), name, "month=*", "*.parquet")
+        if not glob.glob(pattern):
+            raise RuntimeError("尚無分析資料，請先同步")
+        sources[name] = f"read_parquet('{pattern.replace(chr(39), chr(39) * 2)}', hive_partitioning = true)"
+    conditions = []
+    values = []
+    if start:
+        conditions += ["month >= ?", "created_at >= ?"]
+        values += [start[:7], start]
+    if end:
+        # created_at 為 'YYYY-MM-DD HH:MM:SS'，小於隔日字串即含當日
+        conditions += ["month <= ?", "created_at < ?"]
+        values += [end[:7], end + "~"]
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    conn = duckdb.connect()
+    try:
+        return conn.execute(sql.format(where=where, **sources), values + list(params)).df()
+    finally:
+        conn.close()
+
+
+def best_sellers(start=None, end=None, limit=TOP_PRODUCTS):
+    """熱銷商品：商品、類別、銷售數量、營收，依數量排序"""
+    return _query("""
+        SELECT product_id, arg_max(product_name, id) AS product_name, arg_max(category, id) AS category,
+               SUM(quantity) AS quantity, SUM(subtotal) AS revenue
+        FROM {sale_items} {where}
+        GROUP BY product_id ORDER BY quantity DESC, revenue DESC LIMIT ?""", start, end, (limit,))
+
+
+def margin_by_category(start=None, end=None):
+    """類別毛利：以售價（unit_price）與商品成本（cost）計算"""
+    return _query("""
+        SELECT category, SUM(quantity) AS quantity, SUM(quantity * unit_price) AS revenue,
+               SUM(quantity * cost) AS cost, SUM(quantity * (unit_price - cost)) AS margin,
+               SUM(quantity * (unit_price - cost)) / NULLIF(SUM(quantity * unit_price), 0) AS margin_rate
+        FROM {sale_items} {where}
+        GROUP BY category ORDER BY margin DESC""", start, end)
+
+
+def sales_by_hour(start=None, end=None):
+    """各時段的訂單數、營收與平均訂單金額；時段取自 created_at，與其他報表相同為 UTC"""
+    return _query("""
+        SELECT hour, COUNT(*) AS orders, SUM(total) AS revenue, AVG(total) AS average
+        FROM {sales} {where}
+        GROUP BY hour ORDER BY hour""", start, end)
+
+
+def basket_sizes(start=None, end=None):
+    """客單件數分布：每張訂單的商品件數 -> 訂單數與平均金額"""
+    return _query("""
+        SELECT items, COUNT(*) AS orders, AVG(amount) AS average
+        FROM (SELECT sale_id, SUM(quantity) AS items, SUM(subtotal) AS amount FROM {sale_items} {where} GROUP BY sale_id)
+        GROUP BY items ORDER BY items""", start, end)
@@ -0,0 +1,382 @@
+"""POS HTTP API
+
+給掃描閘道、自助結帳機與壓力測試使用的獨立行程，與 Streamlit 介面共用
+database.py。以 asyncio 處理連線，SQLite 等阻塞工作交給有上限的執行緒池。
+
+用法：
+    python api.py [--host 127.0.0.1] [--port 8080] [--workers 8] [--db pos.db]
+
+端點（回傳 JSON）：
+    GET  /health                     狀態與結構版本
+    GET  /products?search=&after=&limit=
+                                     搜尋商品；未帶 search 時以 keyset 分頁（next 為下一頁 after）
+    GET  /products/<id>              單一商品
+    GET  /scan/<條碼>                 條碼查詢
+    POST /cart/price                 {"items": [{"product_id" 或 "barcode", "quantity"}]} 計算促銷
+    POST /checkout                   同上，另可帶 discount、cash、member_phone、payment_method、idempotency_key
+    GET  /members/search?q=&limit=   會員即時查詢（電話開頭 / 末碼、姓名開頭）
+    GET  /stats/daily?day=YYYY-MM-DD 每日營收
+    GET  /metrics                    效能統計（需 POS_METRICS=1）與快取命中
+"""
+import argparse
+import asyncio
+import json
+import math
+import re
+import signal
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import database
+import journal
+import metrics
+import promotion_engine
+
+# 執行 SQLite 工作的執行緒數
+WORKERS = 8
+# 同時處理中的請求上限，超過時回傳 503 而不是無限排隊
+MAX_PENDING = 256
+# 請求內容上限（位元組）
+MAX_BODY = 1 << 20
+# 閒置連線保留秒數
+KEEPALIVE_TIMEOUT = 30
+# 停止時等待處理中請求的秒數
+SHUTDOWN_TIMEOUT = 10
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    """以指定狀態碼回應的錯誤"""
+
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status = status
+        self.body = {"error": message, **extra}
+
+
+def _product(row):
+    return dict(row) if row is not None else None
+
+
+def _int(value, name, default=None):
+    if value in (None, ""):
+        if default is None:
+            raise HTTPError(400, f"缺少 {name}")
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise HTTPError(400, f"{name} 必須是整數")
+
+
+def _number(value, name, default):
+    if value in (None, ""):
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"{name} 必須是數字")
+    # json 接受 Infinity / NaN，float() 接受 "inf"；這些值會通過大小比較
+    if not math.isfinite(number):
+        raise HTTPError(400, f"{name} 必須是數字")
+    return number
+
+
+# ---------- 端點（在執行緒池中執行） ----------
+
+def health(query, body):
+    return {"status": "ok", "schema_version": database.get_schema_version(), "journal": journal.ENABLED}
+
+
+def list_products(query, body):
+    search = query.get("search", "")
+    limit = min(_int(query.get("limit"), "limit", database.PAGE_SIZE), 500)
+    if search:
+        return {"products": [_product(row) for row in database.search_products(search, limit)]}
+    after = query.get("after")
+    rows, next_cursor = database.get_products_page(_int(after, "after") if after else None, page_size=limit)
+    return {"products": [_product(row) for row in rows], "next": next_cursor}
+
+
+def product_by_id(query, body, product_id):
+    product = database.get_product(_int(product_id, "id"))
+    if product is None:
+        raise HTTPError(404, "找不到商品")
+    return _product(product)
+
+
+def scan(query, body, barcode):
+    product = database.get_product_by_barcode(unquote(barcode))
+    if product is None:
+        raise HTTPError(404, "找不到條碼", barcode=unquote(barcode))
+    return _product(product)
+
+
+def _build_cart(body):
+    """依請求的品項讀取商品售價（含稅），回傳與 Streamlit 購物車相同格式的 dict 清單"""
+    items = body.get("items")
+    if not isinstance(items, list) or not items:
+        raise HTTPError(400, "items 必須是非空清單")
+    cart = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise HTTPError(400, "items 的每一項必須是物件")
+        if item.get("barcode"):
+            product = database.get_product_by_barcode(str(item["barcode"]))
+        else:
+            product = database.get_product(_int(item.get("product_id"), "product_id"))
+        if product is None:
+            raise HTTPError(404, "找不到商品", item=item)
+        quantity = _int(item.get("quantity"), "quantity", 1)
+        if quantity <= 0:
+            raise HTTPError(400, "quantity 必須大於 0")
+        line = cart.get(product['id'])
+        if line is None:
+            line = cart[product['id']] = {'product_id': product['id'], 'name': product['name'],
+                                          'price': product['price_inc_tax'], 'quantity': 0, 'subtotal': 0}
+        line['quantity'] += quantity
+        line['subtotal'] = line['quantity'] * line['price']
+    return list(cart.values())
+
+
+def _price(cart, discount=0):
+    pricing = promotion_engine.get_engine().price_cart(cart)
+    subtotal = sum(item['subtotal'] for item in cart)
+    # 與收銀前台相同：四捨五入到整數
+    total = int(subtotal - discount - pricing.total_discount + 0.5)
+    lines = [{**item, 'discount': line_discount, 'promotion': rule.name if rule else None}
+             for item, line_discount, rule in zip(cart, pricing.line_discounts, pricing.line_promotions)]
+    return {"lines": lines, "subtotal": subtotal, "discount": discount,
+            "promotion_discount": pricing.total_discount,
+            "basket_promotions": [rule.name for rule in pricing.basket_promotions], "total": total}
+
+
+def price_cart(query, body):
+    return _price(_build_cart(body))
+
+
+def checkout(query, body):
+    cart = _build_cart(body)
+    discount = _number(body.get("discount"), "discount", 0)
+    subtotal = sum(item['subtotal'] for item in cart)
+    # 與收銀前台的折扣欄位相同：0 到小計之間
+    if not 0 <= discount <= subtotal:
+        raise HTTPError(400, "discount 必須介於 0 與小計之間", subtotal=subtotal)
+    priced = _price(cart, discount)
+    total = priced["total"]
+    cash = _number(body.get("cash"), "cash", total)
+    if cash < total:
+        raise HTTPError(400, "收款金額不足", total=total)
+    change = int(cash - total + 0.5)
+    member_id = None
+    if body.get("member_phone"):
+        member = database.get_member_by_phone(str(body["member_phone"]))
+        if member is None:
+            raise HTTPError(404, "找不到會員")
+        member_id = member['id']
+    key = str(body.get("idempotency_key") or uuid.uuid4().hex)
+    payment_method = str(body.get("payment_method") or "cash")
+    total_discount = discount + priced["promotion_discount"]
+    if journal.ENABLED:
+        journal.get_journal().submit(member_id, priced["subtotal"], total_discount, total, cash, change, cart,
+                                     idempotency_key=key, payment_method=payment_method)
+        sale_id = None
+    else:
+        try:
+            sale_id = database.create_sale(member_id, priced["subtotal"], total_discount, total, cash, change, cart,
+                                           idempotency_key=key, payment_method=payment_method)
+        except database.InsufficientStockError as e:
+            raise HTTPError(409, str(e), shortages=[
+                {"product_id": pid, "name": name, "quantity": need, "stock": stock}
+                for pid, name, need, stock in e.shortages])
+    return {**priced, "sale_id": sale_id, "idempotency_key": key, "cash": cash, "change": change}
+
+
+def search_members(query, body):
+    limit = min(_int(query.get("limit"), "limit", database.MEMBER_SEARCH_LIMIT), 50)
+    return {"members": [dict(row) for row in database.search_members(query.get("q", ""), limit)]}
+
+
+def daily_stats(query, body):
+    return database.get_daily_sales(query.get("day") or None)
+
+
+def metrics_dump(query, body):
+    return json.loads(metrics.dump_json(cache=database.cache_stats()))
+
+
+# (方法, 路徑規則, 名稱, 處理函式)；路徑中的群組依序作為額外參數
+ROUTES = [
+    ("GET", re.compile(r"/health"), "health", health),
+    ("GET", re.compile(r"/products"), "products", list_products),
+    ("GET", re.compile(r"/products/(\d+)"), "product", product_by_id),
+    ("GET", re.compile(r"/scan/([^/]+)"), "scan", scan),
+    ("POST", re.compile(r"/cart/price"), "cart_price", price_cart),
+    ("POST", re.compile(r"/checkout"), "checkout", checkout),
+    ("GET", re.compile(r"/members/search"), "member_search", search_members),
+    ("GET", re.compile(r"/stats/daily"), "daily_stats", daily_stats),
+    ("GET", re.compile(r"/metrics"), "metrics", metrics_dump),
+]
+
+
+def _route(method, path):
+    allowed = False
+    for route_method, pattern, name, handler in ROUTES:
+        match = pattern.fullmatch(path)
+        if match:
+            if route_method == method:
+                return name, handler, match.groups()
+            allowed = True
+    if allowed:
+        raise HTTPError(405, "不支援的方法")
+    raise HTTPError(404, "找不到路徑")
+
+
+def _call(name, handler, query, body, args):
+    with metrics.timer(f"api.{name}"):
+        return handler(query, body, *args)
+
+
+# ---------- HTTP ----------
+
+class Server:
+    """最小的 HTTP/1.1 伺服器（支援 keep-alive，僅處理 JSON 請求）"""
+
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pos-api")
+        self.max_pending = max_pending
+        self.pending = 0
+        self.connections = set()
+
+    async def handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                        ConnectionError):
+                    return
+                status, body, keep_alive = await self._respond(head, reader)
+                payload = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + payload)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # 用戶端斷線（包含送出請求內容途中斷線）
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def _respond(self, head, reader):
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            return 400, {"error": "無效的請求"}, False
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            return 400, {"error": "無效的 Content-Length"}, False
+        if length > MAX_BODY:
+            return 413, {"error": "請求內容過大"}, False
+        raw = await reader.readexactly(length) if length else b""
+
+        try:
+            url = urlsplit(target)
+            name, handler, args = _route(method, url.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            try:
+                body = json.loads(raw) if raw else {}
+            except ValueError:
+                raise HTTPError(400, "請求內容不是有效的 JSON")
+            if not isinstance(body, dict):
+                raise HTTPError(400, "請求內容必須是 JSON 物件")
+            if self.pending >= self.max_pending:
+                raise HTTPError(503, "伺服器忙碌，請稍後再試")
+            self.pending += 1
+            try:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self.pool, _call, name, handler, query, body, args)
+            finally:
+                self.pending -= 1
+            return 200, result, keep_alive
+        except HTTPError as e:
+            return e.status, e.body, keep_alive
+        except Exception as e:
+            return 500, {"error": str(e)}, keep_alive
+
+    async def serve(self, host, port):
+        """提供服務直到收到 SIGINT / SIGTERM，處理中的請求完成後才結束"""
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                # Windows：Ctrl+C 仍以 KeyboardInterrupt 結束
+                pass
+        server = await asyncio.start_server(self.handle, host, port)
+        address = server.sockets[0].getsockname()
+        # 第一行輸出實際的位址（--port 0 時由系統指定埠號，壓力測試據此連線）
+        print(f"POS API 已啟動：http://{address[0]}:{address[1]}", flush=True)
+        await stop.wait()
+        server.close()
+        # 等處理中的請求回應後，再關閉閒置的 keep-alive 連線
+        deadline = loop.time() + SHUTDOWN_TIMEOUT
+        while self.pending and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        for task in list(self.connections):
+            task.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await server.wait_closed()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="POS HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="0 表示由系統指定")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="執行 SQLite 工作的執行緒數")
+    parser.add_argument("--db", default=database.DB_PATH, help="資料庫路徑（預設 pos.db）")
+    args = parser.parse_args(argv)
+
+    database.DB_PATH = args.db
+    database.init_db()
+    if journal.ENABLED:
+        # 啟動背景寫入，當機前留下的結帳記錄立即開始回放
+        journal.get_journal()
+    server = Server(args.workers)
+    start = time.perf_counter()
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.pool.shutdown(wait=True)
+        if journal.ENABLED:
+            journal.get_journal().stop()
+        print(f"POS API 已停止（執行 {time.perf_counter() - start:.0f} 秒）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
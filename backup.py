@@ -0,0 +1,160 @@
+"""POS 線上備份
+
+以 SQLite backup API 分段複製資料頁，每段之間短暫讓出，備份期間結帳照常進行。
+備份讀取同一個 WAL 快照（含尚未 checkpoint 的內容），不會複製到寫到一半的資料；
+完成後以 integrity_check 驗證，可輸出為 gzip 串流，並依保留份數清除舊快照。
+
+封存檔（archive/）寫入後不再異動，請另以一般檔案備份。
+"""
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import database
+
+# 快照目錄（相對於資料庫所在目錄）與預設保留份數
+BACKUP_DIR = "backups"
+KEEP = 14
+# 每段複製的頁數與段間休息秒數：每段只持有讀取快照極短時間，寫入者不受影響
+STEP_PAGES = 256
+STEP_SLEEP = 0.005
+# gzip 串流每次讀寫的位元組數與壓縮等級（9 約慢 3 倍，檔案只小 1%）
+CHUNK_SIZE = 1 << 20
+COMPRESS_LEVEL = 6
+
+SNAPSHOT_PREFIX = "pos-"
+SNAPSHOT_SUFFIX = ".db.gz"
+
+BackupResult = namedtuple("BackupResult", ["path", "pages", "size", "seconds"])
+
+
+class BackupError(Exception):
+    """備份檔未通過完整性檢查"""
+
+
+def _copy(target_path, pages, sleep, progress):
+    """把目前資料庫複製到 target_path，回傳頁數"""
+    source = sqlite3.connect(database.DB_PATH, timeout=30, isolation_level=None)
+    target = sqlite3.connect(target_path, isolation_level=None)
+    try:
+        # 先開啟讀取交易固定 WAL 快照：每一段都讀同一個快照，
+        # 其他連線的寫入不會讓備份重新開始，也不會被備份擋住
+        source.execute("BEGIN")
+        total = source.execute("PRAGMA page_count").fetchone()[0]
+        report = (lambda status, remaining, count: progress(count - remaining, count)) if progress else None
+        source.backup(target, pages=pages, sleep=sleep, progress=report)
+        source.execute("COMMIT")
+        # 快照為單一檔案，不需要 -wal / -shm
+        target.execute("PRAGMA journal_mode = DELETE")
+        return total
+    finally:
+        target.close()
+        source.close()
+
+
+def _integrity_check(path, name=None):
+    conn = sqlite3.connect(path)
+    try:
+        rows = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    except sqlite3.DatabaseError as e:
+        rows = [str(e)]
+    finally:
+        conn.close()
+    if rows != ["ok"]:
+        raise BackupError(f"{name or os.path.basename(path)} 完整性檢查失敗：{'; '.join(rows[:5])}")
+
+
+def _gzip(source_path, out):
+    with open(source_path, "rb") as f, \
+            gzip.GzipFile(fileobj=out, mode="wb", compresslevel=COMPRESS_LEVEL, mtime=0) as gz:
+        shutil.copyfileobj(f, gz, CHUNK_SIZE)
+
+
+def write_backup(out, pages=STEP_PAGES, sleep=STEP_SLEEP, progress=None):
+    """把驗證過的備份以 gzip 串流寫入二進位檔案物件 out，回傳頁數
+
+    progress(已複製頁數, 總頁數) 於每段複製後呼叫。
+    """
+    fd, tmp = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(database.DB_PATH)))
+    os.close(fd)
+    try:
+        total = _copy(tmp, pages, sleep, progress)
+        _integrity_check(tmp)
+        _gzip(tmp, out)
+        return total
+    finally:
+        os.remove(tmp)
+
+
+def backup_to(path, pages=STEP_PAGES, sleep=STEP_SLEEP, progress=None):
+    """備份到 path（副檔名 .gz 時壓縮），完成並驗證後才出現在目標路徑"""
+    start = time.perf_counter()
+    part = path + ".part"
+    try:
+        if path.endswith(".gz"):
+            with open(part, "wb") as out:
+                total = write_backup(out, pages, sleep, progress)
+                out.flush()
+                os.fsync(out.fileno())
+        else:
+            total = _copy(part, pages, sleep, progress)
+            _integrity_check(part)
+        os.replace(part, path)
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    return BackupResult(path, total, os.path.getsize(path), time.perf_counter() - start)
+
+
+def _backup_dir(directory=None):
+    return directory or os.path.join(os.path.dirname(os.path.abspath(database.DB_PATH)), BACKUP_DIR)
+
+
+def list_snapshots(directory=None):
+    """快照清單：[(路徑, 位元組數, 建立時間), ...]，新的在前"""
+    directory = _backup_dir(directory)
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((name for name in os.listdir(directory)
+                    if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)), reverse=True)
+    snapshots = []
+    for name in names:
+        path = os.path.join(directory, name)
+        stat = os.stat(path)
+        snapshots.append((path, stat.st_size, datetime.fromtimestamp(stat.st_mtime)))
+    return snapshots
+
+
+def snapshot(directory=None, keep=KEEP, progress=None):
+    """建立一份壓縮快照並只保留最新 keep 份，回傳 BackupResult"""
+    directory = _backup_dir(directory)
+    os.makedirs(directory, exist_ok=True)
+    name = f"{SNAPSHOT_PREFIX}{datetime.now():%Y%m%d-%H%M%S}{SNAPSHOT_SUFFIX}"
+    result = backup_to(os.path.join(directory, name), progress=progress)
+    # 檔名依時間排序，新快照驗證通過後才刪除舊的
+    for path, _, _ in list_snapshots(directory)[keep:]:
+        os.remove(path)
+    return result
+
+
+def verify(path):
+    """對備份檔（.db 或 .db.gz）執行 integrity_check，失敗時拋出 BackupError"""
+    if not path.endswith(".gz"):
+        _integrity_check(path)
+        return
+    fd, tmp = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        try:
+            with os.fdopen(fd, "wb") as out, gzip.open(path, "rb") as gz:
+                shutil.copyfileobj(gz, out, CHUNK_SIZE)
+        except (OSError, EOFError) as e:
+            raise BackupError(f"{os.path.basename(path)} 無法解壓縮：{e}") from e
+        _integrity_check(tmp, os.path.basename(path))
+    finally:
+        os.remove(tmp)
@@ -0,0 +1,487 @@
+"""POS 效能測試
+
+在暫存資料庫上執行，不會動到 pos.db。
+
+用法：
+    python bench.py checkout [--sales 500] [--json 輸出檔]
+    python bench.py promotions [--lines 200] [--rules 5000]
+    python bench.py suite [--sizes small,medium] [--baseline 基準檔] [--save-baseline 基準檔]
+    python bench.py api [--url http://127.0.0.1:8080] [--clients 32] [--duration 10]
+    python bench.py startup [--reruns 10] [--baseline 基準檔] [--save-baseline 基準檔]
+
+suite 以 datagen 產生各種規模的資料庫，量測 database.py 主要函式的每次呼叫
+中位數耗時（毫秒）。指定 --baseline 時與先前存下的結果比較，任何項目變慢
+超過 --tolerance 即以結束碼 1 結束，可用於確認每次效能調整的效果。
+
+api 對 api.py 進行壓力測試；未指定 --url 時以 small 資料集在暫存目錄啟動一個
+API 行程。回報每秒請求數與各端點的 p50 / p95 / p99 延遲。
+
+startup 在新的 Python 行程中以 streamlit 的 AppTest 執行 main.py（small 資料集），
+量測 import 時間、冷啟動首頁耗時，以及每個頁面首次開啟與重新執行的中位數耗時，
+並列出收銀首頁載入後是否已匯入 pandas 等重型模組；基準比較方式同 suite。
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote, urlsplit
+
+import database
+import datagen
+import promotion_engine
+from cart import Cart
+
+# 資料集規模：名稱 -> datagen.generate 參數
+SIZES = {
+    "small": {"products": 1000, "members": 1000, "promotions": 50, "years": 1, "sales_per_day": 20},
+    "medium": {"products": 10000, "members": 10000, "promotions": 500, "years": 2, "sales_per_day": 100},
+    "large": {"products": 50000, "members": 100000, "promotions": 5000, "years": 3, "sales_per_day": 300},
+}
+
+# 比對基準時忽略的絕對差距（毫秒），避免極快的函式因雜訊誤報
+NOISE_FLOOR_MS = 0.05
+
+
+def scratch_db(directory):
+    """切換到暫存資料庫並初始化結構"""
+    database.close_connections()
+    database.DB_PATH = os.path.join(directory, "bench.db")
+    database.init_db()
+
+
+def bench_checkout(sales=500, cart_sizes=(1, 10, 50)):
+    """結帳吞吐量：每種購物車大小各結帳 sales 筆，回傳 {品項數: 每秒筆數}"""
+    with tempfile.TemporaryDirectory() as tmp:
+        scratch_db(tmp)
+        product_count = max(cart_sizes)
+        for i in range(product_count):
+            database.add_product(f"商品{i}", 10, 10.5, 5, sales * len(cart_sizes) * 10, f"B{i:06d}", "測試")
+        results = {}
+        for size in cart_sizes:
+            items = [{'product_id': i + 1, 'name': f"商品{i}", 'quantity': 1, 'price': 10.5, 'subtotal': 10.5}
+                     for i in range(size)]
+            total = 10.5 * size
+            start = time.perf_counter()
+            for n in range(sales):
+                database.create_sale(None, total, 0, total, total, 0, items, idempotency_key=f"{size}-{n}")
+            elapsed = time.perf_counter() - start
+            results[size] = sales / elapsed
+        database.close_connections()
+    return results
+
+
+def _timeit(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_promotions(lines=200, rules=5000, repeat=20, seed=42):
+    """整車計價：lines 行購物車對 rules 條有效促銷，回傳各步驟毫秒數"""
+    rng = random.Random(seed)
+    types = ['percent', 'fixed', 'bogo', 'second_discount']
+    products = rules // 2
+    promotions = [
+        database.PromotionRule(i, f"促銷{i}", rng.choice(types), rng.randint(1, 50), rng.randint(1, products),
+                               rng.randint(1, 3), 0, None, None, rng.randint(0, 3), rng.random() < 0.1)
+        for i in range(rules - 20)]
+    promotions += [database.PromotionRule(rules - 20 + i, f"滿額{i}", 'amount', 10 * i, None, 1, 100 * i, None, None)
+                   for i in range(20)]
+    cart = []
+    for pid in rng.sample(range(1, products + 1), lines):
+        qty = rng.randint(1, 5)
+        price = float(rng.randint(10, 500))
+        cart.append({'product_id': pid, 'name': f"商品{pid}", 'quantity': qty, 'price': price, 'subtotal': qty * price})
+
+    index = {}
+    for rule in promotions:
+        index.setdefault(rule.product_id, []).append(rule)
+
+    def legacy():
+        # 舊作法：逐行以 calculate_promotion 計算
+        return sum(database.calculate_promotion(item, index.get(item['product_id'])) for item in cart)
+
+    engine = promotion_engine.PromotionEngine(promotions)
+    incremental = Cart()
+    for item in cart:
+        incremental.add(item['product_id'], item['name'], item['price'], item['quantity'])
+    incremental.price(engine)
+    changed = itertools.cycle([item['product_id'] for item in cart])
+
+    def update_one():
+        # 收銀前台按一次 ➕：只有一行需要重算
+        incremental.update(next(changed), 1)
+        incremental.price(engine)
+
+    return {
+        "compile_ms": _timeit(lambda: promotion_engine.PromotionEngine(promotions), max(1, repeat // 4)) * 1000,
+        "price_cart_ms": _timeit(lambda: engine.price_cart(cart), repeat) * 1000,
+        "cart_update_ms": _timeit(update_one, repeat) * 1000,
+        "legacy_loop_ms": _timeit(legacy, repeat) * 1000,
+    }
+
+
+def cmd_promotions(args):
+    results = bench_promotions(args.lines, args.rules)
+    print(f"{args.lines} 行購物車 × {args.rules} 條促銷")
+    print(f"  編譯規則表：{results['compile_ms']:8.2f} ms")
+    print(f"  整車計價：  {results['price_cart_ms']:8.2f} ms")
+    print(f"  單行異動：  {results['cart_update_ms']:8.2f} ms（Cart 增量計價）")
+    print(f"  逐行計算：  {results['legacy_loop_ms']:8.2f} ms（舊作法，不含整單與優先順序）")
+    return {"promotions": results}
+
+
+def _median_ms(func, args_list):
+    """依序以 args_list 中的每組參數呼叫 func，回傳每次呼叫耗時的中位數（毫秒）"""
+    # 先以最後一組參數暖身（載入快取、編譯陳述式），不列入計時
+    func(*args_list[-1])
+    timings = []
+    for call_args in args_list:
+        start = time.perf_counter()
+        func(*call_args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def bench_suite(size, repeat=50, seed=42):
+    """在 size 規模的資料庫上量測各函式，回傳 {"dataset": 筆數, 函式名稱: 中位數毫秒}"""
+    rng = random.Random(seed)
+    params = SIZES[size]
+    with tempfile.TemporaryDirectory() as tmp:
+        # 固定結束日期，讓相同規模每次產生相同的資料
+        counts = datagen.generate(os.path.join(tmp, "suite.db"), seed=seed, end="2026-01-31", **params)
+        products = params["products"]
+        product_ids = [rng.randint(1, products) for _ in range(repeat)]
+        phones = [(f"09{rng.randint(1, params['members']):08d}",) for _ in range(repeat)]
+        days = [(f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",) for _ in range(repeat)]
+        index = database.get_promotion_index()
+        promoted = [pid for pid in index if pid is not None] or [1]
+        lines = [({'product_id': pid, 'quantity': 3, 'price': 100.0, 'subtotal': 300.0}, index.get(pid))
+                 for pid in (rng.choice(promoted) for _ in range(repeat))]
+        carts = []
+        for n in range(repeat):
+            items = [{'product_id': pid, 'name': f"商品{pid}", 'quantity': 1, 'price': 100.0, 'subtotal': 100.0}
+                     for pid in rng.sample(range(1, products + 1), 5)]
+            carts.append((None, 500.0, 0, 500.0, 500.0, 0, items, f"bench-{n}"))
+        # 讀取較重的查詢只跑少量次數
+        heavy = max(3, repeat // 10)
+
+        # 量測實際查詢成本，不經過讀取快取
+        get_products = database.get_products.uncached
+        get_promotions = database.get_promotions.uncached
+        results = {"dataset": counts}
+        results["get_products('')"] = _median_ms(get_products, [("",)] * heavy)
+        results["get_products('') cached"] = _median_ms(database.get_products, [("",)] * repeat)
+        results["get_products(search)"] = _median_ms(
+            database.search_products.uncached, [(rng.choice(datagen.ITEMS),) for _ in range(repeat)])
+        results["get_member_by_phone"] = _median_ms(database.get_member_by_phone, phones)
+        # 收銀員逐字輸入：電話前 4 碼、末 4 碼與姓氏
+        search_members = database.search_members.uncached
+        results["search_members(phone prefix)"] = _median_ms(search_members, [(phone[:4],) for phone, in phones])
+        results["search_members(phone suffix)"] = _median_ms(search_members, [(phone[-4:],) for phone, in phones])
+        results["search_members(name)"] = _median_ms(search_members, [(rng.choice(datagen.SURNAMES),) for _ in phones])
+        results["get_promotions()"] = _median_ms(get_promotions, [()] * heavy)
+        results["get_promotions(product_id)"] = _median_ms(get_promotions, [(pid,) for pid in product_ids])
+        results["create_sale"] = _median_ms(database.create_sale, carts)
+        results["get_sales"] = _median_ms(database.get_sales.uncached, [()] * heavy)
+        # 銷售報表開啟時的查詢：最近 30 天的第一頁與統計
+        results["get_sales_page"] = _median_ms(database.get_sales_page.uncached, [(day, day[:8] + "28") for day, in days])
+        results["get_sales_summary"] = _median_ms(database.get_sales_summary.uncached,
+                                                  [(day[:8] + "01", day[:8] + "28") for day, in days])
+        results["get_daily_sales"] = _median_ms(database.get_daily_sales.uncached, days)
+        results["calculate_promotion"] = _median_ms(database.calculate_promotion, lines)
+        results["get_stock_at"] = _median_ms(database.get_stock_at, [(pid, day) for pid, (day,) in zip(product_ids, days)])
+        results["get_inventory_valuation"] = _median_ms(database.get_inventory_valuation, days[:heavy])
+        database.close_connections()
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """回傳變慢超過 tolerance（比例）的項目 [(規模, 項目, 基準毫秒, 目前毫秒), ...]"""
+    regressions = []
+    for size, timings in results.items():
+        for name, ms in timings.items():
+            base = baseline.get(size, {}).get(name)
+            if name == "dataset" or base is None:
+                continue
+            if ms > base * (1 + tolerance) and ms - base > NOISE_FLOOR_MS:
+                regressions.append((size, name, base, ms))
+    return regressions
+
+
+def cmd_suite(args):
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        raise SystemExit(f"未知的資料集規模：{', '.join(unknown)}（可用：{', '.join(SIZES)}）")
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["suite"]
+
+    results = {}
+    for size in sizes:
+        results[size] = bench_suite(size, args.repeat)
+        counts = results[size]["dataset"]
+        print(f"[{size}] {counts['products']:,} 商品 / {counts['members']:,} 會員 / "
+              f"{counts['promotions']:,} 促銷 / {counts['sales']:,} 銷售")
+        for name, ms in results[size].items():
+            if name == "dataset":
+                continue
+            base = baseline.get(size, {}).get(name)
+            change = f"（基準 {base:.3f} ms，{(ms / base - 1) * 100:+.0f}%）" if base else ""
+            print(f"  {name:<28}{ms:10.3f} ms{change}")
+
+    output = {"suite": results}
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        print(f"✅ 已儲存基準：{args.save_baseline}")
+    if args.baseline:
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        output["regressions"] = [
+            {"size": size, "name": name, "baseline_ms": base, "ms": ms} for size, name, base, ms in regressions]
+        for size, name, base, ms in regressions:
+            print(f"❌ [{size}] {name} 變慢：{base:.3f} → {ms:.3f} ms")
+        if not regressions:
+            print(f"✅ 與基準相比沒有超過 {args.tolerance:.0%} 的退步")
+    return output
+
+
+async def _request(reader, writer, host, method, path, body=None):
+    """在 keep-alive 連線上送出一個請求，回傳 (狀態碼, 內容)"""
+    payload = json.dumps(body).encode("utf-8") if body is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload)
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+    status = int(head.split(" ", 2)[1])
+    length = int(re.search(r"(?i)content-length:\s*(\d+)", head).group(1))
+    return status, await reader.readexactly(length)
+
+
+def _api_requests(rng, products):
+    """產生壓力測試的請求組合：以掃描條碼為主，另有搜尋、計價與結帳"""
+    product = rng.choice(products)
+    roll = rng.random()
+    if roll < 0.70:
+        return "scan", "GET", f"/scan/{quote(product['barcode'])}", None
+    if roll < 0.80:
+        return "products", "GET", f"/products?search={quote(product['category'])}&limit=20", None
+    items = [{"product_id": p['id'], "quantity": rng.randint(1, 3)} for p in rng.sample(products, 5)]
+    if roll < 0.95:
+        return "cart_price", "POST", "/cart/price", {"items": items}
+    return "checkout", "POST", "/checkout", {"items": items}
+
+
+async def _load(url, clients, duration, seed):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    reader, writer = await asyncio.open_connection(host, port)
+    status, body = await _request(reader, writer, host, "GET", "/products?limit=500")
+    writer.close()
+    products = [p for p in json.loads(body)["products"] if p['barcode']]
+    if status != 200 or not products:
+        raise SystemExit(f"❌ 無法取得商品清單（HTTP {status}）")
+
+    latencies = {}
+    errors = {}
+    deadline = time.perf_counter() + duration
+
+    async def client(n):
+        rng = random.Random(seed + n)
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while time.perf_counter() < deadline:
+                name, method, path, body = _api_requests(rng, products)
+                start = time.perf_counter()
+                status, _ = await _request(reader, writer, host, method, path, body)
+                latencies.setdefault(name, []).append(time.perf_counter() - start)
+                if status != 200:
+                    errors[status] = errors.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    return {f"p{p}_ms": ordered[max(0, -(-len(ordered) * p // 100) - 1)] * 1000 for p in (50, 95, 99)}
+
+
+def bench_api(url=None, clients=32, duration=10, workers=8, seed=42):
+    """對 API 壓力測試，回傳 {"requests_per_second", "errors", 端點: {count, p50_ms, p95_ms, p99_ms}}"""
+    with tempfile.TemporaryDirectory() as tmp:
+        server = None
+        if url is None:
+            db_path = os.path.join(tmp, "api.db")
+            datagen.generate(db_path, seed=seed, end="2026-01-31", **SIZES["small"])
+            database.close_connections()
+            server = subprocess.Popen(
+                [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api.py"),
+                 "--port", "0", "--db", db_path, "--workers", str(workers)],
+                stdout=subprocess.PIPE, text=True)
+            url = re.search(r"http://\S+", server.stdout.readline()).group(0)
+        try:
+            latencies, errors, elapsed = asyncio.run(_load(url, clients, duration, seed))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+    total = sum(len(samples) for samples in latencies.values())
+    results = {"requests_per_second": total / elapsed, "errors": errors,
+               "all": {"count": total, **_percentiles([s for samples in latencies.values() for s in samples])}}
+    for name, samples in sorted(latencies.items()):
+        results[name] = {"count": len(samples), **_percentiles(samples)}
+    return results
+
+
+def cmd_api(args):
+    results = bench_api(args.url, args.clients, args.duration, args.workers)
+    print(f"{args.clients} 個連線，{args.duration} 秒：{results['requests_per_second']:,.0f} 請求/秒")
+    for name, stats in results.items():
+        if isinstance(stats, dict) and "count" in stats:
+            print(f"  {name:<12}{stats['count']:>8,} 次  p50 {stats['p50_ms']:7.2f} ms  "
+                  f"p95 {stats['p95_ms']:7.2f} ms  p99 {stats['p99_ms']:7.2f} ms")
+    if results["errors"]:
+        print(f"❌ 錯誤回應：{results['errors']}")
+    return {"api": results}
+
+
+# 啟動量測腳本：在全新行程中執行，import 與快取都從零開始
+_STARTUP_SCRIPT = r"""
+import json, statistics, sys, time
+
+def elapsed_ms(func):
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+script, reruns, heavy = sys.argv[1], int(sys.argv[2]), sys.argv[3].split(",")
+results = {"import_streamlit": elapsed_ms(lambda: __import__("streamlit"))}
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(script, default_timeout=300)
+results["first_run"] = elapsed_ms(app.run)
+if app.exception:
+    raise SystemExit(app.exception[0].message)
+loaded = [name for name in heavy if name in sys.modules]
+for page in app.sidebar.radio[0].options:
+    results[f"{page}/first"] = elapsed_ms(lambda: app.sidebar.radio[0].set_value(page).run())
+    results[f"{page}/rerun"] = statistics.median(elapsed_ms(app.run) for _ in range(reruns))
+print(json.dumps({"timings": results, "loaded": loaded}))
+"""
+
+# 收銀首頁不應載入的模組
+HEAVY_MODULES = ("pandas", "duckdb", "pyarrow", "importer")
+
+
+def bench_startup(reruns=10, seed=42):
+    """main.py 啟動與重新執行耗時（毫秒），回傳 (耗時, 收銀首頁後已載入的重型模組)"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        datagen.generate(os.path.join(tmp, "pos.db"), seed=seed, **SIZES["small"])
+        database.close_connections()
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])))
+        proc = subprocess.run(
+            [sys.executable, "-c", _STARTUP_SCRIPT, os.path.join(root, "main.py"), str(reruns), ",".join(HEAVY_MODULES)],
+            cwd=tmp, env=env, capture_output=True, text=True)
+    if proc.returncode:
+        raise SystemExit(f"main.py 執行失敗：{proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else proc.returncode}")
+    output = json.loads(proc.stdout.strip().splitlines()[-1])
+    return output["timings"], output["loaded"]
+
+
+def cmd_startup(args):
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["startup"]
+
+    timings, loaded = bench_startup(args.reruns)
+    for name, ms in timings.items():
+        base = baseline.get("main.py", {}).get(name)
+        change = f"（基準 {base:.1f} ms，{(ms / base - 1) * 100:+.0f}%）" if base else ""
+        print(f"  {name:<28}{ms:10.1f} ms{change}")
+    print(f"收銀首頁已載入：{', '.join(loaded) if loaded else '（無重型模組）'}")
+
+    results = {"main.py": timings}
+    output = {"startup": results, "loaded_on_first_page": loaded}
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        print(f"✅ 已儲存基準：{args.save_baseline}")
+    if args.baseline:
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        output["regressions"] = [{"name": name, "baseline_ms": base, "ms": ms} for _, name, base, ms in regressions]
+        for _, name, base, ms in regressions:
+            print(f"❌ {name} 變慢：{base:.1f} → {ms:.1f} ms")
+        if not regressions:
+            print(f"✅ 與基準相比沒有超過 {args.tolerance:.0%} 的退步")
+    return output
+
+
+def cmd_checkout(args):
+    results = bench_checkout(args.sales)
+    for size, rate in results.items():
+        print(f"{size:>3} 品項/筆：{rate:8,.0f} 筆/秒（{rate * size:10,.0f} 品項/秒）")
+    return {"checkout_sales_per_second": {str(size): rate for size, rate in results.items()}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="POS 效能測試")
+    parser.add_argument("--json", help="將結果另存為 JSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    checkout = commands.add_parser("checkout", help="結帳吞吐量（1 / 10 / 50 品項）")
+    checkout.add_argument("--sales", type=int, default=500, help="每種購物車大小的結帳筆數")
+    checkout.set_defaults(func=cmd_checkout)
+
+    promotions = commands.add_parser("promotions", help="整車促銷計價（200 行 × 5000 條促銷）")
+    promotions.add_argument("--lines", type=int, default=200, help="購物車行數")
+    promotions.add_argument("--rules", type=int, default=5000, help="有效促銷數")
+    promotions.set_defaults(func=cmd_promotions)
+
+    suite = commands.add_parser("suite", help="以產生的資料集量測 database.py 主要函式")
+    suite.add_argument("--sizes", default="small,medium", help=f"資料集規模，逗號分隔（{', '.join(SIZES)}）")
+    suite.add_argument("--repeat", type=int, default=50, help="每個函式的呼叫次數")
+    suite.add_argument("--baseline", help="比較用的基準 JSON")
+    suite.add_argument("--save-baseline", help="將本次結果存為基準 JSON")
+    suite.add_argument("--tolerance", type=float, default=0.25, help="容許變慢的比例（預設 0.25）")
+    suite.set_defaults(func=cmd_suite)
+
+    api = commands.add_parser("api", help="HTTP API 壓力測試")
+    api.add_argument("--url", help="已啟動的 API 位址（預設在暫存資料庫上自行啟動）")
+    api.add_argument("--clients", type=int, default=32, help="同時連線數")
+    api.add_argument("--duration", type=float, default=10, help="測試秒數")
+    api.add_argument("--workers", type=int, default=8, help="自行啟動時 API 的執行緒數")
+    api.set_defaults(func=cmd_api)
+
+    startup = commands.add_parser("startup", help="main.py 冷啟動與重新執行耗時")
+    startup.add_argument("--reruns", type=int, default=10, help="每個頁面重新執行的次數")
+    startup.add_argument("--baseline", help="比較用的基準 JSON")
+    startup.add_argument("--save-baseline", help="將本次結果存為基準 JSON")
+    startup.add_argument("--tolerance", type=float, default=0.5, help="容許變慢的比例（預設 0.5）")
+    startup.set_defaults(func=cmd_startup)
+
+    args = parser.parse_args(argv)
+    results = args.func(args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 1 if results.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""POS 購物車
+
+以 product_id 為鍵的購物車：加入、增減數量都是 O(1)，小計隨異動累加，
+不必每次重新加總。每行的商品促銷結果會快取，只有該行數量變動或促銷規則
+重新編譯時才重算；重新執行頁面時只有異動過的行會送進促銷引擎。
+"""
+from promotion_engine import CartPricing
+
+
+class CartLine:
+    """購物車中的一行；支援 line['欄位'] 存取，可直接傳給 create_sale / 結帳日誌"""
+
+    __slots__ = ("product_id", "name", "price", "quantity", "subtotal", "discount", "promotion")
+
+    def __init__(self, product_id, name, price):
+        self.product_id = product_id
+        self.name = name
+        self.price = price
+        self.quantity = 0
+        self.subtotal = 0
+        # 最近一次計價的商品促銷折扣與套用的規則
+        self.discount = 0.0
+        self.promotion = None
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+class Cart:
+    """購物車：依加入順序保存各行，維護小計與商品促銷折扣的累計值"""
+
+    def __init__(self):
+        self._lines = {}
+        self.subtotal = 0
+        self.line_discount = 0.0
+        # 尚未以目前引擎計價的行、計價用的引擎與最近一次的整車結果
+        self._stale = set()
+        self._engine = None
+        self._pricing = None
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __iter__(self):
+        return iter(self._lines.values())
+
+    def __contains__(self, product_id):
+        return product_id in self._lines
+
+    def lines(self):
+        """各行清單（加入順序）"""
+        return list(self._lines.values())
+
+    def get(self, product_id):
+        return self._lines.get(product_id)
+
+    def add(self, product_id, name, price, quantity=1):
+        """加入商品，已存在則合併數量"""
+        line = self._lines.get(product_id)
+        if line is None:
+            line = self._lines[product_id] = CartLine(product_id, name, price)
+        self._set(line, line.quantity + quantity)
+
+    def update(self, product_id, delta):
+        """增減數量，減到 0 以下即移除該行"""
+        line = self._lines.get(product_id)
+        if line is not None:
+            self.set_quantity(product_id, line.quantity + delta)
+
+    def set_quantity(self, product_id, quantity):
+        if quantity <= 0:
+            self.remove(product_id)
+        else:
+            self._set(self._lines[product_id], quantity)
+
+    def remove(self, product_id):
+        line = self._lines.pop(product_id, None)
+        if line is None:
+            return
+        self.subtotal = round(self.subtotal - line.subtotal, 2)
+        self.line_discount = round(self.line_discount - line.discount, 2)
+        self._stale.discard(product_id)
+        self._pricing = None
+        if not self._lines:
+            # 清空時歸零，避免浮點誤差累積
+            self.subtotal = 0
+            self.line_discount = 0.0
+
+    def clear(self):
+        self.__init__()
+
+    def _set(self, line, quantity):
+        subtotal = quantity * line.price
+        # 累加差額後取到分，避免浮點誤差隨增減次數累積
+        self.subtotal = round(self.subtotal + subtotal - line.subtotal, 2)
+        line.quantity = quantity
+        line.subtotal = subtotal
+        self._stale.add(line.product_id)
+        self._pricing = None
+
+    def price(self, engine):
+        """以 engine 計價整台購物車，回傳 promotion_engine.CartPricing
+
+        只有異動過的行（或換了引擎時的所有行）會重算商品促銷；整單促銷依小計每次重算。
+        購物車與引擎都沒變時直接回傳上次的結果。
+        """
+        if engine is not self._engine:
+            self._engine = engine
+            self._stale = set(self._lines)
+            self._pricing = None
+        if self._pricing is not None:
+            return self._pricing
+        if self._stale:
+            stale = [self._lines[product_id] for product_id in self._stale]
+            discounts, applied = engine.price_lines([line.product_id for line in stale],
+                                                    [line.quantity for line in stale],
+                                                    [line.price for line in stale])
+            for line, discount, rule in zip(stale, discounts.tolist(), applied.tolist()):
+                self.line_discount += discount - line.discount
+                line.discount = discount
+                line.promotion = engine.line_rules[rule] if rule >= 0 else None
+            self.line_discount = round(self.line_discount, 2)
+            self._stale.clear()
+        lines = self._lines.values()
+        basket_discount, basket_rules = engine.price_basket(self.subtotal, list(self._lines), self.line_discount)
+        self._pricing = CartPricing(
+            line_discounts=[line.discount for line in lines],
+            line_promotions=[line.promotion for line in lines],
+            basket_discount=basket_discount,
+            basket_promotions=basket_rules,
+            total_discount=round(self.line_discount + basket_discount, 2),
+        )
+        return self._pricing
@@ -0,0 +1,38 @@
+"""檢查熱路徑查詢的執行計畫
+
+在暫存資料庫上執行所有遷移，對 database.HOT_QUERIES 逐一執行
+EXPLAIN QUERY PLAN；出現全表掃描時列出問題並以狀態碼 1 結束。
+
+用法：python check_query_plans.py [-v]
+（tests/test_query_plans.py 以 pytest 執行相同的檢查）
+"""
+import os
+import sys
+import tempfile
+
+import database
+
+
+def main(argv):
+    verbose = "-v" in argv
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "plan_check.db")
+        database.init_db()
+        if verbose:
+            for name, sql in database.HOT_QUERIES.items():
+                print(f"{name}:")
+                for detail in database.explain_query(sql):
+                    print(f"    {detail}")
+        problems = database.check_query_plans()
+        database.close_connections()
+
+    for name, detail in problems:
+        print(f"❌ {name}: {detail}")
+    if problems:
+        return 1
+    print(f"✅ {len(database.HOT_QUERIES)} 個熱路徑查詢皆使用索引")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
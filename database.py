@@ -1,21 +1,223 @@
 """POS 資料庫模組 v1.6.1"""
+import functools
+import json
+import os
 import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+import metrics
 
 DB_PATH = "pos.db"
 
+# 連線池最多保留的閒置連線數
+POOL_SIZE = 8
 
-def get_connection():
-    """建立資料庫連線"""
-    conn = sqlite3.connect(DB_PATH, timeout=30)
+# 每條連線套用的 PRAGMA（WAL 讓讀寫互不阻塞）
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=30000",
+)
+
+
+def _connect(path):
+    """開啟一條新的長駐連線並套用 PRAGMA"""
+    # isolation_level=None：由 transaction() 自行控制 BEGIN/COMMIT
+    # 啟用量測時改用會記錄每個查詢耗時與列數的連線；未啟用時為一般連線
+    factory = _TimedConnection if metrics.ENABLED else sqlite3.Connection
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False,
+                           cached_statements=256, factory=factory)
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 
-def init_db():
-    """初始化資料庫"""
-    conn = get_connection()
-    cursor = conn.cursor()
+# SQL -> 量測名稱；熱路徑查詢使用登記的名稱，其餘取壓縮空白後的 SQL 開頭
+_query_names = {}
+
+
+def _query_name(sql):
+    name = _query_names.get(sql)
+    if name is None:
+        name = next((key for key, hot_sql in HOT_QUERIES.items() if hot_sql == sql), None)
+        name = name or " ".join(sql.split())[:80]
+        if len(_query_names) < 1024:
+            _query_names[sql] = name
+    return name
+
+
+class _TimedCursor(sqlite3.Cursor):
+    """記錄查詢耗時（執行加上讀取結果）與列數的游標"""
+
+    _pending = None
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._begin(sql, time.perf_counter() - start)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        metrics.record_query(_query_name(sql), time.perf_counter() - start, max(self.rowcount, 0))
+        return self
+
+    def _begin(self, sql, elapsed):
+        if self.description is None:
+            # 非 SELECT：沒有結果列，以異動列數記錄
+            metrics.record_query(_query_name(sql), elapsed, max(self.rowcount, 0))
+        else:
+            self._pending = [_query_name(sql), elapsed, 0]
+
+    def _fetched(self, elapsed, rows, done):
+        pending = self._pending
+        if pending is not None:
+            pending[1] += elapsed
+            pending[2] += rows
+            if done:
+                self._finish()
+
+    def _finish(self):
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            metrics.record_query(*pending)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(time.perf_counter() - start, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(time.perf_counter() - start, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(time.perf_counter() - start, len(rows), True)
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(time.perf_counter() - start, 0, True)
+            raise
+        self._fetched(time.perf_counter() - start, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # 只讀取第一列就丟棄的游標（例如 fetchone 查單筆）
+        self._finish()
+
+
+class _TimedConnection(sqlite3.Connection):
+    """所有查詢都經由 _TimedCursor 執行的連線"""
+
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class _ConnectionPool:
+    """執行緒安全的連線池，連線重複使用以保留已編譯的 SQL 陳述式"""
+
+    def __init__(self, size):
+        self.size = size
+        self.path = None
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            # DB_PATH 被更換時（例如測試或效能測試）捨棄舊連線
+            if self.path != DB_PATH:
+                self._close_idle()
+                self.path = DB_PATH
+            if self._idle:
+                return self._idle.pop()
+            path = self.path
+        return _connect(path)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if self.path == DB_PATH and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        with self._lock:
+            self._close_idle()
+
+    def _close_idle(self):
+        for conn in self._idle:
+            conn.close()
+        self._idle = []
+
+
+_pool = _ConnectionPool(POOL_SIZE)
+
+
+@contextmanager
+def get_connection():
+    """從連線池借出資料庫連線，離開區塊時歸還"""
+    conn = _pool.acquire()
+    try:
+        yield conn
+    finally:
+        _pool.release(conn)
+
+
+@contextmanager
+def transaction():
+    """以 BEGIN IMMEDIATE 開啟寫入交易，成功提交、失敗回滾"""
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def close_connections():
+    """關閉連線池中所有閒置連線；下次 init_db() 會重新檢查結構版本"""
+    _pool.close_all()
+    _initialized.clear()
 
+
+# ---------- 結構版本 ----------
+
+def _migrate_v1(cursor):
+    """基礎資料表"""
     cursor.execute('''CREATE TABLE IF NOT EXISTS products (
         id INTEGER PRIMARY KEY, name TEXT, price_ex_tax REAL, price_inc_tax REAL, 
         cost REAL, stock INTEGER, barcode TEXT, category TEXT, created_at TIMESTAMP)''')
@@ -47,159 +249,1584 @@ def init_db():
         created_at TIMESTAMP
     )''')
 
-    conn.commit()
-    conn.close()
+
+def _migrate_v2(cursor):
+    """熱路徑索引"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_barcode ON products(barcode)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_created_at ON sales(created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_sale ON sale_items(sale_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_product ON sale_items(product_id)")
+    # is_active 在前：同時支援「全部有效促銷」與「單一商品有效促銷」兩種查詢
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_promotions_active ON promotions(is_active, product_id)")
+
+
+def _migrate_v3(cursor):
+    """條碼唯一索引（空白條碼不受限制）"""
+    # 舊資料若已有重複條碼則保留一般索引，查詢時以最小 id 為準
+    duplicate = cursor.execute(
+        "SELECT 1 FROM products WHERE barcode != '' GROUP BY barcode HAVING COUNT(*) > 1 LIMIT 1").fetchone()
+    if duplicate:
+        return
+    cursor.execute("DROP INDEX IF EXISTS idx_products_barcode")
+    cursor.execute("CREATE UNIQUE INDEX idx_products_barcode ON products(barcode) WHERE barcode != ''")
+
+
+def _fts5_trigram_supported(cursor):
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE temp._fts_probe USING fts5(x, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        return False
+    cursor.execute("DROP TABLE temp._fts_probe")
+    return True
+
+
+def _migrate_v4(cursor):
+    """商品全文檢索（FTS5 trigram，可處理中文）"""
+    # SQLite 3.34 以前沒有 trigram，搜尋會退回 LIKE
+    if not _fts5_trigram_supported(cursor):
+        return
+    cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, category, barcode, content='products', content_rowid='id', tokenize='trigram')''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, category, barcode)
+        VALUES (new.id, new.name, new.category, new.barcode);
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, category, barcode)
+        VALUES ('delete', old.id, old.name, old.category, old.barcode);
+    END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, category, barcode ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, category, barcode)
+        VALUES ('delete', old.id, old.name, old.category, old.barcode);
+        INSERT INTO products_fts(rowid, name, category, barcode)
+        VALUES (new.id, new.name, new.category, new.barcode);
+    END''')
+    cursor.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+
+def _migrate_v5(cursor):
+    """商品分頁瀏覽索引"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_name ON products(name)")
+    # (category) 的索引內含 rowid，可依 id 分頁；(category, name) 供依名稱分頁
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products(category)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category_name ON products(category, name)")
+
+
+def _migrate_v6(cursor):
+    """每日銷售彙總（依付款方式），並由既有銷售資料回填"""
+    cursor.execute('''CREATE TABLE IF NOT EXISTS daily_sales_summary (
+        day TEXT,
+        payment_method TEXT,
+        orders INTEGER,
+        revenue REAL,
+        discount REAL,
+        items INTEGER,
+        PRIMARY KEY (day, payment_method)
+    ) WITHOUT ROWID''')
+    _rebuild_daily_sales_summary(cursor)
+
+
+def _migrate_v7(cursor):
+    """結帳冪等鍵：同一鍵值只會建立一筆銷售"""
+    cursor.execute("ALTER TABLE sales ADD COLUMN idempotency_key TEXT")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_idempotency ON sales(idempotency_key) WHERE idempotency_key IS NOT NULL")
+
+
+def _migrate_v8(cursor):
+    """促銷優先順序與獨佔設定"""
+    cursor.execute("ALTER TABLE promotions ADD COLUMN priority INTEGER DEFAULT 0")
+    cursor.execute("ALTER TABLE promotions ADD COLUMN exclusive INTEGER DEFAULT 0")
+
+
+def _migrate_v9(cursor):
+    """庫存異動帳（只新增不修改），並以目前庫存建立期初餘額"""
+    cursor.execute('''CREATE TABLE IF NOT EXISTS stock_movements (
+        id INTEGER PRIMARY KEY,
+        product_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        balance_after INTEGER NOT NULL,
+        sale_id INTEGER,
+        note TEXT,
+        created_at TIMESTAMP NOT NULL
+    )''')
+    # 時點庫存：依商品與時間直接找到最後一筆異動，不需重播整段歷史
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_movements_product ON stock_movements(product_id, created_at, id)")
+    _reconcile_stock_ledger(cursor, "期初")
+
+
+def _migrate_v10(cursor):
+    """已封存的銷售月份（封存檔位於資料庫旁的 archive/ 目錄）"""
+    cursor.execute('''CREATE TABLE IF NOT EXISTS sales_archives (
+        month TEXT PRIMARY KEY,
+        file TEXT NOT NULL,
+        sales INTEGER NOT NULL,
+        items INTEGER NOT NULL,
+        archived_at TIMESTAMP NOT NULL
+    )''')
+
+
+def _migrate_v11(cursor):
+    """會員即時查詢：反轉電話欄位（末碼查詢）與姓名索引"""
+    cursor.execute("ALTER TABLE members ADD COLUMN phone_reversed TEXT")
+    rows = cursor.execute("SELECT id, phone FROM members WHERE phone IS NOT NULL").fetchall()
+    cursor.executemany("UPDATE members SET phone_reversed = ? WHERE id = ?", [(row[1][::-1], row[0]) for row in rows])
+    # 電話開頭使用既有的 UNIQUE(phone) 索引；末碼以反轉後的開頭範圍查詢
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_phone_reversed ON members(phone_reversed)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_name ON members(name)")
+
+
+def _migrate_v12(cursor):
+    """銷售查詢依會員篩選時的索引"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_member ON sales(member_id, created_at)")
+
+
+# 依序執行；第 n 個函式執行後 user_version = n
+MIGRATIONS = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+    _migrate_v6,
+    _migrate_v7,
+    _migrate_v8,
+    _migrate_v9,
+    _migrate_v10,
+    _migrate_v11,
+    _migrate_v12,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version():
+    """取得資料庫目前的結構版本"""
+    with get_connection() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+# 本行程已確認結構為最新版本的資料庫路徑
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def init_db():
+    """初始化資料庫並套用尚未執行的結構遷移
+
+    每個行程每個資料庫只檢查一次；結構已是最新版本時只讀取 user_version，不開啟寫入交易。
+    """
+    if DB_PATH in _initialized:
+        return
+    with _init_lock:
+        if DB_PATH in _initialized:
+            return
+        with get_connection() as conn:
+            current = conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        if not current:
+            with transaction() as cursor:
+                # 取得寫入鎖後重新讀取，其他行程可能已完成遷移
+                version = cursor.execute("PRAGMA user_version").fetchone()[0]
+                for target in range(version + 1, SCHEMA_VERSION + 1):
+                    MIGRATIONS[target - 1](cursor)
+                    cursor.execute(f"PRAGMA user_version = {target}")
+        _initialized.add(DB_PATH)
+
+
+# ---------- 執行計畫檢查 ----------
+
+# 熱路徑查詢：名稱 -> SQL，出現全表掃描即視為效能問題
+HOT_QUERIES = {}
+
+
+def _hot_query(name, sql):
+    """登記熱路徑查詢供 check_query_plans() 檢查"""
+    HOT_QUERIES[name] = sql
+    return sql
+
+
+def explain_query(sql):
+    """回傳查詢的 EXPLAIN QUERY PLAN 明細"""
+    params = [None] * sql.count("?")
+    with get_connection() as conn:
+        return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def check_query_plans():
+    """檢查所有熱路徑查詢，回傳出現全表掃描的 (名稱, 計畫明細) 清單"""
+    problems = []
+    for name, sql in HOT_QUERIES.items():
+        for detail in explain_query(sql):
+            if detail.startswith("SCAN ") and "INDEX" not in detail:
+                problems.append((name, detail))
+    return problems
+
+
+# ---------- 讀取快取 ----------
+
+# 快取最多保留的結果數（所有函式共用，超過時淘汰最久未使用的）
+CACHE_SIZE = 256
+# 快取結果的最長保留秒數；其他行程寫入資料庫時不會遞增本行程的世代，以此限制過期時間
+CACHE_TTL = 30
+
+# 各資料表的世代計數；寫入函式提交後遞增，讀取快取以世代作為鍵的一部分
+_generations = {"products": 0, "members": 0, "sales": 0, "promotions": 0}
+_cache = OrderedDict()
+_cache_stats = {}
+_cache_lock = threading.Lock()
+
+
+def _bump(*tables):
+    """資料表已異動：遞增世代，舊的快取結果不再命中"""
+    with _cache_lock:
+        for table in tables:
+            _generations[table] += 1
+
+
+def invalidate_cache():
+    """清除所有讀取快取（直接以 SQL 寫入資料庫後呼叫）"""
+    with _cache_lock:
+        for table in _generations:
+            _generations[table] += 1
+        _cache.clear()
+
+
+def cache_stats():
+    """回傳 {函式名稱: {"hits", "misses", "size"}}"""
+    with _cache_lock:
+        sizes = {}
+        for key in _cache:
+            sizes[key[0]] = sizes.get(key[0], 0) + 1
+        return {name: {"hits": hits, "misses": misses, "size": sizes.get(name, 0)}
+                for name, (hits, misses) in sorted(_cache_stats.items())}
+
+
+def _copy(value):
+    # 逐層複製清單、字典與 tuple（例如分頁的 (資料列, cursor)），呼叫端修改結果不會影響快取；
+    # sqlite3.Row、namedtuple 與純量本身不可變，直接共用
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if type(value) is tuple:
+        return tuple(_copy(item) for item in value)
+    return value
+
+
+def _cached(*tables):
+    """讀取函式的快取：同一行程內的所有工作階段共用，tables 任一異動即失效"""
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _cache_lock:
+                key = (name, DB_PATH, args, tuple(sorted(kwargs.items())),
+                       tuple(_generations[table] for table in tables))
+                entry = _cache.get(key)
+                hits, misses = _cache_stats.get(name, (0, 0))
+                if entry is not None and time.monotonic() - entry[0] < CACHE_TTL:
+                    _cache.move_to_end(key)
+                    _cache_stats[name] = (hits + 1, misses)
+                    return _copy(entry[1])
+                _cache_stats[name] = (hits, misses + 1)
+            # 查詢在鎖外執行；世代已先取得，查詢期間的異動會讓這筆結果不再被使用
+            value = func(*args, **kwargs)
+            with _cache_lock:
+                _cache[key] = (time.monotonic(), value)
+                _cache.move_to_end(key)
+                while len(_cache) > CACHE_SIZE:
+                    _cache.popitem(last=False)
+            return _copy(value)
+
+        wrapper.uncached = func
+        return wrapper
+    return decorator
 
 
 # ---------- 商品 ----------
 
+# 搜尋結果上限，避免單一字元的查詢回傳整個商品目錄
+SEARCH_LIMIT = 50
+
+# 名稱前綴相符者優先，其次為 bm25 相關度（名稱權重最高）
+_SQL_SEARCH_FTS = _hot_query("search_products", """
+    SELECT p.* FROM products_fts JOIN products p ON p.id = products_fts.rowid
+    WHERE products_fts MATCH ?
+    ORDER BY p.barcode = ? DESC, p.name LIKE ? ESCAPE '\\' DESC, bm25(products_fts, 10.0, 2.0, 5.0)
+    LIMIT ?""")
+
+_SQL_SEARCH_LIKE = """
+    SELECT * FROM products
+    WHERE name LIKE ? ESCAPE '\\' OR category LIKE ? ESCAPE '\\' OR barcode LIKE ? ESCAPE '\\'
+    ORDER BY name LIKE ? ESCAPE '\\' DESC, id
+    LIMIT ?"""
+
+_fts_tables = {}
+
+
+def _has_fts(conn):
+    """目前的資料庫是否建有 products_fts（依 DB_PATH 快取）"""
+    if DB_PATH not in _fts_tables:
+        row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'").fetchone()
+        _fts_tables[DB_PATH] = row is not None
+    return _fts_tables[DB_PATH]
+
+
+def _like_escape(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+@_cached("products")
+def search_products(search, limit=SEARCH_LIMIT):
+    """依名稱、類別或條碼搜尋商品，結果依相關度排序"""
+    search = search.strip()
+    if not search:
+        return []
+    prefix = _like_escape(search) + "%"
+    with get_connection() as conn:
+        # trigram 需要至少三個字元，較短的查詢改用 LIKE
+        if len(search) >= 3 and _has_fts(conn):
+            phrase = '"' + search.replace('"', '""') + '"'
+            return conn.execute(_SQL_SEARCH_FTS, (phrase, search, prefix, limit)).fetchall()
+        pattern = "%" + _like_escape(search) + "%"
+        return conn.execute(_SQL_SEARCH_LIKE, (pattern, pattern, pattern, prefix, limit)).fetchall()
+
+
+@_cached("products")
 def get_products(search=""):
-    conn = get_connection()
-    cursor = conn.cursor()
     if search:
-        cursor.execute("SELECT * FROM products WHERE name LIKE ? OR barcode LIKE ?", (f"%{search}%", f"%{search}%"))
-    else:
-        cursor.execute("SELECT * FROM products")
-    products = cursor.fetchall()
-    conn.close()
-    return products
+        return search_products(search)
+    with get_connection() as conn:
+        return conn.execute("SELECT * FROM products").fetchall()
+
+
+# ---------- 商品分頁 ----------
+
+PAGE_SIZE = 40
+
+# 分頁排序方式 -> (keyset 條件, 排序欄位)
+_PAGE_ORDERS = {
+    "id": ("id > ?", "id"),
+    "name": ("(name, id) > (?, ?)", "name, id"),
+}
+
+
+def _product_page_sql(order_by, by_category, first_page):
+    conditions = []
+    if by_category:
+        conditions.append("category = ?")
+    keyset, order = _PAGE_ORDERS[order_by]
+    if not first_page:
+        conditions.append(keyset)
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    return f"SELECT * FROM products {where}ORDER BY {order} LIMIT ?"
+
+
+# 依 id 排序的第一頁以 id > 0 查詢，一律走主鍵範圍搜尋
+_SQL_PRODUCT_PAGE = {
+    (order_by, by_category, first_page): _hot_query(
+        f"get_products_page({order_by}, category={by_category}, first={first_page})",
+        _product_page_sql(order_by, by_category, first_page))
+    for order_by in _PAGE_ORDERS for by_category in (False, True) for first_page in (False, True)
+    if not (order_by == "id" and first_page)
+}
+
+
+@_cached("products")
+def get_products_page(after=None, order_by="id", category=None, page_size=PAGE_SIZE):
+    """以 keyset 分頁取得商品
+
+    after 為上一頁回傳的 cursor（第一頁為 None）；回傳 (商品列表, 下一頁 cursor)，
+    已是最後一頁時 cursor 為 None。
+    """
+    if after is None and order_by == "id":
+        after = 0
+    params = []
+    if category:
+        params.append(category)
+    if after is not None:
+        params.extend(after if order_by == "name" else (after,))
+    sql = _SQL_PRODUCT_PAGE[(order_by, bool(category), after is None)]
+    with get_connection() as conn:
+        rows = conn.execute(sql, params + [page_size + 1]).fetchall()
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    last = rows[-1]
+    return rows, ((last['name'], last['id']) if order_by == "name" else last['id'])
+
+
+@_cached("products")
+def count_products(category=None):
+    """商品總數（可依類別篩選）"""
+    with get_connection() as conn:
+        if category:
+            return conn.execute("SELECT COUNT(*) FROM products WHERE category = ?", (category,)).fetchone()[0]
+        return conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+
+@_cached("products")
+def get_categories():
+    """取得所有商品類別"""
+    with get_connection() as conn:
+        rows = conn.execute("SELECT DISTINCT category FROM products WHERE category != '' ORDER BY category")
+        return [row[0] for row in rows]
 
 
 def add_product(name, price_ex_tax, price_inc_tax, cost=0, stock=0, barcode="", category=""):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO products VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)", 
-        (name, price_ex_tax, price_inc_tax, cost, stock, barcode, category))
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute("INSERT INTO products VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)", 
+            (name, price_ex_tax, price_inc_tax, cost, stock, barcode, category))
+        product_id = cursor.lastrowid
+        if stock:
+            _record_movements(cursor, "receipt", [(product_id, stock)], note="新增商品")
+    _bump("products")
+    _remember_barcode(barcode, product_id)
+    return product_id
 
 
-def update_product(product_id, name, price_ex_tax, price_inc_tax, cost, stock, barcode, category):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE products 
-        SET name=?, price_ex_tax=?, price_inc_tax=?, cost=?, stock=?, barcode=?, category=? 
-        WHERE id=?
-    """, (name, price_ex_tax, price_inc_tax, cost, stock, barcode, category, product_id))
-    conn.commit()
-    conn.close()
+def update_product(product_id, name, price_ex_tax, price_inc_tax, cost, stock, barcode, category, stock_was=None):
+    """更新商品；stock_was 為表單載入時的庫存，只套用差額，期間成交的銷售不會被覆蓋"""
+    with transaction() as cursor:
+        old_barcode = _current_barcode(cursor, product_id)
+        if stock_was is None:
+            stock_was = cursor.execute("SELECT COALESCE(stock, 0) FROM products WHERE id = ?", (product_id,)).fetchone()
+            stock_was = stock_was[0] if stock_was else 0
+        delta = stock - stock_was
+        cursor.execute("""
+            UPDATE products 
+            SET name=?, price_ex_tax=?, price_inc_tax=?, cost=?, stock=COALESCE(stock, 0) + ?, barcode=?, category=? 
+            WHERE id=?
+        """, (name, price_ex_tax, price_inc_tax, cost, delta, barcode, category, product_id))
+        if delta:
+            _record_movements(cursor, "adjustment", [(product_id, delta)], note="修改商品")
+    _bump("products")
+    _forget_barcode(old_barcode)
+    _remember_barcode(barcode, product_id)
 
 
 def delete_product(product_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM products WHERE id=?", (product_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        old_barcode = _current_barcode(cursor, product_id)
+        cursor.execute("DELETE FROM products WHERE id=?", (product_id,))
+    _bump("products")
+    _forget_barcode(old_barcode)
+
+
+# ---------- 條碼 ----------
+
+# 條碼 -> 商品 id 的行程內雜湊表；只存 id，商品資料一律以主鍵即時讀取以免庫存過期
+_barcode_map = None
+_barcode_lock = threading.Lock()
+
+_SQL_PRODUCT_BY_ID = _hot_query("get_product", "SELECT * FROM products WHERE id = ?")
+# 需帶 barcode != '' 條件才能使用部分唯一索引
+_SQL_PRODUCT_BY_BARCODE = _hot_query("get_product_by_barcode", """
+    SELECT * FROM products WHERE barcode = ? AND barcode != '' ORDER BY id LIMIT 1""")
+# 條碼以 JSON 陣列傳入，一次查詢任意數量的條碼，每個條碼各走一次索引；
+# 與單筆查詢相同，重複的條碼取 id 最小的商品
+_SQL_PRODUCTS_BY_BARCODES = _hot_query("get_products_by_barcodes", """
+    SELECT * FROM products WHERE id IN (
+        SELECT MIN(id) FROM products
+        WHERE barcode IN (SELECT value FROM json_each(?)) AND barcode != '' GROUP BY barcode)""")
+
+
+def _get_barcode_map():
+    global _barcode_map
+    if _barcode_map is None:
+        with _barcode_lock:
+            if _barcode_map is None:
+                with get_connection() as conn:
+                    # 由大到小寫入，重複條碼時以最小 id 為準
+                    rows = conn.execute(
+                        "SELECT barcode, id FROM products WHERE barcode != '' ORDER BY id DESC")
+                    _barcode_map = {row[0]: row[1] for row in rows}
+    return _barcode_map
+
+
+def _current_barcode(cursor, product_id):
+    row = cursor.execute("SELECT barcode FROM products WHERE id = ?", (product_id,)).fetchone()
+    return row[0] if row else None
+
+
+def _remember_barcode(barcode, product_id):
+    if _barcode_map is not None and barcode:
+        _barcode_map.setdefault(barcode, product_id)
+
+
+def _forget_barcode(barcode):
+    if _barcode_map is not None and barcode:
+        _barcode_map.pop(barcode, None)
+
+
+def get_product(product_id):
+    """以 id 取得單一商品"""
+    with get_connection() as conn:
+        return conn.execute(_SQL_PRODUCT_BY_ID, (product_id,)).fetchone()
+
+
+def get_product_by_barcode(barcode):
+    """以條碼精確查詢商品（掃描用），找不到回傳 None"""
+    barcode = (barcode or "").strip()
+    if not barcode:
+        return None
+    barcode_map = _get_barcode_map()
+    product_id = barcode_map.get(barcode)
+    with get_connection() as conn:
+        if product_id is not None:
+            product = conn.execute(_SQL_PRODUCT_BY_ID, (product_id,)).fetchone()
+            # 其他行程可能已修改條碼，不符時改走索引查詢
+            if product is not None and product['barcode'] == barcode:
+                return product
+        product = conn.execute(_SQL_PRODUCT_BY_BARCODE, (barcode,)).fetchone()
+    if product is not None:
+        barcode_map[barcode] = product['id']
+    else:
+        barcode_map.pop(barcode, None)
+    return product
+
+
+def get_products_by_barcodes(barcodes):
+    """以單一查詢取得多個條碼的商品（連續掃描用），回傳 {條碼: 商品}；找不到的條碼不在結果中"""
+    codes = sorted({code.strip() for code in barcodes if code and code.strip()})
+    if not codes:
+        return {}
+    with get_connection() as conn:
+        rows = conn.execute(_SQL_PRODUCTS_BY_BARCODES, (json.dumps(codes),)).fetchall()
+    return {row['barcode']: row for row in rows}
 
 
 # ---------- 會員 ----------
 
+# 即時查詢回傳的會員數上限
+MEMBER_SEARCH_LIMIT = 10
+
+_MEMBER_COLUMNS = ("id, name, phone, email, COALESCE(points, 0) as points, "
+                   "COALESCE(total_spent, 0) as total_spent, created_at")
+
+# 開頭比對一律改寫成索引範圍查詢（LIKE 在預設大小寫設定下無法使用索引）
+# 與會員列表相同的欄位，不含索引用的 phone_reversed
+_SQL_MEMBERS_BY_PHONE_PREFIX = _hot_query("search_members(phone)", f"""
+    SELECT {_MEMBER_COLUMNS} FROM members WHERE phone >= ? AND phone < ? ORDER BY phone LIMIT ?""")
+_SQL_MEMBERS_BY_PHONE_SUFFIX = _hot_query("search_members(phone suffix)", f"""
+    SELECT {_MEMBER_COLUMNS} FROM members
+    WHERE phone_reversed >= ? AND phone_reversed < ? ORDER BY phone_reversed LIMIT ?""")
+_SQL_MEMBERS_BY_NAME_PREFIX = _hot_query("search_members(name)", f"""
+    SELECT {_MEMBER_COLUMNS} FROM members WHERE name >= ? AND name < ? ORDER BY name, id LIMIT ?""")
+_SQL_MEMBER_PAGE = _hot_query("get_members_page", f"""
+    SELECT {_MEMBER_COLUMNS} FROM members WHERE id > ? ORDER BY id LIMIT ?""")
+
+
+def _prefix_range(prefix):
+    """以 prefix 開頭的字串範圍 [下限, 上限)（BINARY 排序）"""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+@_cached("members")
 def get_members():
-    conn = get_connection()
-    cursor = conn.cursor()
-    # 確保 total_spent 為 0 而不是 NULL
-    cursor.execute("SELECT id, name, phone, email, COALESCE(points, 0) as points, COALESCE(total_spent, 0) as total_spent, created_at FROM members")
-    members = cursor.fetchall()
-    conn.close()
-    return members
+    with get_connection() as conn:
+        # 確保 total_spent 為 0 而不是 NULL
+        return conn.execute(f"SELECT {_MEMBER_COLUMNS} FROM members").fetchall()
+
+
+@_cached("members")
+def get_members_page(after=None, page_size=PAGE_SIZE):
+    """以 id keyset 分頁取得會員，回傳 (會員列表, 下一頁 cursor)，最後一頁時 cursor 為 None"""
+    with get_connection() as conn:
+        rows = conn.execute(_SQL_MEMBER_PAGE, (after or 0, page_size + 1)).fetchall()
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, rows[-1]['id']
+
+
+@_cached("members")
+def count_members():
+    with get_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM members").fetchone()[0]
+
+
+@_cached("members")
+def search_members(query, limit=MEMBER_SEARCH_LIMIT):
+    """會員即時查詢：數字依電話開頭、再依電話末碼比對，其他依姓名開頭比對
+
+    電話開頭相符者依電話排序，完全相符的電話一定排第一。
+    """
+    query = query.strip()
+    if not query:
+        return []
+    with get_connection() as conn:
+        if not query.isdigit():
+            return conn.execute(_SQL_MEMBERS_BY_NAME_PREFIX, (*_prefix_range(query), limit)).fetchall()
+        rows = conn.execute(_SQL_MEMBERS_BY_PHONE_PREFIX, (*_prefix_range(query), limit)).fetchall()
+        if len(rows) < limit:
+            seen = {row['id'] for row in rows}
+            suffix = conn.execute(_SQL_MEMBERS_BY_PHONE_SUFFIX, (*_prefix_range(query[::-1]), limit)).fetchall()
+            rows += [row for row in suffix if row['id'] not in seen][:limit - len(rows)]
+        return rows
 
 
 def add_member(name, phone, email=""):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO members VALUES (NULL, ?, ?, ?, 0, 0, CURRENT_TIMESTAMP)", (name, phone, email))
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute("""
+            INSERT INTO members (name, phone, email, points, total_spent, created_at, phone_reversed)
+            VALUES (?, ?, ?, 0, 0, CURRENT_TIMESTAMP, ?)""", (name, phone, email, phone[::-1]))
+    _bump("members")
+
+
+_SQL_MEMBER_BY_PHONE = _hot_query("get_member_by_phone", f"SELECT {_MEMBER_COLUMNS} FROM members WHERE phone = ?")
 
 
 def get_member_by_phone(phone):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM members WHERE phone = ?", (phone,))
-    member = cursor.fetchone()
-    conn.close()
-    return member
+    with get_connection() as conn:
+        return conn.execute(_SQL_MEMBER_BY_PHONE, (phone,)).fetchone()
+
+
+# ---------- 批次匯入 ----------
+
+# 依條碼 upsert；空白條碼不在唯一索引內，一律新增
+_SQL_UPSERT_PRODUCT = """
+    INSERT INTO products (name, price_ex_tax, price_inc_tax, cost, stock, barcode, category, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(barcode) WHERE barcode != '' DO UPDATE SET
+        name = excluded.name, price_ex_tax = excluded.price_ex_tax, price_inc_tax = excluded.price_inc_tax,
+        cost = excluded.cost, stock = excluded.stock, category = excluded.category"""
+
+# 舊資料庫條碼有重複（沒有唯一索引）時，改以 UPDATE + 條件 INSERT 達成 upsert
+_SQL_UPDATE_PRODUCT_BY_BARCODE = """
+    UPDATE products SET name = ?, price_ex_tax = ?, price_inc_tax = ?, cost = ?, stock = ?, category = ?
+    WHERE barcode = ? AND barcode != ''"""
+_SQL_INSERT_PRODUCT_IF_NEW = """
+    INSERT INTO products (name, price_ex_tax, price_inc_tax, cost, stock, barcode, category, created_at)
+    SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7, CURRENT_TIMESTAMP
+    WHERE ?6 = '' OR NOT EXISTS (SELECT 1 FROM products WHERE barcode = ?6 AND barcode != '')"""
+
+_SQL_UPSERT_MEMBER = """
+    INSERT INTO members (name, phone, email, points, total_spent, created_at, phone_reversed)
+    VALUES (?, ?, ?, 0, 0, CURRENT_TIMESTAMP, ?)
+    ON CONFLICT(phone) DO UPDATE SET name = excluded.name, email = excluded.email"""
+
+
+def _barcode_index_unique(cursor):
+    for row in cursor.execute("PRAGMA index_list(products)").fetchall():
+        if row['name'] == 'idx_products_barcode':
+            return bool(row['unique'])
+    return False
+
+
+def _executemany_reporting(cursor, statements, rows):
+    """整批 executemany；失敗時以 SAVEPOINT 逐筆重試找出問題列，回傳 [(索引, 錯誤訊息)]"""
+    cursor.execute("SAVEPOINT bulk")
+    try:
+        for sql, make_params in statements:
+            cursor.executemany(sql, map(make_params, rows))
+        cursor.execute("RELEASE bulk")
+        return []
+    except sqlite3.Error:
+        cursor.execute("ROLLBACK TO bulk")
+    errors = []
+    for i, row in enumerate(rows):
+        cursor.execute("SAVEPOINT bulk_row")
+        try:
+            for sql, make_params in statements:
+                cursor.execute(sql, make_params(row))
+        except sqlite3.Error as e:
+            cursor.execute("ROLLBACK TO bulk_row")
+            errors.append((i, str(e)))
+        cursor.execute("RELEASE bulk_row")
+    cursor.execute("RELEASE bulk")
+    return errors
+
+
+def _bulk_write(batches, statements, finish=None):
+    """在單一交易中寫入所有批次；batches 逐批產生 [(列號, 參數), ...]，finish(cursor) 於提交前執行"""
+    imported = 0
+    errors = []
+    with transaction() as cursor:
+        if callable(statements):
+            statements = statements(cursor)
+        for batch in batches:
+            params = [row for _, row in batch]
+            failed = _executemany_reporting(cursor, statements, params)
+            imported += len(batch) - len(failed)
+            errors.extend((batch[i][0], message) for i, message in failed)
+        if finish is not None:
+            finish(cursor)
+    return imported, errors
+
+
+def _product_upsert_statements(cursor):
+    if _barcode_index_unique(cursor):
+        return [(_SQL_UPSERT_PRODUCT, lambda row: row)]
+    return [
+        (_SQL_UPDATE_PRODUCT_BY_BARCODE, lambda row: row[:5] + (row[6], row[5])),
+        (_SQL_INSERT_PRODUCT_IF_NEW, lambda row: row),
+    ]
+
+
+def bulk_upsert_products(batches):
+    """批次匯入商品（依條碼更新既有商品）
+
+    batches 逐批產生 [(列號, (名稱, 未稅價, 含稅價, 成本, 庫存, 條碼, 類別)), ...]，
+    全部在同一個交易中寫入；回傳 (成功筆數, [(列號, 錯誤訊息), ...])。
+    """
+    global _barcode_map
+    try:
+        # 匯入直接覆寫庫存，提交前為有變動的商品補記調整
+        return _bulk_write(batches, _product_upsert_statements,
+                           finish=lambda cursor: _reconcile_stock_ledger(cursor, "匯入"))
+    finally:
+        # 大量異動後直接重建條碼表
+        _barcode_map = None
+        _bump("products")
+
+
+def bulk_upsert_members(batches):
+    """批次匯入會員（依電話更新既有會員），參數格式同 bulk_upsert_products，欄位為 (姓名, 電話, Email)"""
+    try:
+        return _bulk_write(batches, [(_SQL_UPSERT_MEMBER, lambda row: (*row, row[1][::-1]))])
+    finally:
+        _bump("members")
 
 
 # ---------- 銷售 ----------
 
-def create_sale(member_id, subtotal, discount, total, cash, change_amount, items=None):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO sales VALUES (NULL, ?, ?, ?, ?, ?, ?, 'cash', CURRENT_TIMESTAMP)", 
-        (member_id, subtotal, discount, total, cash, change_amount))
+class InsufficientStockError(Exception):
+    """庫存不足，整筆銷售已回滾；shortages 為 [(product_id, 商品名稱, 需求數量, 現有庫存), ...]"""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        names = "、".join(f"{name}（需要 {need}，庫存 {stock}）" for _, name, need, stock in shortages)
+        super().__init__(f"庫存不足：{names}")
+
+
+_SQL_SALE_BY_KEY = _hot_query("create_sale(idempotency_key)", "SELECT id FROM sales WHERE idempotency_key = ?")
+
+# created_at 未指定時為目前時間；結帳日誌回放時帶結帳當下的時間
+_SQL_INSERT_SALE = """
+    INSERT INTO sales (member_id, subtotal, discount, total, cash, change_amount, payment_method, created_at, idempotency_key)
+    VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)"""
+
+_SQL_INSERT_SALE_ITEM = """
+    INSERT INTO sale_items (sale_id, product_id, product_name, quantity, unit_price, subtotal)
+    VALUES (?, ?, ?, ?, ?, ?)"""
+
+# 庫存足夠才扣減；rowcount 少於品項數代表有商品庫存不足
+_SQL_DECREMENT_STOCK = _hot_query("create_sale(stock)", """
+    UPDATE products SET stock = COALESCE(stock, 0) - ? WHERE id = ? AND COALESCE(stock, 0) >= ?""")
+_SQL_DECREMENT_STOCK_UNCHECKED = _hot_query("apply_sales(stock)", """
+    UPDATE products SET stock = COALESCE(stock, 0) - ? WHERE id = ?""")
+# 商品 id 以 JSON 陣列傳入，固定的 SQL 才能登記為熱路徑查詢
+_SQL_CHECK_STOCK = _hot_query("create_sale(check_stock)", """
+    SELECT id, COALESCE(stock, 0) FROM products WHERE id IN (SELECT value FROM json_each(?))""")
+_SQL_ADD_MEMBER_SPENT = _hot_query("create_sale(member)", """
+    UPDATE members SET total_spent = COALESCE(total_spent, 0) + ? WHERE id = ?""")
+
+
+def _check_stock(cursor, quantities, names):
+    stock = dict(cursor.execute(_SQL_CHECK_STOCK, (json.dumps(list(quantities)),)).fetchall())
+    return [(pid, names[pid], need, stock.get(pid, 0)) for pid, need in quantities.items() if stock.get(pid, 0) < need]
+
+
+def _insert_sale(cursor, member_id, subtotal, discount, total, cash, change_amount, items,
+                 idempotency_key=None, payment_method='cash', enforce_stock=True, created_at=None):
+    """在呼叫端的交易中寫入一筆銷售，回傳 sale_id；相同 idempotency_key 只會寫入一次"""
+    if idempotency_key:
+        existing = cursor.execute(_SQL_SALE_BY_KEY, (idempotency_key,)).fetchone()
+        if existing:
+            return existing[0]
+    items = items or []
+    quantities = {}
+    names = {}
+    for item in items:
+        quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+        names[item['product_id']] = item['name']
+    if enforce_stock and quantities:
+        shortages = _check_stock(cursor, quantities, names)
+        if shortages:
+            raise InsufficientStockError(shortages)
+
+    cursor.execute(_SQL_INSERT_SALE, (member_id, subtotal, discount, total, cash, change_amount,
+                                      payment_method, created_at, idempotency_key))
     sale_id = cursor.lastrowid
-    if items:
-        for item in items:
-            cursor.execute("INSERT INTO sale_items VALUES (NULL, ?, ?, ?, ?, ?, ?)", 
-                (sale_id, item['product_id'], item['name'], item['quantity'], item['price'], item['subtotal']))
-            cursor.execute("UPDATE products SET stock = stock - ? WHERE id=?", (item['quantity'], item['product_id']))
+    cursor.executemany(_SQL_INSERT_SALE_ITEM, [
+        (sale_id, item['product_id'], item['name'], item['quantity'], item['price'], item['subtotal'])
+        for item in items])
+    if enforce_stock:
+        cursor.executemany(_SQL_DECREMENT_STOCK, [(qty, pid, qty) for pid, qty in quantities.items()])
+        if cursor.rowcount < len(quantities):
+            raise InsufficientStockError(_check_stock(cursor, quantities, names))
+    else:
+        cursor.executemany(_SQL_DECREMENT_STOCK_UNCHECKED, [(qty, pid) for pid, qty in quantities.items()])
+    # 庫存帳依寫入順序記錄餘額，回放的銷售以寫入時間記帳
+    _record_movements(cursor, "sale", [(pid, -qty) for pid, qty in quantities.items()], sale_id)
     # 更新會員總消費
     if member_id:
-        cursor.execute("UPDATE members SET total_spent = total_spent + ? WHERE id=?", (total, member_id))
-    conn.commit()
-    conn.close()
+        cursor.execute(_SQL_ADD_MEMBER_SPENT, (total, member_id))
+    _add_to_daily_summary(cursor, sale_id, sum(quantities.values()))
+    return sale_id
+
+
+def create_sale(member_id, subtotal, discount, total, cash, change_amount, items=None,
+                idempotency_key=None, payment_method='cash'):
+    """以單一 IMMEDIATE 交易完成結帳
+
+    任一商品庫存不足時整筆回滾並拋出 InsufficientStockError；
+    帶相同 idempotency_key 重複呼叫（例如連點結帳）只會記錄一次，並回傳同一個 sale_id。
+    """
+    with transaction() as cursor:
+        sale_id = _insert_sale(cursor, member_id, subtotal, discount, total, cash, change_amount, items,
+                               idempotency_key, payment_method)
+    # 銷售會扣庫存並累計會員消費
+    _bump("sales", "products", "members")
     return sale_id
 
 
+def apply_sales(sales):
+    """在單一交易中寫入多筆銷售（供離線日誌回放），回傳 sale_id 清單
+
+    sales 為 create_sale 參數的 dict（可另帶 created_at）；已寫入過的 idempotency_key 不會重複記錄。
+    商品已交給顧客，因此不檢查庫存（可能出現負庫存）。
+    """
+    with transaction() as cursor:
+        sale_ids = [_insert_sale(cursor, enforce_stock=False, **sale) for sale in sales]
+    _bump("sales", "products", "members")
+    return sale_ids
+
+
+_SQL_SALES = _hot_query("get_sales", """
+    SELECT s.id, s.member_id, s.subtotal, s.discount, s.total, s.cash, s.change_amount, s.payment_method, s.created_at, m.name
+    FROM sales s LEFT JOIN members m ON s.member_id = m.id ORDER BY s.created_at DESC""")
+
+
+@_cached("sales", "members")
 def get_sales():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT s.*, m.name FROM sales s LEFT JOIN members m ON s.member_id = m.id ORDER BY s.created_at DESC")
-    sales = cursor.fetchall()
-    conn.close()
-    return sales
+    with get_connection() as conn:
+        return conn.execute(_SQL_SALES).fetchall()
+
+
+# ---------- 庫存異動 ----------
+
+# 異動類型；quantity 為帶正負號的數量變化
+STOCK_MOVEMENT_KINDS = {"sale": "銷售", "receipt": "進貨", "adjustment": "調整", "return": "退貨"}
+
+# products.stock 即為即時在庫量（在同一交易中增量維護），異動後的值記為 balance_after
+_SQL_RECORD_MOVEMENT = _hot_query("record_movement", """
+    INSERT INTO stock_movements (product_id, kind, quantity, balance_after, sale_id, note, created_at)
+    SELECT id, ?, ?, COALESCE(stock, 0), ?, ?, CURRENT_TIMESTAMP FROM products WHERE id = ?""")
+
+_SQL_STOCK_AT = _hot_query("get_stock_at", """
+    SELECT balance_after FROM stock_movements
+    WHERE product_id = ? AND created_at <= ? ORDER BY created_at DESC, id DESC LIMIT 1""")
+
+_SQL_STOCK_MOVEMENTS = _hot_query("get_stock_movements", """
+    SELECT id, product_id, kind, quantity, balance_after, sale_id, note, created_at FROM stock_movements
+    WHERE product_id = ? ORDER BY created_at DESC, id DESC LIMIT ?""")
+
+# 每個商品以索引找出時點前最後一筆異動；成本為目前成本
+# 子查詢只回傳異動 id 並放在 JOIN 條件中，每個商品只執行一次
+# （放在欄位中會被攤平到篩選、庫存與金額，每個商品執行三次）
+_SQL_INVENTORY_AT = """
+    SELECT p.id, p.name, p.category, p.cost, m.balance_after AS stock, m.balance_after * COALESCE(p.cost, 0) AS value
+    FROM products p
+    JOIN stock_movements m ON m.id = (
+        SELECT id FROM stock_movements
+        WHERE product_id = p.id AND created_at <= ?
+        ORDER BY created_at DESC, id DESC LIMIT 1)
+    WHERE m.balance_after != 0 ORDER BY p.id"""
+
+
+def _record_movements(cursor, kind, changes, sale_id=None, note=None):
+    """在呼叫端的交易中記錄異動；changes 為 [(product_id, 數量變化), ...]，庫存須已先更新"""
+    cursor.executemany(_SQL_RECORD_MOVEMENT, [(kind, qty, sale_id, note, pid) for pid, qty in changes])
+
+
+def _reconcile_stock_ledger(cursor, note):
+    """為庫存與帳上最後餘額不符的商品補記調整（以 SQL 直接改動庫存後使用）"""
+    cursor.execute("""
+        INSERT INTO stock_movements (product_id, kind, quantity, balance_after, note, created_at)
+        SELECT p.id, 'adjustment', COALESCE(p.stock, 0) - COALESCE(m.balance_after, 0), COALESCE(p.stock, 0),
+               ?, CURRENT_TIMESTAMP
+        FROM products p
+        LEFT JOIN stock_movements m ON m.id = (SELECT MAX(id) FROM stock_movements WHERE product_id = p.id)
+        WHERE COALESCE(p.stock, 0) != COALESCE(m.balance_after, 0)""", (note,))
+
+
+def _end_of_day(at):
+    # 只給日期時包含當天所有異動
+    return f"{at} 23:59:59" if len(at) == 10 else at
+
+
+def record_stock_movement(product_id, kind, quantity, note="", sale_id=None):
+    """記錄進貨 / 調整 / 退貨並更新庫存，回傳異動後的庫存；銷售由 create_sale 記錄"""
+    if kind not in STOCK_MOVEMENT_KINDS or kind == "sale":
+        raise ValueError(f"不支援的庫存異動類型：{kind}")
+    if kind != "adjustment" and quantity <= 0:
+        raise ValueError("進貨與退貨數量必須大於 0")
+    with transaction() as cursor:
+        cursor.execute("UPDATE products SET stock = COALESCE(stock, 0) + ? WHERE id = ?", (quantity, product_id))
+        if cursor.rowcount == 0:
+            raise ValueError("找不到商品")
+        _record_movements(cursor, kind, [(product_id, quantity)], sale_id, note or None)
+        balance = cursor.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+    _bump("products")
+    return balance
+
+
+def get_stock_movements(product_id, limit=50):
+    """商品最近的庫存異動（新到舊）"""
+    with get_connection() as conn:
+        return conn.execute(_SQL_STOCK_MOVEMENTS, (product_id, limit)).fetchall()
+
+
+def get_stock_at(product_id, at):
+    """商品在 at（'YYYY-MM-DD' 當天結束，或 'YYYY-MM-DD HH:MM:SS'）時的庫存"""
+    with get_connection() as conn:
+        row = conn.execute(_SQL_STOCK_AT, (product_id, _end_of_day(at))).fetchone()
+    return row[0] if row else 0
+
+
+def get_inventory_valuation(at):
+    """at 時點的庫存估值：[(id, 名稱, 類別, 成本, 庫存, 金額), ...]，金額以目前成本計算"""
+    with get_connection() as conn:
+        return conn.execute(_SQL_INVENTORY_AT, (_end_of_day(at),)).fetchall()
+
+
+# ---------- 每日彙總 ----------
+
+# 日期取自銷售紀錄本身，跨午夜的交易也會計入正確的日期
+_SQL_ADD_DAILY_SUMMARY = _hot_query("create_sale(daily_summary)", """
+    INSERT INTO daily_sales_summary (day, payment_method, orders, revenue, discount, items)
+    SELECT date(created_at), COALESCE(payment_method, 'cash'), 1, COALESCE(total, 0), COALESCE(discount, 0), ?
+    FROM sales WHERE id = ?
+    ON CONFLICT(day, payment_method) DO UPDATE SET
+        orders = orders + 1,
+        revenue = revenue + excluded.revenue,
+        discount = discount + excluded.discount,
+        items = items + excluded.items""")
+
+_SQL_DAILY_SALES = _hot_query("get_daily_sales", """
+    SELECT SUM(orders), SUM(revenue), SUM(discount), SUM(items)
+    FROM daily_sales_summary WHERE day = COALESCE(?, date('now'))""")
+
+_SQL_DAILY_TREND = _hot_query("get_daily_sales_trend", """
+    SELECT day, SUM(orders) AS orders, SUM(revenue) AS revenue, SUM(discount) AS discount, SUM(items) AS items
+    FROM daily_sales_summary WHERE day >= ? AND day <= ?
+    GROUP BY day ORDER BY day""")
+
+
+def _add_to_daily_summary(cursor, sale_id, items):
+    cursor.execute(_SQL_ADD_DAILY_SUMMARY, (items, sale_id))
+
+
+def _rebuild_daily_sales_summary(cursor, start=None):
+    if start:
+        cursor.execute("DELETE FROM daily_sales_summary WHERE day >= ?", (start,))
+    else:
+        cursor.execute("DELETE FROM daily_sales_summary")
+    cursor.execute("""
+        INSERT INTO daily_sales_summary (day, payment_method, orders, revenue, discount, items)
+        SELECT date(s.created_at), COALESCE(s.payment_method, 'cash'), COUNT(*),
+               COALESCE(SUM(s.total), 0), COALESCE(SUM(s.discount), 0), COALESCE(SUM(i.quantity), 0)
+        FROM sales s
+        LEFT JOIN (SELECT sale_id, SUM(quantity) AS quantity FROM sale_items GROUP BY sale_id) i ON i.sale_id = s.id
+        WHERE s.created_at >= ?
+        GROUP BY 1, 2
+    """, (start or "",))
+
+
+def rebuild_daily_sales_summary(start=None):
+    """由銷售明細重建每日彙總；start（'YYYY-MM-DD'）為空時重建全部
+
+    已封存月份的銷售不在 pos.db 中，這些日期的彙總保留不動。
+    """
+    with transaction() as cursor:
+        floor = _archived_through(cursor)
+        if floor and (not start or start < floor):
+            start = floor
+        _rebuild_daily_sales_summary(cursor, start)
+    _bump("sales")
+
+
+@_cached("sales")
+def get_daily_sales(day=None):
+    """取得當日（或指定日期）營收統計，由每日彙總表讀取"""
+    with get_connection() as conn:
+        result = conn.execute(_SQL_DAILY_SALES, (day,)).fetchone()
+    return {'orders': result[0] or 0, 'revenue': result[1] or 0, 'discount': result[2] or 0, 'items': result[3] or 0}
+
+
+@_cached("sales")
+def get_daily_sales_trend(start="", end="9999-12-31"):
+    """取得日期區間內的每日營收（day, orders, revenue, discount, items）"""
+    with get_connection() as conn:
+        return conn.execute(_SQL_DAILY_TREND, (start, end)).fetchall()
+
 
+# ---------- 封存 ----------
 
-def get_daily_sales():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*), SUM(total), SUM(discount) FROM sales WHERE date(created_at) = date('now')")
-    result = cursor.fetchone()
-    conn.close()
-    return {'orders': result[0] or 0, 'revenue': result[1] or 0}
+# 封存檔目錄（相對於資料庫所在目錄），每月一個檔案
+ARCHIVE_DIR = "archive"
+ARCHIVE_BATCH_SIZE = 5000
+# SQLite 預設最多同時 ATTACH 10 個資料庫，保留餘裕
+MAX_ATTACHED_ARCHIVES = 8
+
+_SALE_COLUMNS = ("id, member_id, subtotal, discount, total, cash, change_amount, payment_method, created_at, "
+                 "idempotency_key")
+_SALE_ITEM_COLUMNS = "id, sale_id, product_id, product_name, quantity, unit_price, subtotal"
+
+_ARCHIVE_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS archive.sales (
+        id INTEGER PRIMARY KEY, member_id INTEGER, subtotal REAL, discount REAL, total REAL, cash REAL,
+        change_amount REAL, payment_method TEXT, created_at TIMESTAMP, idempotency_key TEXT)""",
+    """CREATE TABLE IF NOT EXISTS archive.sale_items (
+        id INTEGER PRIMARY KEY, sale_id INTEGER, product_id INTEGER, product_name TEXT,
+        quantity INTEGER, unit_price REAL, subtotal REAL)""",
+    "CREATE INDEX IF NOT EXISTS archive.idx_sales_created_at ON sales(created_at)",
+    "CREATE INDEX IF NOT EXISTS archive.idx_sale_items_sale ON sale_items(sale_id)",
+)
+
+
+def _archive_file(month):
+    return os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), ARCHIVE_DIR, f"sales-{month}.db")
+
+
+def _archived_through(cursor):
+    """最後一個封存月份的隔月第一天（'YYYY-MM-DD'），沒有封存時回傳 None"""
+    row = cursor.execute("SELECT date(MAX(month) || '-01', '+1 month') FROM sales_archives").fetchone()
+    return row[0]
+
+
+def get_archives():
+    """已封存的月份：[(月份, 檔名, 銷售筆數, 明細筆數, 封存時間), ...]"""
+    with get_connection() as conn:
+        return conn.execute("SELECT month, file, sales, items, archived_at FROM sales_archives ORDER BY month").fetchall()
+
+
+def count_archivable_sales(keep_months=3):
+    """archive_sales(keep_months) 會搬移的銷售筆數（估計，不含保留的最大 id）"""
+    with get_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM sales WHERE created_at < date('now', 'start of month', ?)",
+                            (f"-{max(keep_months, 1) - 1} months",)).fetchone()[0]
+
+
+def _archive_month(month, batch_size, progress=None):
+    """分批把一個月份的銷售與明細搬到封存檔，回傳搬移的銷售筆數
+
+    每批先在封存檔提交複本，再從 pos.db 刪除已確認存在於封存檔的資料列；
+    兩步驟之間當機時資料只會重複不會遺失，重新執行即可接續。
+    """
+    path = _archive_file(month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    moved = 0
+    with get_connection() as conn:
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        try:
+            # 封存檔的複本必須先落盤，之後才能刪除原始資料
+            conn.execute("PRAGMA archive.synchronous = FULL")
+            for sql in _ARCHIVE_SCHEMA:
+                conn.execute(sql)
+            start, end = conn.execute("SELECT ?, date(?, '+1 month')", (f"{month}-01", f"{month}-01")).fetchone()
+            after = 0
+            while True:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # 不封存 id 最大的銷售與明細：INTEGER PRIMARY KEY 以最大 id + 1 配號，
+                    # 保留它們才不會讓新銷售重用已封存的 id
+                    keep = conn.execute("""
+                        SELECT (SELECT MAX(id) FROM main.sales),
+                               (SELECT sale_id FROM main.sale_items ORDER BY id DESC LIMIT 1)""").fetchone()
+                    last = conn.execute("""
+                        SELECT MAX(id) FROM (SELECT id FROM main.sales
+                        WHERE created_at >= ? AND created_at < ? AND id > ? ORDER BY id LIMIT ?)""",
+                        (start, end, after, batch_size)).fetchone()[0]
+                    if last is None:
+                        conn.execute("COMMIT")
+                        break
+                    conn.execute(f"""
+                        INSERT OR IGNORE INTO archive.sales ({_SALE_COLUMNS})
+                        SELECT {_SALE_COLUMNS} FROM main.sales
+                        WHERE created_at >= ? AND created_at < ? AND id > ? AND id <= ?
+                          AND id NOT IN (?, ?)""", (start, end, after, last, keep[0], keep[1] or 0))
+                    conn.execute(f"""
+                        INSERT OR IGNORE INTO archive.sale_items ({_SALE_ITEM_COLUMNS})
+                        SELECT {_SALE_ITEM_COLUMNS} FROM main.sale_items
+                        WHERE sale_id IN (SELECT id FROM archive.sales WHERE id > ? AND id <= ?)""", (after, last))
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.rollback()
+                    raise
+                # 只刪除已在封存檔中的資料列
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute("""
+                        DELETE FROM main.sale_items WHERE id IN (
+                            SELECT i.id FROM archive.sale_items i JOIN archive.sales s ON s.id = i.sale_id
+                            WHERE s.id > ? AND s.id <= ?)""", (after, last))
+                    cursor = conn.execute("""
+                        DELETE FROM main.sales WHERE id IN (SELECT id FROM archive.sales WHERE id > ? AND id <= ?)""",
+                        (after, last))
+                    moved += cursor.rowcount
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.rollback()
+                    raise
+                after = last
+                if progress:
+                    progress(month, moved)
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("""
+                INSERT INTO sales_archives (month, file, sales, items, archived_at)
+                VALUES (?, ?, (SELECT COUNT(*) FROM archive.sales), (SELECT COUNT(*) FROM archive.sale_items),
+                        CURRENT_TIMESTAMP)
+                ON CONFLICT(month) DO UPDATE SET
+                    sales = excluded.sales, items = excluded.items, archived_at = excluded.archived_at""",
+                (month, os.path.basename(path)))
+            conn.execute("COMMIT")
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute("DETACH DATABASE archive")
+    return moved
+
+
+def archive_sales(keep_months=3, batch_size=ARCHIVE_BATCH_SIZE, progress=None):
+    """把最近 keep_months 個月（含本月）以前的銷售與明細搬到每月封存檔，回傳 {月份: 搬移筆數}
+
+    每日彙總與庫存異動帳留在 pos.db，報表與估值不受影響；progress(月份, 已搬移筆數) 於每批後呼叫。
+    """
+    with get_connection() as conn:
+        months = [row[0] for row in conn.execute("""
+            SELECT DISTINCT substr(created_at, 1, 7) FROM sales
+            WHERE created_at < date('now', 'start of month', ?) ORDER BY 1""",
+            (f"-{max(keep_months, 1) - 1} months",))]
+    moved = {}
+    try:
+        for month in months:
+            moved[month] = _archive_month(month, batch_size, progress)
+    finally:
+        _bump("sales")
+    return moved
+
+
+@contextmanager
+def archive_view(months):
+    """借出連線並 ATTACH 指定月份的封存檔，建立 all_sales / all_sale_items 聯集檢視
+
+    檢視合併 pos.db 與封存檔；封存途中兩邊暫時重複的資料列以 pos.db 為準。
+    """
+    if len(months) > MAX_ATTACHED_ARCHIVES:
+        raise ValueError(f"一次最多 ATTACH {MAX_ATTACHED_ARCHIVES} 個封存檔")
+    with get_connection() as conn:
+        aliases = []
+        try:
+            for month in months:
+                path = _archive_file(month)
+                # ATTACH 不存在的檔案會建立空資料庫，先確認檔案還在
+                if not os.path.exists(path):
+                    raise FileNotFoundError(f"找不到封存檔：{path}")
+                alias = f"archive_{len(aliases)}"
+                conn.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+                aliases.append(alias)
+            sales = [f"SELECT {_SALE_COLUMNS} FROM main.sales"] + [
+                f"SELECT {_SALE_COLUMNS} FROM {alias}.sales a WHERE NOT EXISTS (SELECT 1 FROM main.sales WHERE id = a.id)"
+                for alias in aliases]
+            items = [f"SELECT {_SALE_ITEM_COLUMNS} FROM main.sale_items"] + [
+                f"SELECT {_SALE_ITEM_COLUMNS} FROM {alias}.sale_items a "
+                f"WHERE NOT EXISTS (SELECT 1 FROM main.sale_items WHERE id = a.id)"
+                for alias in aliases]
+            conn.execute("CREATE TEMP VIEW all_sales AS " + " UNION ALL ".join(sales))
+            conn.execute("CREATE TEMP VIEW all_sale_items AS " + " UNION ALL ".join(items))
+            yield conn
+        finally:
+            conn.execute("DROP VIEW IF EXISTS temp.all_sales")
+            conn.execute("DROP VIEW IF EXISTS temp.all_sale_items")
+            for alias in aliases:
+                conn.execute(f"DETACH DATABASE {alias}")
+
+
+def _archived_months(conn, start, end):
+    """日期區間（'YYYY-MM-DD'，可為 None）涵蓋的已封存月份"""
+    return [row[0] for row in conn.execute(
+        "SELECT month FROM sales_archives WHERE month >= ? AND month <= ? ORDER BY month",
+        ((start or "")[:7], (end or "9999-12")[:7]))]
+
+
+def _archive_windows(start, end):
+    """依需要的封存月份把日期區間切成多段，回傳 [(封存月份清單, 起日, 迄日(不含)), ...]
+
+    每段最多 MAX_ATTACHED_ARCHIVES 個月份，依時間先後排列；最後一個封存月份之後的區間
+    另成一段且不需 ATTACH。
+    """
+    end_exclusive = None
+    with get_connection() as conn:
+        if end:
+            end_exclusive = conn.execute("SELECT date(?, '+1 day')", (end,)).fetchone()[0]
+        months = _archived_months(conn, start, end)
+    windows = []
+    low = start
+    for i in range(0, len(months), MAX_ATTACHED_ARCHIVES):
+        chunk = months[i:i + MAX_ATTACHED_ARCHIVES]
+        # 以分段最後一個封存月份的隔月第一天為界
+        year, month = map(int, chunk[-1].split("-"))
+        high = f"{year + month // 12:04d}-{month % 12 + 1:02d}-01"
+        if end_exclusive and end_exclusive < high:
+            high = end_exclusive
+        windows.append((chunk, low, high))
+        low = high
+    if not windows or end_exclusive is None or low < end_exclusive:
+        windows.append(([], low, end_exclusive))
+    return windows
+
+
+@contextmanager
+def _sales_tables(months):
+    """借出連線，回傳 (連線, 銷售表, 明細表)；有封存月份時為 ATTACH 後的聯集檢視"""
+    if months:
+        with archive_view(months) as conn:
+            yield conn, "all_sales", "all_sale_items"
+    else:
+        with get_connection() as conn:
+            yield conn, "sales", "sale_items"
+
+
+def _window_conditions(column, low, high):
+    conditions = []
+    params = []
+    if low:
+        conditions.append(f"{column} >= ?")
+        params.append(low)
+    if high:
+        conditions.append(f"{column} < ?")
+        params.append(high)
+    return conditions, params
+
+
+# ---------- 銷售查詢 ----------
+
+SALES_PAGE_SIZE = 50
+
+_SALE_ROW_COLUMNS = ("s.id, s.member_id, s.subtotal, s.discount, s.total, s.cash, s.change_amount, "
+                     "s.payment_method, s.created_at, m.name")
+# 新的在前；created_at 相同時以 id 區分
+_SALES_KEYSET = "(s.created_at, s.id) < (?, ?)"
+
+
+def _sales_conditions(start, end, member_id, payment_method, min_total, max_total):
+    """銷售篩選條件，回傳 (條件清單, 參數清單)；日期為 'YYYY-MM-DD'（含當日）"""
+    conditions = []
+    params = []
+    for condition, value in (
+            ("s.created_at >= ?", start),
+            ("s.created_at < date(?, '+1 day')", end),
+            ("s.member_id = ?", member_id),
+            # 與每日彙總相同，未記錄付款方式的舊銷售視為現金
+            ("COALESCE(s.payment_method, 'cash') = ?", payment_method),
+            ("s.total >= ?", min_total),
+            ("s.total <= ?", max_total)):
+        if value is not None and value != "":
+            conditions.append(condition)
+            params.append(value)
+    return conditions, params
+
+
+def _sales_page_sql(table, conditions):
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    return f"""
+    SELECT {_SALE_ROW_COLUMNS} FROM {table} s LEFT JOIN members m ON s.member_id = m.id
+    {where}ORDER BY s.created_at DESC, s.id DESC LIMIT ?"""
+
+
+_hot_query("get_sales_page", _sales_page_sql(
+    "sales", ["s.created_at >= ?", "s.created_at < date(?, '+1 day')", _SALES_KEYSET]))
+_hot_query("get_sales_page(member)", _sales_page_sql("sales", ["s.member_id = ?", _SALES_KEYSET]))
+
+_SQL_SALE_ITEMS = _hot_query("get_sale_items", """
+    SELECT id, sale_id, product_id, product_name, quantity, unit_price, subtotal
+    FROM sale_items WHERE sale_id = ? ORDER BY id""")
+
+
+@_cached("sales", "members")
+def get_sales_page(start=None, end=None, member_id=None, payment_method=None, min_total=None, max_total=None,
+                   before=None, page_size=SALES_PAGE_SIZE):
+    """依條件以 (created_at, id) keyset 分頁查詢銷售，新的在前
+
+    before 為上一頁回傳的 cursor（第一頁為 None）；回傳 (銷售列表, 下一頁 cursor)，
+    已是最後一頁時 cursor 為 None。涵蓋已封存月份時由新到舊逐段 ATTACH 查詢，
+    近期的頁面只讀 pos.db。
+    """
+    conditions, params = _sales_conditions(start, end, member_id, payment_method, min_total, max_total)
+    if before is not None:
+        conditions.append(_SALES_KEYSET)
+        params.extend(before)
+    rows = []
+    for months, low, high in reversed(_archive_windows(start, end)):
+        if before is not None and low and before[0] < low:
+            # 整段都比 cursor 新
+            continue
+        bounds, bound_params = _window_conditions("s.created_at", low, high)
+        with _sales_tables(months) as (conn, sales, _):
+            rows += conn.execute(_sales_page_sql(sales, conditions + bounds),
+                                 params + bound_params + [page_size + 1 - len(rows)]).fetchall()
+        if len(rows) > page_size:
+            break
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, (rows[-1]['created_at'], rows[-1]['id'])
+
+
+@_cached("sales")
+def get_sales_summary(start=None, end=None, member_id=None, payment_method=None, min_total=None, max_total=None):
+    """篩選範圍內的 {"orders", "revenue", "discount", "average"}
+
+    只依日期與付款方式篩選時直接加總每日彙總表，成本與銷售筆數無關。
+    """
+    if member_id is None and min_total is None and max_total is None:
+        sql = """
+            SELECT COALESCE(SUM(orders), 0), COALESCE(SUM(revenue), 0), COALESCE(SUM(discount), 0)
+            FROM daily_sales_summary WHERE day >= ? AND day <= ?"""
+        params = [start or "", end or "9999-12-31"]
+        if payment_method:
+            sql += " AND payment_method = ?"
+            params.append(payment_method)
+        with get_connection() as conn:
+            orders, revenue, discount = conn.execute(sql, params).fetchone()
+    else:
+        conditions, params = _sales_conditions(start, end, member_id, payment_method, min_total, max_total)
+        orders = revenue = discount = 0
+        for months, low, high in _archive_windows(start, end):
+            bounds, bound_params = _window_conditions("s.created_at", low, high)
+            with _sales_tables(months) as (conn, sales, _):
+                row = conn.execute(f"""
+                    SELECT COUNT(*), COALESCE(SUM(s.total), 0), COALESCE(SUM(s.discount), 0)
+                    FROM {sales} s WHERE {' AND '.join(conditions + bounds)}""", params + bound_params).fetchone()
+            orders += row[0]
+            revenue += row[1]
+            discount += row[2]
+    return {"orders": orders, "revenue": revenue, "discount": discount,
+            "average": revenue / orders if orders else 0.0}
+
+
+@_cached("sales")
+def get_sale_items(sale_id, created_at=None):
+    """單筆銷售的明細；已封存的銷售需提供 created_at 才能找到所屬的封存檔"""
+    with get_connection() as conn:
+        rows = conn.execute(_SQL_SALE_ITEMS, (sale_id,)).fetchall()
+        if rows or not created_at:
+            return rows
+        months = _archived_months(conn, created_at[:10], created_at[:10])
+    if not months:
+        return rows
+    with archive_view(months) as conn:
+        return conn.execute("""
+            SELECT id, sale_id, product_id, product_name, quantity, unit_price, subtotal
+            FROM all_sale_items WHERE sale_id = ? ORDER BY id""", (sale_id,)).fetchall()
+
+
+@_cached("sales")
+def get_payment_methods():
+    """出現過的付款方式"""
+    with get_connection() as conn:
+        return [row[0] for row in conn.execute("SELECT DISTINCT payment_method FROM daily_sales_summary ORDER BY 1")]
+
+
+# ---------- 匯出 ----------
+
+EXPORT_CHUNK_SIZE = 5000
+
+# 匯出查詢：名稱 -> (SQL, 日期篩選欄位)；欄位明確列出，不受後續結構變更影響
+EXPORT_QUERIES = {
+    "products": ("""
+        SELECT id, name, price_ex_tax, price_inc_tax, cost, stock, barcode, category, created_at
+        FROM products {where} ORDER BY id""", "created_at"),
+    "members": ("""
+        SELECT id, name, phone, email, COALESCE(points, 0), COALESCE(total_spent, 0), created_at
+        FROM members {where} ORDER BY id""", "created_at"),
+    "sales": ("""
+        SELECT s.id, s.member_id, s.subtotal, s.discount, s.total, s.cash, s.change_amount,
+               s.payment_method, s.created_at, m.name
+        FROM {sales} s LEFT JOIN members m ON s.member_id = m.id {where} ORDER BY s.created_at""", "s.created_at"),
+    "sale_items": ("""
+        SELECT i.id, i.sale_id, i.product_id, i.product_name, i.quantity, i.unit_price, i.subtotal, s.created_at
+        FROM {sales} s JOIN {sale_items} i ON i.sale_id = s.id {where} ORDER BY s.created_at""", "s.created_at"),
+}
+
+
+def iter_export(name, start=None, end=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """以 fetchmany 逐批產生匯出資料列，記憶體用量與資料量無關
+
+    start / end 為 'YYYY-MM-DD'（含當日），僅篩選建立時間。
+    銷售與明細的日期區間涵蓋已封存月份時，透過 ATTACH 的聯集檢視一併讀取。
+    """
+    sql, date_column = EXPORT_QUERIES[name]
+    if "{sales}" in sql:
+        windows = _archive_windows(start, end)
+    else:
+        windows = [([], start, None)]
+        if end:
+            with get_connection() as conn:
+                windows = [([], start, conn.execute("SELECT date(?, '+1 day')", (end,)).fetchone()[0])]
+    for months, low, high in windows:
+        conditions, params = _window_conditions(date_column, low, high)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with _sales_tables(months) as (conn, sales, sale_items):
+            # WAL 下每段匯出讀取同一個快照，不阻擋結帳寫入
+            cursor = conn.execute(sql.format(where=where, sales=sales, sale_items=sale_items), params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                cursor.close()
+
+
+# ---------- 分析資料 ----------
+
+# 分析資料同步：名稱 -> (SQL, id 欄位)；依 id 遞增讀取，月份與時段在 SQLite 端算好
+ANALYTICS_QUERIES = {
+    "sales": ("""
+        SELECT s.id, substr(s.created_at, 1, 7) AS month, s.created_at,
+               CAST(strftime('%H', s.created_at) AS INTEGER) AS hour, COALESCE(s.payment_method, 'cash'),
+               s.member_id, s.subtotal, s.discount, s.total
+        FROM {sales} s {where} ORDER BY s.id""", "s.id"),
+    # 成本取同步當時的商品成本；每日同步時即接近銷售當時的成本
+    "sale_items": ("""
+        SELECT i.id, substr(s.created_at, 1, 7) AS month, i.sale_id, s.created_at,
+               CAST(strftime('%H', s.created_at) AS INTEGER) AS hour, i.product_id, i.product_name,
+               COALESCE(p.category, ''), i.quantity, i.unit_price, i.subtotal, COALESCE(p.cost, 0)
+        FROM {sale_items} i JOIN {sales} s ON s.id = i.sale_id LEFT JOIN products p ON p.id = i.product_id
+        {where} ORDER BY i.id""", "i.id"),
+}
+
+_archive_max_ids = {}
+
+
+def _archive_max_id(month, table):
+    """封存檔中 table 的最大 id（依檔案修改時間快取）"""
+    path = _archive_file(month)
+    key = (path, table, os.path.getmtime(path))
+    if key not in _archive_max_ids:
+        conn = sqlite3.connect(path)
+        try:
+            _archive_max_ids[key] = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+        finally:
+            conn.close()
+    return _archive_max_ids[key]
+
+
+def iter_analytics(name, after=0, chunk_size=EXPORT_CHUNK_SIZE):
+    """依 id 遞增逐批產生 id 大於 after 的分析資料列（含已封存月份），供 analytics 增量同步
+
+    每列第一欄為 id、第二欄為月份（'YYYY-MM'）。回放或補登的銷售 created_at 可能早於 id 較小的銷售，
+    因此每批都向所有時段各取 id 最小的 chunk_size 筆再合併，整個串流依 id 遞增。
+    新銷售以最大 id + 1 配號且封存時保留最大 id，high-water mark 以下的資料列一定都已產生過；
+    封存途中 pos.db 已刪除、尚未登記為封存月份的資料列讀不到，請勿與 archive_sales 同時執行。
+    """
+    sql, id_column = ANALYTICS_QUERIES[name]
+    where_id = f"{id_column} > ?"
+    while True:
+        rows = []
+        for months, low, high in _archive_windows(None, None):
+            if months and all(_archive_max_id(month, name) <= after for month in months):
+                # 封存檔都已同步過；之後補進這些月份的銷售仍在 pos.db，只查 pos.db
+                months = []
+            conditions, params = _window_conditions("s.created_at", low, high)
+            where = f"WHERE {' AND '.join([where_id] + conditions)}"
+            with _sales_tables(months) as (conn, sales, sale_items):
+                rows += conn.execute(sql.format(where=where, sales=sales, sale_items=sale_items) + " LIMIT ?",
+                                     [after] + params + [chunk_size]).fetchall()
+        if not rows:
+            return
+        rows.sort(key=lambda row: row[0])
+        rows = rows[:chunk_size]
+        yield rows
+        after = rows[-1][0]
 
 
 # ---------- 促銷 ----------
 
+# 預先解析的促銷規則，calculate_promotion() 直接以屬性讀取
+PromotionRule = namedtuple("PromotionRule", [
+    "id", "name", "type", "value", "product_id",
+    "min_quantity", "min_amount", "start_date", "end_date",
+    "priority", "exclusive",
+], defaults=(0, False))
+
+# (促銷世代, 索引, 載入時間)；世代變動或超過 CACHE_TTL 時重新載入
+_promotion_index = None
+
+
+def _to_rule(row):
+    """將 sqlite Row（或 dict）轉為 PromotionRule"""
+    return PromotionRule(row['id'], row['name'], row['type'], row['value'] or 0, row['product_id'],
+                         row['min_quantity'] or 1, row['min_amount'] or 0, row['start_date'], row['end_date'],
+                         row['priority'] or 0, bool(row['exclusive']))
+
+
+def _invalidate_promotions():
+    _bump("promotions")
+
+
+_SQL_PRODUCT_PROMOTIONS = _hot_query("get_promotions(product_id)", "SELECT * FROM promotions WHERE product_id = ? AND is_active = 1")
+_SQL_ACTIVE_PROMOTIONS = _hot_query("get_promotions", "SELECT * FROM promotions WHERE is_active = 1")
+
+
+@_cached("promotions")
 def get_promotions(product_id=None):
     """取得促銷列表"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    if product_id:
-        cursor.execute("SELECT * FROM promotions WHERE product_id = ? AND is_active = 1", (product_id,))
-    else:
-        cursor.execute("SELECT * FROM promotions WHERE is_active = 1")
-    promotions = cursor.fetchall()
-    conn.close()
-    return promotions
+    with get_connection() as conn:
+        if product_id:
+            return conn.execute(_SQL_PRODUCT_PROMOTIONS, (product_id,)).fetchall()
+        return conn.execute(_SQL_ACTIVE_PROMOTIONS).fetchall()
 
 
-def add_promotion(name, promo_type, value, product_id=None, min_quantity=1, min_amount=0, start_date=None, end_date=None):
-    """新增促銷"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO promotions (name, type, value, product_id, min_quantity, min_amount, start_date, end_date, is_active, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, CURRENT_TIMESTAMP)
-    """, (name, promo_type, value, product_id, min_quantity, min_amount, start_date, end_date))
-    conn.commit()
-    conn.close()
+def add_promotion(name, promo_type, value, product_id=None, min_quantity=1, min_amount=0, start_date=None, end_date=None,
+                  priority=0, exclusive=False):
+    """新增促銷（priority 越大越優先；exclusive 的促銷套用時不與其他促銷疊加）"""
+    with transaction() as cursor:
+        cursor.execute("""
+            INSERT INTO promotions (name, type, value, product_id, min_quantity, min_amount, start_date, end_date,
+                                    priority, exclusive, is_active, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, CURRENT_TIMESTAMP)
+        """, (name, promo_type, value, product_id, min_quantity, min_amount, start_date, end_date,
+              priority, int(bool(exclusive))))
+    _invalidate_promotions()
 
 
 def delete_promotion(promo_id):
     """刪除促銷"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM promotions WHERE id = ?", (promo_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM promotions WHERE id = ?", (promo_id,))
+    _invalidate_promotions()
+
+
+def get_promotion_index():
+    """以單次查詢載入所有有效促銷，回傳 {product_id: [PromotionRule, ...]}
+
+    其他行程（例如 API 與介面）修改促銷不會遞增本行程的世代，因此與讀取快取相同，
+    超過 CACHE_TTL 秒也會重新載入；內容沒變時沿用同一個索引物件，促銷引擎不必重新編譯。
+    """
+    global _promotion_index
+    cached = _promotion_index
+    version = (DB_PATH, _generations["promotions"])
+    if cached is not None and cached[0] == version and time.monotonic() - cached[2] < CACHE_TTL:
+        return cached[1]
+    # 先記下世代再查詢：查詢期間若有異動，下次呼叫會重新載入
+    index = {}
+    for row in get_promotions.uncached():
+        index.setdefault(row['product_id'], []).append(_to_rule(row))
+    if cached is not None and cached[1] == index:
+        index = cached[1]
+    _promotion_index = (version, index, time.monotonic())
+    return index
 
 
 def calculate_promotion(item, promotions):
-    """計算單項商品的促銷折扣"""
+    """計算單項商品的促銷折扣（promotions 可為 PromotionRule 或資料列）"""
     if not promotions:
         return 0
     
@@ -208,29 +1835,30 @@ def calculate_promotion(item, promotions):
     price = item['price']
     
     for p in promotions:
-        p = dict(p)
+        if not isinstance(p, PromotionRule):
+            p = _to_rule(p)
         
         # 百分比折扣
-        if p['type'] == 'percent':
-            discount += price * qty * (p['value'] / 100)
+        if p.type == 'percent':
+            discount += price * qty * (p.value / 100)
         
         # 固定金額折扣
-        elif p['type'] == 'fixed':
-            discount += p['value']
+        elif p.type == 'fixed':
+            discount += p.value
         
         # 買一送一
-        elif p['type'] == 'bogo':
+        elif p.type == 'bogo':
             free_items = qty // 2
             discount += free_items * price
         
         # 第二件折扣
-        elif p['type'] == 'second_discount':
+        elif p.type == 'second_discount':
             if qty >= 2:
-                discount += price * (p['value'] / 100)
+                discount += price * (p.value / 100)
         
         # 滿額折扣
-        elif p['type'] == 'amount':
-            if item['subtotal'] >= p['min_amount']:
-                discount += p['value']
+        elif p.type == 'amount':
+            if item['subtotal'] >= p.min_amount:
+                discount += p.value
     
     return round(discount, 2)
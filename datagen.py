@@ -0,0 +1,193 @@
+"""POS 測試資料產生器
+
+在暫存資料庫中產生指定數量的商品、會員、促銷與多年份的銷售紀錄（含庫存異動帳），
+相同的 seed 會產生完全相同的資料，供效能測試與硬體規劃使用。
+
+用法：
+    python datagen.py scratch.db [--products 10000] [--members 10000] [--promotions 500]
+                                 [--years 2] [--sales-per-day 100] [--seed 42] [--end YYYY-MM-DD]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import database
+
+CATEGORIES = ["飲料", "零食", "泡麵", "乳品", "冷凍", "麵包", "日用品", "文具", "菸酒", "生鮮"]
+BRANDS = ["統一", "味全", "光泉", "義美", "可口可樂", "黑松", "維力", "金車", "桂格", "舒潔"]
+ITEMS = ["綠茶", "紅茶", "奶茶", "咖啡", "礦泉水", "洋芋片", "餅乾", "牛奶", "優格", "泡麵",
+         "水餃", "吐司", "衛生紙", "原子筆", "啤酒", "蘋果", "香蕉", "豆漿", "果汁", "巧克力"]
+SURNAMES = "陳林黃張李王吳劉蔡楊許鄭謝郭洪曾邱廖賴周"
+GIVEN = "志明怡君俊傑淑芬家豪雅婷建宏美玲冠宇佳穎"
+PROMO_TYPES = ["percent", "fixed", "bogo", "second_discount"]
+PAYMENT_METHODS = ["cash", "cash", "cash", "card", "mobile"]
+
+# 每次 executemany 寫入的筆數
+BATCH_SIZE = 5000
+
+
+def _batched(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _product_rows(rng, count):
+    for i in range(1, count + 1):
+        price = rng.randint(10, 500)
+        name = f"{rng.choice(BRANDS)}{rng.choice(ITEMS)} {i:06d}"
+        yield (i, name, round(price / 1.05, 2), price, round(price * rng.uniform(0.5, 0.8), 2),
+               10 ** 6, f"471{i:010d}", rng.choice(CATEGORIES))
+
+
+def _member_rows(rng, count):
+    for i in range(1, count + 1):
+        name = rng.choice(SURNAMES) + rng.choice(GIVEN) + rng.choice(GIVEN)
+        phone = f"09{i:08d}"
+        yield (i, name, phone, f"member{i}@example.com", phone[::-1])
+
+
+def _promotion_rows(rng, count, products):
+    for i in range(1, count + 1):
+        if i % 50 == 0:
+            # 約 2% 為滿額折扣
+            yield (i, f"滿額折扣{i}", "amount", rng.choice([50, 100, 200]), None, 1, rng.choice([500, 1000, 2000]))
+            continue
+        promo_type = rng.choice(PROMO_TYPES)
+        value = rng.randint(5, 30) if promo_type != "fixed" else rng.randint(1, 10)
+        yield (i, f"促銷{i}", promo_type, value, rng.randint(1, products), rng.randint(1, 3), 0)
+
+
+def _sales(rng, products, members, years, sales_per_day, catalog, end):
+    """依日期產生 (sale 資料列, [品項資料列])，sale_id 由 1 起連續編號，最後一天為 end"""
+    start = end - timedelta(days=365 * years - 1)
+    sale_id = 0
+    for offset in range(365 * years):
+        day = (start + timedelta(days=offset)).isoformat()
+        for seconds in sorted(rng.randrange(8 * 3600, 22 * 3600) for _ in range(sales_per_day)):
+            sale_id += 1
+            items = []
+            subtotal = 0
+            for product_id in rng.sample(range(1, products + 1), min(rng.randint(1, 5), products)):
+                qty = rng.randint(1, 3)
+                name, price = catalog[product_id]
+                items.append((sale_id, product_id, name, qty, price, qty * price))
+                subtotal += qty * price
+            discount = rng.choice([0, 0, 0, 5, 10])
+            total = max(subtotal - discount, 0)
+            cash = -(-total // 100) * 100
+            member_id = rng.randint(1, members) if members and rng.random() < 0.3 else None
+            created_at = f"{day} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+            yield (sale_id, member_id, subtotal, discount, total, cash, cash - total,
+                   rng.choice(PAYMENT_METHODS), created_at), items
+
+
+def generate(db_path, products=10000, members=10000, promotions=500, years=2, sales_per_day=100,
+             seed=42, end=None, progress=None):
+    """在 db_path 產生測試資料並回傳各資料表筆數；db_path 必須是新檔案
+
+    銷售紀錄涵蓋到 end（'YYYY-MM-DD'，預設今天）為止的 years 年。
+    """
+    if os.path.exists(db_path):
+        raise FileExistsError(f"{db_path} 已存在，請指定新的檔案")
+    rng = random.Random(seed)
+    end = date.fromisoformat(end) if end else date.today()
+    database.close_connections()
+    database.DB_PATH = db_path
+    database.init_db()
+
+    report = progress or (lambda message: None)
+    product_rows = list(_product_rows(rng, products))
+    catalog = {row[0]: (row[1], row[3]) for row in product_rows}
+    with database.transaction() as cursor:
+        report(f"商品 {products:,} 筆")
+        cursor.executemany("""
+            INSERT INTO products (id, name, price_ex_tax, price_inc_tax, cost, stock, barcode, category, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)""", product_rows)
+        report(f"會員 {members:,} 筆")
+        cursor.executemany("""
+            INSERT INTO members (id, name, phone, email, phone_reversed, points, total_spent, created_at)
+            VALUES (?, ?, ?, ?, ?, 0, 0, CURRENT_TIMESTAMP)""", _member_rows(rng, members))
+        report(f"促銷 {promotions:,} 筆")
+        cursor.executemany("""
+            INSERT INTO promotions (id, name, type, value, product_id, min_quantity, min_amount, is_active, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 1, CURRENT_TIMESTAMP)""", _promotion_rows(rng, promotions, products))
+
+    sale_count = item_count = 0
+    for batch in _batched(_sales(rng, products, members, years, sales_per_day, catalog, end)):
+        with database.transaction() as cursor:
+            cursor.executemany("""
+                INSERT INTO sales (id, member_id, subtotal, discount, total, cash, change_amount, payment_method, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", [sale for sale, _ in batch])
+            items = [item for _, sale_items in batch for item in sale_items]
+            cursor.executemany("""
+                INSERT INTO sale_items (sale_id, product_id, product_name, quantity, unit_price, subtotal)
+                VALUES (?, ?, ?, ?, ?, ?)""", items)
+        sale_count += len(batch)
+        item_count += len(items)
+        report(f"銷售 {sale_count:,} 筆")
+
+    with database.transaction() as cursor:
+        # 庫存帳：期初進貨（目前庫存加上已售數量）與每筆銷售的出貨，結餘等於目前庫存
+        cursor.execute("""
+            INSERT INTO stock_movements (product_id, kind, quantity, balance_after, note, created_at)
+            SELECT p.id, 'receipt', p.stock + COALESCE(sold.quantity, 0), p.stock + COALESCE(sold.quantity, 0), '期初', ?
+            FROM products p
+            LEFT JOIN (SELECT product_id, SUM(quantity) AS quantity FROM sale_items GROUP BY product_id) sold
+                ON sold.product_id = p.id""", (f"{end - timedelta(days=365 * years)} 00:00:00",))
+        cursor.execute("""
+            INSERT INTO stock_movements (product_id, kind, quantity, balance_after, sale_id, created_at)
+            SELECT i.product_id, 'sale', -i.quantity,
+                   o.balance_after - SUM(i.quantity) OVER (PARTITION BY i.product_id ORDER BY s.created_at, i.id),
+                   s.id, s.created_at
+            FROM sale_items i
+            JOIN sales s ON s.id = i.sale_id
+            JOIN stock_movements o ON o.product_id = i.product_id AND o.kind = 'receipt'
+            ORDER BY s.created_at, i.id""")
+        cursor.execute("""
+            UPDATE members SET total_spent = spent.total
+            FROM (SELECT member_id, SUM(total) AS total FROM sales WHERE member_id IS NOT NULL GROUP BY member_id) AS spent
+            WHERE members.id = spent.member_id""")
+        database._rebuild_daily_sales_summary(cursor)
+    database.invalidate_cache()
+    database._barcode_map = None
+    return {"products": products, "members": members, "promotions": promotions,
+            "sales": sale_count, "sale_items": item_count}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="POS 測試資料產生器")
+    parser.add_argument("db", help="輸出的資料庫檔案（不可已存在）")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--members", type=int, default=10000)
+    parser.add_argument("--promotions", type=int, default=500)
+    parser.add_argument("--years", type=int, default=2, help="銷售紀錄涵蓋的年數")
+    parser.add_argument("--sales-per-day", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--end", help="最後一天的銷售日期（YYYY-MM-DD，預設今天）")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        counts = generate(args.db, args.products, args.members, args.promotions, args.years,
+                          args.sales_per_day, args.seed, args.end, progress=lambda message: print(f"  {message}", end="\r"))
+    except FileExistsError as e:
+        print(f"❌ {e}")
+        return 1
+    print(" " * 40, end="\r")
+    print(f"✅ 已產生 {args.db}（{time.perf_counter() - start:.1f} 秒）")
+    for table, count in counts.items():
+        print(f"  {table}: {count:,}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
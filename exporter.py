@@ -0,0 +1,110 @@
+"""POS 串流匯出模組
+
+由 database.iter_export 逐批讀取資料列，直接寫入 CSV / XLSX / Parquet，
+產生檔案時不會把整張資料表放進記憶體（記憶體用量取決於每批筆數）。
+
+注意：Streamlit 的下載按鈕會把完成的檔案整份載入記憶體後才送給瀏覽器；
+大量資料請改用 python manage.py export 直接寫入檔案或標準輸出。
+"""
+import csv
+import io
+import os
+import tempfile
+
+import database
+
+# 匯出欄位：名稱 -> [(標題, 型別), ...]，型別用於 Parquet schema
+EXPORT_COLUMNS = {
+    "products": [("ID", "int"), ("名稱", "str"), ("售價未稅", "float"), ("售價含稅", "float"),
+                 ("成本", "float"), ("庫存", "int"), ("條碼", "str"), ("類別", "str"), ("建立時間", "str")],
+    "members": [("ID", "int"), ("姓名", "str"), ("電話", "str"), ("Email", "str"),
+                ("積分", "int"), ("總消費", "float"), ("建立時間", "str")],
+    "sales": [("ID", "int"), ("會員ID", "int"), ("小計", "float"), ("折扣", "float"), ("總額", "float"),
+              ("收款", "float"), ("找零", "float"), ("方式", "str"), ("時間", "str"), ("會員名", "str")],
+    "sale_items": [("ID", "int"), ("銷售ID", "int"), ("商品ID", "int"), ("商品名稱", "str"),
+                   ("數量", "int"), ("單價", "float"), ("小計", "float"), ("時間", "str")],
+}
+
+# 格式 -> (副檔名, MIME)
+FORMATS = {
+    "csv": ("csv", "text/csv"),
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "parquet": ("parquet", "application/octet-stream"),
+}
+
+# Excel 單一工作表的列數上限（含標題列）
+XLSX_MAX_ROWS = 1048576
+
+
+def _write_csv(chunks, headers, out):
+    # utf-8-sig 讓 Excel 正確辨識中文
+    text = io.TextIOWrapper(out, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text)
+    writer.writerow(headers)
+    for rows in chunks:
+        writer.writerows(rows)
+    text.flush()
+    text.detach()
+
+
+def _write_xlsx(chunks, headers, out):
+    from openpyxl import Workbook
+
+    # write_only 模式逐列寫出，不在記憶體中保留儲存格
+    workbook = Workbook(write_only=True)
+    sheet = None
+    for rows in chunks:
+        for row in rows:
+            if sheet is None or sheet_rows >= XLSX_MAX_ROWS:
+                sheet = workbook.create_sheet()
+                sheet.append(headers)
+                sheet_rows = 1
+            sheet.append(tuple(row))
+            sheet_rows += 1
+    if sheet is None:
+        workbook.create_sheet().append(headers)
+    workbook.save(out)
+
+
+def _write_parquet(chunks, columns, out):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("匯出 Parquet 需要安裝 pyarrow")
+
+    types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string()}
+    schema = pa.schema([(header, types[kind]) for header, kind in columns])
+    with pq.ParquetWriter(out, schema, compression="zstd") as writer:
+        for rows in chunks:
+            # 每批各寫成一個 row group
+            arrays = [pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+
+def export(name, fmt, out, start=None, end=None, chunk_size=database.EXPORT_CHUNK_SIZE):
+    """將 name（products / members / sales / sale_items）以 fmt 格式寫入二進位檔案 out"""
+    columns = EXPORT_COLUMNS[name]
+    headers = [header for header, _ in columns]
+    chunks = database.iter_export(name, start, end, chunk_size)
+    if fmt == "csv":
+        _write_csv(chunks, headers, out)
+    elif fmt == "xlsx":
+        _write_xlsx(chunks, headers, out)
+    elif fmt == "parquet":
+        _write_parquet(chunks, columns, out)
+    else:
+        raise ValueError(f"不支援的匯出格式：{fmt}")
+
+
+def export_to_file(name, fmt, start=None, end=None, directory=None):
+    """匯出到暫存檔並回傳路徑，呼叫端用完後自行刪除"""
+    suffix = "." + FORMATS[fmt][0]
+    fd, path = tempfile.mkstemp(prefix=f"{name}_", suffix=suffix, dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            export(name, fmt, out, start, end)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
@@ -0,0 +1,180 @@
+"""POS 批次匯入模組
+
+以串流方式分批讀取 CSV / XLSX，向量化驗證與轉型後交由
+database.bulk_upsert_products / bulk_upsert_members 在單一交易中寫入。
+"""
+import time
+
+import pandas as pd
+
+import database
+
+# 每批讀取與寫入的列數
+CHUNK_SIZE = 5000
+
+# 欄位 -> 是否必填；選填欄位缺少或空白時數值為 0、文字為空字串
+PRODUCT_COLUMNS = {"名稱": True, "售價未稅": False, "售價含稅": False, "成本": False, "庫存": False, "條碼": False, "類別": False}
+MEMBER_COLUMNS = {"姓名": True, "電話": True, "Email": False}
+
+
+class ImportReport:
+    """匯入結果：成功筆數、逐列錯誤與吞吐量"""
+
+    def __init__(self):
+        self.rows_read = 0
+        self.imported = 0
+        self.errors = []  # [(檔案列號, 錯誤訊息), ...]
+        self.elapsed = 0.0
+        self._started = time.perf_counter()
+
+    @property
+    def rows_per_second(self):
+        return self.rows_read / self.elapsed if self.elapsed else 0.0
+
+
+def _is_excel(filename):
+    return filename.lower().endswith((".xlsx", ".xlsm"))
+
+
+def _cell_text(value):
+    """XLSX 儲存格轉字串；整數值的浮點數（例如條碼）不帶小數點"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _read_xlsx_chunks(file, chunk_size):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [_cell_text(v).strip() for v in next(rows, ())]
+        chunk = []
+        for row in rows:
+            chunk.append([_cell_text(v) for v in row[:len(header)]])
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def read_chunks(file, filename, chunk_size=CHUNK_SIZE):
+    """依副檔名分批讀取檔案，逐批產生全為字串欄位的 DataFrame"""
+    if _is_excel(filename):
+        yield from _read_xlsx_chunks(file, chunk_size)
+    else:
+        # 全部以字串讀入，避免條碼、電話的前導 0 被轉成數字
+        reader = pd.read_csv(file, chunksize=chunk_size, dtype=str, keep_default_na=False,
+                             encoding="utf-8-sig")
+        with reader:
+            for df in reader:
+                df.columns = [str(c).strip() for c in df.columns]
+                yield df
+
+
+def preview(file, filename, rows=5):
+    """讀取前幾列供預覽，讀完後將檔案指標移回開頭"""
+    df = next(read_chunks(file, filename, chunk_size=rows), pd.DataFrame())
+    file.seek(0)
+    return df.head(rows)
+
+
+def _text(df, column):
+    if column not in df:
+        return pd.Series("", index=df.index, dtype=object)
+    return df[column].astype(str).str.strip()
+
+
+def _number(df, column, errors, line_numbers, integer=False):
+    """轉為數值；空白視為 0，無法轉換、為負數或（integer 時）帶小數的列記錄錯誤"""
+    text = _text(df, column)
+    values = pd.to_numeric(text.where(text != "", "0"), errors="coerce")
+    bad = values.isna() | (values < 0)
+    if integer:
+        # 不截斷小數：1.7 視為格式錯誤而不是匯入成 1
+        bad |= values % 1 != 0
+    for line in line_numbers[bad]:
+        errors.append((int(line), f"{column} 格式錯誤"))
+    return values, bad
+
+
+def _required(df, columns, errors, line_numbers):
+    bad = pd.Series(False, index=df.index)
+    for column, required in columns.items():
+        if required:
+            missing = _text(df, column) == ""
+            for line in line_numbers[missing & ~bad]:
+                errors.append((int(line), f"缺少{column}"))
+            bad |= missing
+    return bad
+
+
+def _check_header(df, columns):
+    missing = [c for c, required in columns.items() if required and c not in df]
+    if missing:
+        raise ValueError(f"檔案缺少必要欄位：{', '.join(missing)}")
+
+
+def _prepare_products(df, line_numbers, errors):
+    bad = _required(df, PRODUCT_COLUMNS, errors, line_numbers)
+    price_ex, bad_ex = _number(df, "售價未稅", errors, line_numbers)
+    price_inc, bad_inc = _number(df, "售價含稅", errors, line_numbers)
+    cost, bad_cost = _number(df, "成本", errors, line_numbers)
+    stock, bad_stock = _number(df, "庫存", errors, line_numbers, integer=True)
+    valid = ~(bad | bad_ex | bad_inc | bad_cost | bad_stock)
+    columns = zip(
+        _text(df, "名稱")[valid], price_ex[valid].astype(float), price_inc[valid].astype(float),
+        cost[valid].astype(float), stock[valid].astype(int),
+        _text(df, "條碼")[valid], _text(df, "類別")[valid],
+    )
+    return list(zip(line_numbers[valid].tolist(), columns))
+
+
+def _prepare_members(df, line_numbers, errors):
+    bad = _required(df, MEMBER_COLUMNS, errors, line_numbers)
+    valid = ~bad
+    columns = zip(_text(df, "姓名")[valid], _text(df, "電話")[valid], _text(df, "Email")[valid])
+    return list(zip(line_numbers[valid].tolist(), columns))
+
+
+def _batches(chunks, columns, prepare, report, progress):
+    """讀取、驗證並逐批產生 [(列號, 參數), ...]，同時更新進度"""
+    for df in chunks:
+        if report.rows_read == 0:
+            _check_header(df, columns)
+        # 檔案列號：標題佔第 1 列
+        line_numbers = pd.Series(range(report.rows_read + 2, report.rows_read + 2 + len(df)), index=df.index)
+        batch = prepare(df, line_numbers, report.errors)
+        report.rows_read += len(df)
+        yield batch
+        if progress:
+            report.elapsed = time.perf_counter() - report._started
+            progress(report)
+
+
+def _run(file, filename, columns, prepare, write, chunk_size, progress):
+    report = ImportReport()
+    chunks = read_chunks(file, filename, chunk_size)
+    report.imported, write_errors = write(_batches(chunks, columns, prepare, report, progress))
+    report.errors.extend(write_errors)
+    report.errors.sort()
+    report.elapsed = time.perf_counter() - report._started
+    return report
+
+
+def import_products(file, filename, chunk_size=CHUNK_SIZE, progress=None):
+    """匯入商品（依條碼 upsert），progress(report) 於每批完成後呼叫"""
+    return _run(file, filename, PRODUCT_COLUMNS, _prepare_products, database.bulk_upsert_products,
+                chunk_size, progress)
+
+
+def import_members(file, filename, chunk_size=CHUNK_SIZE, progress=None):
+    """匯入會員（依電話 upsert），progress(report) 於每批完成後呼叫"""
+    return _run(file, filename, MEMBER_COLUMNS, _prepare_members, database.bulk_upsert_members,
+                chunk_size, progress)
@@ -0,0 +1,240 @@
+"""POS 離線結帳日誌（write-behind）
+
+結帳時先把銷售以一行 JSON 附加到本機日誌並 fsync，立即回傳；
+背景執行緒再分批把日誌寫入 pos.db。即使資料庫被報表或其他收銀台
+鎖住，收銀員也不必等待。
+
+回放以 idempotency_key 去重，當機後重新啟動會從檢查點繼續，
+已寫入資料庫的銷售不會重複記錄（exactly-once）。每筆記錄帶結帳當下的
+created_at，延後回放的銷售仍計入正確的日期與月份。
+
+介面與 API 啟動時即開始回放上次留下的記錄；也可手動執行：
+    python manage.py journal-replay
+
+介面與 API 可共用同一個日誌：附加、回放與壓縮以檔案鎖（flock）跨行程互斥。
+
+啟用方式：設定環境變數 POS_CHECKOUT_MODE=journal。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import database
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 沒有 fcntl：只保證同一行程內互斥，請勿讓多個行程共用同一個日誌
+    fcntl = None
+
+ENABLED = os.environ.get("POS_CHECKOUT_MODE") == "journal"
+
+# 每次寫入資料庫的最大筆數與背景寫入間隔（秒）
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 0.2
+
+
+def _fsync_write(path, data):
+    """原子寫入小檔案：先寫暫存檔再 rename"""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _exclusive(lock, lock_file):
+    """同一行程內以 threading 鎖、跨行程（介面與 API 共用日誌）以 flock 互斥"""
+    with lock:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class SaleJournal:
+    """附加寫入的銷售日誌與背景寫入器"""
+
+    def __init__(self, path, batch_size=BATCH_SIZE, interval=FLUSH_INTERVAL):
+        self.path = path
+        self.checkpoint_path = path + ".ckpt"
+        # 多次重試仍無法寫入的銷售，保留供人工處理
+        self.failed_path = path + ".failed"
+        self.batch_size = batch_size
+        self.interval = interval
+        # 附加與回放各一把鎖；壓縮時先取回放鎖再取附加鎖
+        self._append_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._append_lock_file = open(path + ".lock", "ab")
+        self._flush_lock_file = open(path + ".flush.lock", "ab")
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._recover()
+
+    # ---------- 寫入 ----------
+
+    def submit(self, member_id, subtotal, discount, total, cash, change_amount, items=None,
+               idempotency_key=None, payment_method='cash'):
+        """記錄一筆銷售並 fsync，回傳 idempotency_key；資料庫稍後才會寫入"""
+        entry = {
+            'member_id': member_id, 'subtotal': subtotal, 'discount': discount, 'total': total,
+            'cash': cash, 'change_amount': change_amount, 'payment_method': payment_method,
+            'idempotency_key': idempotency_key or uuid.uuid4().hex,
+            # 與 CURRENT_TIMESTAMP 相同的 UTC 格式
+            'created_at': time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+            'items': [{k: item[k] for k in ('product_id', 'name', 'quantity', 'price', 'subtotal')}
+                      for item in items or ()],
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with _exclusive(self._append_lock, self._append_lock_file):
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        self._wakeup.set()
+        return entry['idempotency_key']
+
+    # ---------- 回放 ----------
+
+    def _read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                offset = int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+        # 日誌已截斷但檢查點尚未歸零（壓縮途中當機）
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return offset if offset <= size else 0
+
+    def _read_pending(self, offset):
+        """從 offset 讀取最多 batch_size 筆完整記錄，回傳 ([(記錄, 結束位置)], 是否還有更多)"""
+        entries = []
+        if not os.path.exists(self.path):
+            return entries, False
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for raw in f:
+                # 沒有換行結尾的是寫到一半的記錄，尚未確認給收銀員，不回放
+                if not raw.endswith(b"\n"):
+                    break
+                offset += len(raw)
+                entries.append((json.loads(raw), offset))
+                if len(entries) >= self.batch_size:
+                    return entries, True
+        return entries, False
+
+    def _recover(self):
+        """啟動時截掉寫到一半的最後一行（持有附加鎖，不會截到其他行程正在寫的記錄）"""
+        with _exclusive(self._append_lock, self._append_lock_file):
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, "rb+") as f:
+                data = f.read()
+                end = data.rfind(b"\n") + 1
+                if end < len(data):
+                    f.truncate(end)
+
+    def _apply(self, entries):
+        """寫入一批記錄；資料庫暫時無法寫入時拋出 OperationalError，檢查點不推進，下一輪重試"""
+        try:
+            database.apply_sales([entry for entry, _ in entries])
+        except sqlite3.OperationalError:
+            raise
+        except Exception:
+            # 整批失敗時逐筆寫入，找出資料本身有問題的記錄移到 .failed，其餘照常寫入
+            for entry, _ in entries:
+                try:
+                    database.apply_sales([entry])
+                except sqlite3.OperationalError:
+                    # 例如 database is locked：不是記錄的問題，不可移走
+                    raise
+                except Exception as e:
+                    with open(self.failed_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps({'error': str(e), 'sale': entry}, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        """把檢查點之後的所有記錄寫入資料庫，回傳寫入筆數"""
+        applied = 0
+        with _exclusive(self._flush_lock, self._flush_lock_file):
+            offset = self._read_checkpoint()
+            while True:
+                entries, more = self._read_pending(offset)
+                if not entries:
+                    break
+                self._apply(entries)
+                # 先寫資料庫再推進檢查點：兩者之間當機時會重放，由 idempotency_key 去重
+                offset = entries[-1][1]
+                _fsync_write(self.checkpoint_path, str(offset))
+                applied += len(entries)
+                if not more:
+                    break
+            self._compact(offset)
+        return applied
+
+    def _compact(self, offset):
+        """全部寫入後清空日誌，避免檔案無限成長；其他行程剛附加的記錄會讓大小不符而保留"""
+        with _exclusive(self._append_lock, self._append_lock_file):
+            if offset and os.path.exists(self.path) and os.path.getsize(self.path) == offset:
+                with open(self.path, "r+b") as f:
+                    f.truncate(0)
+                    os.fsync(f.fileno())
+                _fsync_write(self.checkpoint_path, "0")
+
+    def pending(self):
+        """尚未寫入資料庫的位元組數"""
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return size - self._read_checkpoint()
+
+    # ---------- 背景寫入 ----------
+
+    def _run(self):
+        # 啟動後先回放上次留下的記錄，不等第一筆新結帳
+        while not self._stopping.is_set():
+            try:
+                self.flush()
+            except Exception:
+                # 資料庫忙碌或暫時無法寫入：記錄仍在日誌中，下一輪重試
+                pass
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="sale-journal", daemon=True)
+            self._thread.start()
+
+    def stop(self, flush=True):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if flush:
+            self.flush()
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    """取得本行程共用、已啟動背景寫入的日誌（檔案與資料庫同目錄）"""
+    global _journal
+    with _journal_lock:
+        if _journal is None or _journal.path != database.DB_PATH + ".journal":
+            if _journal is not None:
+                _journal.stop()
+            _journal = SaleJournal(database.DB_PATH + ".journal")
+            _journal.start()
+        return _journal
@@ -4,18 +4,40 @@ POS 收銀系統 v1.6.2 - 促銷版
 新增：新增商品功能
 """
 import streamlit as st
-import pandas as pd
 import os
+import uuid
+import exporter
+from cart import Cart
+import journal
+import promotion_engine
+import metrics
+import backup
+import analytics
 from database import init_db, get_products, add_product, update_product, delete_product
-from database import get_members, add_member, create_sale, get_sales, get_daily_sales
-from database import get_member_by_phone, get_promotions, add_promotion, delete_promotion, calculate_promotion
-from datetime import datetime
+from database import add_member, create_sale, get_daily_sales
+from database import get_member_by_phone, search_members, get_members_page, count_members
+from database import get_promotions, add_promotion, delete_promotion
+from database import get_product_by_barcode, get_products_by_barcodes
+from database import get_products_page, count_products, get_categories, PAGE_SIZE
+from database import get_daily_sales_trend, rebuild_daily_sales_summary, InsufficientStockError
+from database import cache_stats
+from database import record_stock_movement, get_stock_movements, get_inventory_valuation, STOCK_MOVEMENT_KINDS
+from database import archive_sales, get_archives, count_archivable_sales
+from database import get_sales_page, get_sales_summary, get_sale_items, get_payment_methods, SALES_PAGE_SIZE
+from collections import Counter
+from datetime import datetime, timedelta
 
 init_db()
+if journal.ENABLED:
+    # 啟動背景寫入，當機前留下的結帳記錄在開啟介面時就回放
+    journal.get_journal()
 st.set_page_config(page_title="POS 收銀系統", page_icon="🏪", layout="wide")
 
 if 'cart' not in st.session_state:
-    st.session_state.cart = []
+    st.session_state.cart = Cart()
+if 'checkout_key' not in st.session_state:
+    # 每筆交易一個冪等鍵，連點結帳也只會記錄一次
+    st.session_state.checkout_key = uuid.uuid4().hex
 
 
 def calculate_price_inc_tax(price_ex_tax):
@@ -38,9 +60,173 @@ def calculate_price_ex_tax(price_inc_tax):
         return 0.0
 
 
+def start_new_transaction():
+    st.session_state.sale_done = False
+    st.session_state.cart = Cart()
+    st.session_state.selected_member = None
+    st.session_state.checkout_key = uuid.uuid4().hex
+
+
+def add_to_cart(p):
+    """加入購物車，已存在則合併數量"""
+    # 上一筆已結帳：直接開始下一筆交易
+    if st.session_state.get('sale_done'):
+        start_new_transaction()
+    st.session_state.cart.add(p[0], p[1], p[3])
+
+
+def scan_barcode():
+    """搜尋框內容為完整條碼時直接加入購物車並清空搜尋框"""
+    product = get_product_by_barcode(st.session_state.search)
+    if product and (product['stock'] or 0) > 0:
+        add_to_cart(product)
+        st.session_state.search = ""
+        st.toast(f"✅ 已加入 {product['name']}")
+
+
+def add_scanned(text):
+    """連續掃描：一次查詢所有條碼並加入購物車
+
+    回傳 (加入件數, 找不到的條碼, 庫存不足的商品名稱)；同一條碼掃描多次即加入多件，
+    加入數量不超過庫存扣除購物車內已有的數量。
+    """
+    counts = Counter(code for code in text.split() if code)
+    products = get_products_by_barcodes(counts)
+    if products and st.session_state.get('sale_done'):
+        start_new_transaction()
+    cart = st.session_state.cart
+    added = 0
+    short = []
+    for code, quantity in counts.items():
+        product = products.get(code)
+        if product is None:
+            continue
+        line = cart.get(product['id'])
+        available = (product['stock'] or 0) - (line.quantity if line else 0)
+        if available < quantity:
+            short.append(product['name'])
+            quantity = available
+        if quantity > 0:
+            cart.add(product['id'], product['name'], product['price_inc_tax'], quantity)
+            added += quantity
+    return added, [code for code in counts if code not in products], short
+
+
+def paginate(key, fetch_page, total, unit, filter_value=None, page_size=PAGE_SIZE):
+    """以 keyset 分頁取得目前頁並顯示翻頁按鈕，翻頁狀態存於 session_state
+
+    fetch_page(cursor) 回傳 (資料列, 下一頁 cursor)；filter_value 改變時回到第一頁。
+    """
+    pages_key = f"{key}_pages"
+    filter_key = f"{key}_filter"
+    if pages_key not in st.session_state or st.session_state.get(filter_key) != filter_value:
+        # 每頁起點的 cursor，第一頁為 None
+        st.session_state[pages_key] = [None]
+        st.session_state[filter_key] = filter_value
+    pages = st.session_state[pages_key]
+    rows, next_cursor = fetch_page(pages[-1])
+    
+    c1, c2, c3 = st.columns([1, 2, 1])
+    if c1.button("⬅️ 上一頁", key=f"{key}_prev", disabled=len(pages) == 1):
+        pages.pop()
+        st.rerun()
+    c2.caption(f"第 {len(pages)} / {max(1, -(-total // page_size))} 頁，共 {total} {unit}")
+    if c3.button("下一頁 ➡️", key=f"{key}_next", disabled=next_cursor is None):
+        pages.append(next_cursor)
+        st.rerun()
+    return rows
+
+
+def paginate_products(key, order_by="id", category=None):
+    """以 keyset 分頁取得目前頁的商品並顯示翻頁按鈕"""
+    return paginate(key, lambda after: get_products_page(after, order_by, category),
+                    count_products(category), "項商品", category)
+
+
+def analytics_sync_controls():
+    """顯示分析資料的同步狀態與更新按鈕"""
+    status = analytics.status()
+    synced = datetime.fromtimestamp(status["synced_at"]).strftime("%Y-%m-%d %H:%M") if status["synced_at"] else "尚未同步"
+    c1, c2 = st.columns([3, 1])
+    c1.caption(f"分析資料更新於 {synced}（{status['files']} 個檔案，{status['bytes'] / 1e6:,.1f} MB）；"
+               f"分析報表只套用日期區間")
+    if c2.button("🔄 更新分析資料"):
+        try:
+            counts = analytics.sync()
+            st.success(f"✅ 已同步 {counts['sales']:,} 筆銷售、{counts['sale_items']:,} 筆明細")
+        except Exception as e:
+            st.error(f"❌ 同步失敗: {str(e)}")
+
+
+def show_analytics(report, filters, columns, chart=None):
+    """執行分析報表並顯示圖表與表格；chart 為 (X 欄, Y 欄)"""
+    try:
+        df = report(filters["start"], filters["end"]).rename(columns=columns)
+    except Exception as e:
+        st.info(f"⚠️ {str(e)}")
+        return
+    if df.empty:
+        st.info("該期間沒有資料")
+        return
+    if chart:
+        st.bar_chart(df.set_index(chart[0])[chart[1]])
+    st.dataframe(df, hide_index=True)
+
+
+def import_progress():
+    """建立匯入進度顯示，回傳給 importer 的 progress 回呼"""
+    placeholder = st.empty()
+    def update(report):
+        placeholder.caption(f"⏳ 已處理 {report.rows_read:,} 筆（{report.rows_per_second:,.0f} 筆/秒）")
+    return update
+
+
+def show_import_report(report):
+    st.success(f"✅ 成功匯入 {report.imported:,} / {report.rows_read:,} 筆，"
+               f"耗時 {report.elapsed:.1f} 秒（{report.rows_per_second:,.0f} 筆/秒）")
+    if report.errors:
+        import pandas as pd
+        st.warning(f"⚠️ {len(report.errors)} 筆資料未匯入")
+        st.dataframe(pd.DataFrame(report.errors, columns=["列號", "原因"]), hide_index=True)
+
+
+def export_section(name, label, with_dates=False):
+    """匯出區塊：串流寫入暫存檔後提供下載
+
+    產生檔案時不需載入整張資料表，但下載按鈕會把完成的檔案整份讀進記憶體，
+    因此只在按下匯出後才建立；大量資料請用 python manage.py export。
+    """
+    fmt = st.selectbox("格式", list(exporter.FORMATS), format_func=str.upper, key=f"export_{name}_fmt")
+    start = end = None
+    if with_dates:
+        c1, c2 = st.columns(2)
+        start = c1.date_input("開始日期", value=None, key=f"export_{name}_start")
+        end = c2.date_input("結束日期", value=None, key=f"export_{name}_end")
+    if st.button(f"匯出{label} {fmt.upper()}", key=f"export_{name}"):
+        try:
+            path = exporter.export_to_file(name, fmt, start and start.isoformat(), end and end.isoformat())
+        except Exception as e:
+            st.error(f"❌ 匯出失敗: {str(e)}")
+            return
+        extension, mime = exporter.FORMATS[fmt]
+        with open(path, "rb") as f:
+            st.download_button(
+                label=f"下載 {fmt.upper()}",
+                data=f,
+                file_name=f"{name}.{extension}",
+                mime=mime,
+                key=f"export_{name}_download"
+            )
+        os.remove(path)
+
+
 with st.sidebar:
     st.title("🏪 POS 系統")
-    page = st.radio("選單", ["收銀前台", "商品管理", "會員管理", "銷售報表", "資料管理"])
+    pages = ["收銀前台", "商品管理", "會員管理", "銷售報表", "資料管理"]
+    if metrics.ENABLED:
+        # 隱藏頁面：只在 POS_METRICS=1 時出現
+        pages.append("效能診斷")
+    page = st.radio("選單", pages)
     stats = get_daily_sales()
     st.metric("今日營收", f"${stats['revenue']:,.0f}")
     st.metric("訂單數", stats['orders'])
@@ -54,20 +240,44 @@ if 'sale_done' in st.session_state and st.session_state.sale_done:
     </div>
     """, unsafe_allow_html=True)
     if st.button("🔄 下一筆交易"):
-        st.session_state.sale_done = False
-        st.session_state.cart = []
-        st.session_state.selected_member = None
+        start_new_transaction()
         st.rerun()
 
+# 量測本頁繪製耗時；st.rerun() 中斷的執行不列入
+page_timer = metrics.timer(f"page.{page}").start()
 
 if page == "收銀前台":
     st.title("🛒 收銀前台")
     col1, col2 = st.columns([3, 1])
 
     with col1:
-        search = st.text_input("🔍 搜尋商品", placeholder="輸入商品名稱或條碼...")
-        products = get_products(search)
+        scan_mode = st.toggle("📠 連續掃描", key="scan_mode", help="掃描槍連續輸入多個條碼，一次加入購物車")
+        if scan_mode:
+            # 表單內的輸入不會觸發重新執行：掃描槍每個條碼後的 Enter 只是換行，
+            # 送出時所有條碼以單一查詢解析，整批只重新執行一次
+            with st.form("scan_form", clear_on_submit=True):
+                codes = st.text_area("條碼（每行一個）", key="scan_codes", height=200,
+                                     placeholder="連續掃描後按「加入購物車」或 Ctrl+Enter")
+                submitted = st.form_submit_button("🛒 加入購物車", type="primary")
+            if submitted and codes.strip():
+                added, unknown, short = add_scanned(codes)
+                if added:
+                    st.success(f"✅ 已加入 {added} 件商品")
+                if unknown:
+                    st.warning(f"⚠️ 找不到條碼（{len(unknown)} 個）：{'、'.join(unknown)}")
+                if short:
+                    st.warning(f"⚠️ 庫存不足：{'、'.join(short)}")
+            # 掃描模式不顯示商品格，重新執行時不必繪製
+            products = []
+        else:
+            search = st.text_input("🔍 搜尋商品", placeholder="輸入商品名稱、類別或條碼...", key="search", on_change=scan_barcode)
+            if search:
+                products = get_products(search)
+            else:
+                category = st.selectbox("類別", ["全部"] + get_categories(), key="grid_category")
+                products = paginate_products("grid", category=None if category == "全部" else category)
         if products:
+            engine = promotion_engine.get_engine()
             cols = st.columns(4)
             for i, p in enumerate(products):
                 p = list(p)
@@ -75,38 +285,22 @@ if page == "收銀前台":
                     p[5] = 0
                 
                 # 檢查是否有促銷
-                promos = get_promotions(p[0])
+                promo = engine.best_rule(p[0])
                 promo_text = ""
-                if promos:
-                    promo = dict(promos[0])
-                    if promo['type'] == 'percent':
-                        promo_text = f" 🔥 {int(promo['value'])}%OFF"
-                    elif promo['type'] == 'bogo':
+                if promo:
+                    if promo.type == 'percent':
+                        promo_text = f" 🔥 {int(promo.value)}%OFF"
+                    elif promo.type == 'bogo':
                         promo_text = " 🔥 買一送一"
-                    elif promo['type'] == 'second_discount':
-                        promo_text = f" 🔥 第2件{int(promo['value'])}%OFF"
+                    elif promo.type == 'second_discount':
+                        promo_text = f" 🔥 第2件{int(promo.value)}%OFF"
                 
                 with cols[i % 4]:
                     st.write(f"**{p[1]}**{promo_text}")
                     st.caption(f"含稅: ${p[3]} | 未稅: ${p[2]} | 庫存: {p[5]}")
-                    if (p[5] or 0) > 0 and st.button(f"加入購物車", key=f"add_{p[0]}"):
-                        # 檢查是否已存在，合併數量
-                        found = False
-                        for item in st.session_state.cart:
-                            if item['product_id'] == p[0]:
-                                item['quantity'] += 1
-                                item['subtotal'] = item['quantity'] * item['price']
-                                found = True
-                                break
-                        if not found:
-                            st.session_state.cart.append({
-                                'product_id': p[0], 
-                                'name': p[1], 
-                                'price': p[3], 
-                                'quantity': 1, 
-                                'subtotal': p[3]
-                            })
-                        st.rerun()
+                    if (p[5] or 0) > 0:
+                        # 在重新執行前加入，按一次只重新執行一次
+                        st.button("加入購物車", key=f"add_{p[0]}", on_click=add_to_cart, args=(p,))
 
     with col2:
         st.markdown("### 🛒 購物車")
@@ -116,12 +310,19 @@ if page == "收銀前台":
         if 'selected_member' not in st.session_state:
             st.session_state.selected_member = None
         
-        member_search = st.text_input("輸入會員電話", placeholder="09xxxxxxxx", key="member_search")
+        member_search = st.text_input("輸入會員電話或姓名", placeholder="電話開頭、末碼或姓名", key="member_search")
         if member_search:
-            member = get_member_by_phone(member_search)
-            if member:
-                st.session_state.selected_member = member
-                st.success(f"✅ 已登入: {member[1]}")
+            matches = search_members(member_search)
+            exact = [m for m in matches if m[2] == member_search.strip()]
+            if exact:
+                st.session_state.selected_member = exact[0]
+                st.success(f"✅ 已登入: {exact[0][1]}")
+            elif matches:
+                # 部分號碼或姓名：列出最相符的會員供選擇
+                for m in matches:
+                    if st.button(f"{m[1]}（{m[2]}）", key=f"member_{m[0]}"):
+                        st.session_state.selected_member = m
+                        st.rerun()
             else:
                 st.warning("找不到會員")
                 if st.button("清除"):
@@ -137,57 +338,31 @@ if page == "收銀前台":
         
         st.markdown("---")
         
-        # 顯示購物車並計算促銷
-        cart_with_promo = []
-        promo_discount = 0
+        # 整台購物車計價（商品促銷 + 整單滿額）；只有異動過的行會重算商品促銷
+        cart = st.session_state.cart
+        pricing = cart.price(promotion_engine.get_engine())
+        promo_discount = pricing.total_discount
         
-        for i, item in enumerate(st.session_state.cart):
-            # 檢查此商品是否有促銷
-            promos = get_promotions(item['product_id'])
-            item_discount = 0
-            promo_name = ""
-            
-            if promos:
-                item_discount = calculate_promotion(item, promos)
-                promo_discount += item_discount
-                promo_dict = dict(promos[0])
-                promo_name = promo_dict['name']
-            
-            cart_with_promo.append({
-                **item,
-                'discount': item_discount,
-                'promo_name': promo_name
-            })
-            
+        for line in cart:
             c1, c2, c3, c4, c5 = st.columns([2, 1, 1, 1, 1])
-            c1.markdown(f"**{item['name']}**")
-            c2.write(f"x{item['quantity']}")
-            if c3.button("➕", key=f"plus_{i}"):
-                st.session_state.cart[i]['quantity'] += 1
-                st.session_state.cart[i]['subtotal'] = st.session_state.cart[i]['quantity'] * st.session_state.cart[i]['price']
-                st.rerun()
-            if c4.button("➖", key=f"minus_{i}"):
-                if st.session_state.cart[i]['quantity'] > 1:
-                    st.session_state.cart[i]['quantity'] -= 1
-                    st.session_state.cart[i]['subtotal'] = st.session_state.cart[i]['quantity'] * st.session_state.cart[i]['price']
-                else:
-                    st.session_state.cart.pop(i)
-                st.rerun()
-            if item_discount > 0:
-                c5.markdown(f"~~${item['subtotal']}~~ 💰${item['subtotal'] - item_discount}")
+            c1.markdown(f"**{line.name}**")
+            c2.write(f"x{line.quantity}")
+            # 以 on_click 在重新執行前更新數量，按一次只需重新執行一次
+            c3.button("➕", key=f"plus_{line.product_id}", on_click=cart.update, args=(line.product_id, 1))
+            c4.button("➖", key=f"minus_{line.product_id}", on_click=cart.update, args=(line.product_id, -1))
+            if line.discount > 0:
+                c5.markdown(f"~~${line.subtotal}~~ 💰${line.subtotal - line.discount}")
             else:
-                c5.write(f"${item['subtotal']}")
+                c5.write(f"${line.subtotal}")
 
-        if len(st.session_state.cart) > 0:
-            if st.button("🗑️ 清空購物車"):
-                st.session_state.cart = []
-                st.rerun()
+        if cart:
+            st.button("🗑️ 清空購物車", on_click=cart.clear)
 
-        if st.session_state.cart:
-            # 計算小計
-            subtotal = sum(item['subtotal'] for item in st.session_state.cart)
+            subtotal = cart.subtotal
             
             # 顯示促銷折扣
+            for rule in pricing.basket_promotions:
+                st.info(f"🏷️ {rule.name}")
             if promo_discount > 0:
                 st.success(f"🎉 促銷折扣: -${promo_discount:.1f}")
             
@@ -212,22 +387,35 @@ if page == "收銀前台":
                     cash = total
                     change = 0
             
-            if cash >= total:
+            # 已結帳的購物車不再顯示結帳按鈕
+            if cash >= total and not st.session_state.get('sale_done'):
                 # 結帳按鈕
                 if st.button("💰 結帳", type="primary"):
                     # 建立銷售記錄
                     member_id = st.session_state.selected_member[0] if st.session_state.selected_member else None
                     total_discount = discount + promo_discount
-                    create_sale(member_id, subtotal, total_discount, total, cash, change, st.session_state.cart)
-                    
-                    # 設定完成標記，訊息會顯示在最上面
-                    st.session_state.sale_done = True
-                    st.session_state.sale_cash = cash
-                    st.session_state.sale_change = change
-                    st.rerun()
+                    try:
+                        if journal.ENABLED:
+                            # 先寫入本機日誌立即完成，資料庫由背景寫入
+                            journal.get_journal().submit(member_id, subtotal, total_discount, total, cash, change,
+                                                         cart.lines(), idempotency_key=st.session_state.checkout_key)
+                        else:
+                            create_sale(member_id, subtotal, total_discount, total, cash, change, cart.lines(),
+                                        idempotency_key=st.session_state.checkout_key)
+                    except InsufficientStockError as e:
+                        st.error(f"❌ {str(e)}")
+                    else:
+                        # 設定完成標記，訊息會顯示在最上面
+                        st.session_state.sale_done = True
+                        st.session_state.sale_cash = cash
+                        st.session_state.sale_change = change
+                        st.rerun()
 
 
 elif page == "商品管理":
+    # pandas / 匯入模組只在需要的頁面載入，收銀前台首次開啟不必等待
+    import pandas as pd
+    import importer
     st.title("📦 商品管理")
 
     # 匯入匯出區塊
@@ -236,44 +424,20 @@ elif page == "商品管理":
         
         with col1:
             st.subheader("📤 匯出商品")
-            if st.button("匯出商品 CSV"):
-                products = get_products()
-                df = pd.DataFrame(products, columns=["ID", "名稱", "售價未稅", "售價含稅", "成本", "庫存", "條碼", "類別", "建立時間"])
-                csv = df.to_csv(index=False, encoding='utf-8-sig')
-                st.download_button(
-                    label="下載 CSV",
-                    data=csv,
-                    file_name="products.csv",
-                    mime="text/csv"
-                )
+            export_section("products", "商品")
         
         with col2:
             st.subheader("📥 匯入商品")
-            uploaded_file = st.file_uploader("選擇 CSV 檔案", type=['csv'])
+            uploaded_file = st.file_uploader("選擇 CSV / XLSX 檔案", type=['csv', 'xlsx'])
             if uploaded_file is not None:
                 try:
-                    df = pd.read_csv(uploaded_file)
                     st.write("預覽：")
-                    st.dataframe(df.head())
+                    st.dataframe(importer.preview(uploaded_file, uploaded_file.name))
+                    st.caption("依條碼更新既有商品，條碼空白或不存在則新增")
                     
                     if st.button("確認匯入"):
-                        import_count = 0
-                        for _, row in df.iterrows():
-                            try:
-                                add_product(
-                                    name=str(row['名稱']),
-                                    price_ex_tax=float(row['售價未稅']) if pd.notna(row['售價未稅']) else 0,
-                                    price_inc_tax=float(row['售價含稅']) if pd.notna(row['售價含稅']) else 0,
-                                    cost=float(row['成本']) if pd.notna(row['成本']) else 0,
-                                    stock=int(row['庫存']) if pd.notna(row['庫存']) else 0,
-                                    barcode=str(row['條碼']) if pd.notna(row['條碼']) else "",
-                                    category=str(row['類別']) if pd.notna(row['類別']) else ""
-                                )
-                                import_count += 1
-                            except Exception as e:
-                                continue
-                        st.success(f"✅ 成功匯入 {import_count} 筆商品")
-                        st.rerun()
+                        show_import_report(importer.import_products(
+                            uploaded_file, uploaded_file.name, progress=import_progress()))
                 except Exception as e:
                     st.error(f"❌ 匯入失敗: {str(e)}")
 
@@ -299,22 +463,29 @@ elif page == "商品管理":
             
             if st.form_submit_button("💾 新增商品"):
                 if new_name:
-                    add_product(
-                        name=new_name,
-                        price_ex_tax=new_price_ex,
-                        price_inc_tax=price_inc,
-                        cost=new_cost,
-                        stock=new_stock,
-                        barcode=new_barcode,
-                        category=new_category
-                    )
-                    st.success(f"✅ 已新增商品: {new_name}")
-                    st.rerun()
+                    try:
+                        add_product(
+                            name=new_name,
+                            price_ex_tax=new_price_ex,
+                            price_inc_tax=price_inc,
+                            cost=new_cost,
+                            stock=new_stock,
+                            barcode=new_barcode,
+                            category=new_category
+                        )
+                        st.success(f"✅ 已新增商品: {new_name}")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"❌ 新增失敗（條碼是否重複？）: {str(e)}")
                 else:
                     st.error("請輸入商品名稱")
 
     # 選擇商品進行管理
-    products = get_products()
+    product_search = st.text_input("🔍 搜尋要管理的商品", placeholder="輸入商品名稱、類別或條碼...", key="manage_search")
+    if product_search:
+        products = get_products(product_search)
+    else:
+        products = paginate_products("manage", order_by="name")
     product_options = {f"{p[1]} (${p[3]})": p[0] for p in products}
     
     if product_options:
@@ -344,14 +515,41 @@ elif page == "商品管理":
             
             col1, col2 = st.columns(2)
             if col1.button("💾 更新商品"):
-                update_product(product_id, new_name, new_price_ex, new_price_inc, new_cost, new_stock, new_barcode, new_category)
-                st.success("✅ 商品已更新")
-                st.rerun()
+                try:
+                    # 只套用庫存差額，編輯期間的銷售不會被覆蓋
+                    update_product(product_id, new_name, new_price_ex, new_price_inc, new_cost, new_stock, new_barcode, new_category,
+                                   stock_was=int(product[5] or 0))
+                    st.success("✅ 商品已更新")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"❌ 更新失敗（條碼是否重複？）: {str(e)}")
             if col2.button("🗑️ 刪除商品", type="primary"):
                 delete_product(product_id)
                 st.success("✅ 商品已刪除")
                 st.rerun()
         
+        # 庫存異動
+        with st.expander("📦 庫存異動"):
+            with st.form("stock_movement"):
+                c1, c2, c3 = st.columns([1, 1, 2])
+                kind = c1.selectbox("類型", ["receipt", "adjustment", "return"], format_func=STOCK_MOVEMENT_KINDS.get)
+                quantity = c2.number_input("數量（調整可為負數）", value=1, step=1)
+                note = c3.text_input("備註", placeholder="例如：供應商進貨單號")
+                if st.form_submit_button("💾 記錄異動"):
+                    try:
+                        balance = record_stock_movement(product_id, kind, int(quantity), note)
+                        st.success(f"✅ 已記錄，目前庫存 {balance}")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"❌ 記錄失敗: {str(e)}")
+            movements = get_stock_movements(product_id)
+            if movements:
+                df = pd.DataFrame(movements, columns=["ID", "商品", "類型", "數量", "結餘", "銷售ID", "備註", "時間"])
+                df["類型"] = df["類型"].map(STOCK_MOVEMENT_KINDS).fillna(df["類型"])
+                st.dataframe(df.drop(columns=["商品"]), hide_index=True)
+            else:
+                st.info("尚無庫存異動")
+
         # 促銷設定
         with st.expander("🏷️ 促銷設定", expanded=True):
             st.write("### 🎫 目前促銷")
@@ -411,18 +609,29 @@ elif page == "商品管理":
                 elif promo_type == 'amount':
                     promo_value = st.number_input("折扣金額", min_value=0.0, value=50.0)
                     min_amount = st.number_input("最低消費金額", min_value=0.0, value=200.0)
+                    st.caption("滿額折扣以整張訂單小計計算，訂單需包含此商品")
+                
+                c1, c2 = st.columns(2)
+                start_date = c1.date_input("開始日期（可選）", value=None)
+                end_date = c2.date_input("結束日期（可選）", value=None)
+                c1, c2 = st.columns(2)
+                priority = c1.number_input("優先順序", value=0, step=1, help="數字越大越優先")
+                exclusive = c2.checkbox("獨佔（不與其他促銷併用）")
                 
                 if st.form_submit_button("➕ 新增促銷"):
-                    if promo_type == 'amount':
-                        add_promotion(promo_name, promo_type, promo_value, product_id, min_amount=min_amount)
-                    else:
-                        add_promotion(promo_name, promo_type, promo_value, product_id)
+                    add_promotion(promo_name, promo_type, promo_value, product_id,
+                                  min_amount=min_amount if promo_type == 'amount' else 0,
+                                  start_date=start_date and start_date.isoformat(),
+                                  end_date=end_date and end_date.isoformat(),
+                                  priority=int(priority), exclusive=exclusive)
                     st.success("✅ 促銷已新增")
                     st.rerun()
     else:
-        st.warning("尚無商品，請先新增商品")
+        st.warning("找不到符合的商品" if product_search else "尚無商品，請先新增商品")
 
 elif page == "會員管理":
+    import pandas as pd
+    import importer
     st.title("👥 會員管理")
 
     # 匯入匯出區塊
@@ -431,40 +640,20 @@ elif page == "會員管理":
         
         with col1:
             st.subheader("📤 匯出會員")
-            if st.button("匯出會員 CSV"):
-                members = get_members()
-                df = pd.DataFrame(members, columns=["ID", "姓名", "電話", "Email", "積分", "總消費", "建立時間"])
-                csv = df.to_csv(index=False, encoding='utf-8-sig')
-                st.download_button(
-                    label="下載 CSV",
-                    data=csv,
-                    file_name="members.csv",
-                    mime="text/csv"
-                )
+            export_section("members", "會員")
         
         with col2:
             st.subheader("📥 匯入會員")
-            uploaded_file = st.file_uploader("選擇 CSV 檔案", type=['csv'], key="member_upload")
+            uploaded_file = st.file_uploader("選擇 CSV / XLSX 檔案", type=['csv', 'xlsx'], key="member_upload")
             if uploaded_file is not None:
                 try:
-                    df = pd.read_csv(uploaded_file)
                     st.write("預覽：")
-                    st.dataframe(df.head())
+                    st.dataframe(importer.preview(uploaded_file, uploaded_file.name))
+                    st.caption("依電話更新既有會員，電話不存在則新增")
                     
                     if st.button("確認匯入會員"):
-                        import_count = 0
-                        for _, row in df.iterrows():
-                            try:
-                                add_member(
-                                    name=str(row['姓名']),
-                                    phone=str(row['電話']),
-                                    email=str(row['Email']) if pd.notna(row['Email']) else ""
-                                )
-                                import_count += 1
-                            except Exception as e:
-                                continue
-                        st.success(f"✅ 成功匯入 {import_count} 筆會員")
-                        st.rerun()
+                        show_import_report(importer.import_members(
+                            uploaded_file, uploaded_file.name, progress=import_progress()))
                 except Exception as e:
                     st.error(f"❌ 匯入失敗: {str(e)}")
 
@@ -477,84 +666,203 @@ elif page == "會員管理":
                 add_member(name, phone, email)
                 st.rerun()
 
-    members = get_members()
+    member_query = st.text_input("🔍 搜尋會員", placeholder="電話開頭、末碼或姓名")
+    if member_query:
+        members = search_members(member_query)
+    else:
+        # 伺服器端分頁，每次只讀取一頁
+        members = paginate("members", get_members_page, count_members(), "位會員")
     if members:
-        # 顯示會員列表（使用索引確保正確顯示）
-        member_data = []
-        for m in members:
-            # 使用索引取得資料
-            member_data.append([
-                m[0],  # ID
-                m[1],  # 姓名
-                m[2],  # 電話
-                m[3],  # Email
-                m[4],  # 積分
-                m[5],  # 總消費
-                m[6]   # 建立時間
-            ])
-        st.dataframe(pd.DataFrame(member_data, columns=["ID", "姓名", "電話", "Email", "積分", "總消費", "建立時間"]))
+        st.dataframe(pd.DataFrame([tuple(m) for m in members], columns=["ID", "姓名", "電話", "Email", "積分", "總消費", "建立時間"]),
+                     hide_index=True)
+    elif member_query:
+        st.warning("找不到符合的會員")
 
 
 elif page == "銷售報表":
+    import pandas as pd
     st.title("📊 銷售報表")
 
     # 匯出區塊
     with st.expander("📤 匯出銷售資料"):
-        if st.button("匯出銷售 CSV"):
-            sales = get_sales()
-            if sales:
-                df = pd.DataFrame(sales, columns=["ID", "會員ID", "小計", "折扣", "總額", "收款", "找零", "方式", "時間", "會員名"])
-                csv = df.to_csv(index=False, encoding='utf-8-sig')
-                st.download_button(
-                    label="下載 CSV",
-                    data=csv,
-                    file_name="sales.csv",
-                    mime="text/csv"
-                )
+        export_section("sales", "銷售", with_dates=True)
+        st.write("---")
+        export_section("sale_items", "銷售明細", with_dates=True)
     
-    sales = get_sales()
-    if sales:
-        df = pd.DataFrame(sales, columns=["ID", "會員", "小計", "折扣", "總額", "收款", "找零", "方式", "時間", "會員名"])
-        st.dataframe(df)
-        
-        # 統計
-        col1, col2, col3 = st.columns(3)
-        col1.metric("總營收", f"${df['總額'].sum():,.0f}")
-        col2.metric("總訂單數", len(df))
-        col3.metric("平均訂單", f"${df['總額'].mean():,.0f}")
-        
-        # 圖表
-        st.subheader("📈 營收趨勢")
+    # 篩選條件（預設最近 30 天）；查詢、統計與分頁都在資料庫端完成
+    today = datetime.now().date()
+    col1, col2, col3 = st.columns(3)
+    date_range = col1.date_input("日期區間", value=(today - timedelta(days=29), today))
+    method = col2.selectbox("付款方式", ["全部"] + get_payment_methods())
+    member_phone = col3.text_input("會員電話")
+    col4, col5 = st.columns(2)
+    min_total = col4.number_input("最低金額", min_value=0.0, value=0.0, step=100.0)
+    max_total = col5.number_input("最高金額（0 表示不限）", min_value=0.0, value=0.0, step=100.0)
+
+    member_id = None
+    if member_phone:
+        member = get_member_by_phone(member_phone.strip())
+        if member is None:
+            st.warning("找不到會員")
+        # 找不到會員時以不存在的 id 篩選，結果為空
+        member_id = member[0] if member else 0
+    filters = {
+        "start": date_range[0].isoformat() if date_range else None,
+        "end": date_range[-1].isoformat() if date_range else None,
+        "member_id": member_id,
+        "payment_method": None if method == "全部" else method,
+        "min_total": min_total or None,
+        "max_total": max_total or None,
+    }
+
+    tab_sales, tab_top, tab_margin, tab_hour, tab_basket = st.tabs(
+        ["📋 銷售明細", "🏆 熱銷商品", "💹 類別毛利", "🕐 時段分析", "🧺 客單件數"])
+    with tab_sales:
         try:
-            df['日期'] = pd.to_datetime(df['時間']).dt.date
-            daily = df.groupby('日期')['總額'].sum().sort_index()
-            st.line_chart(daily)
+            summary = get_sales_summary(**filters)
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("總營收", f"${summary['revenue']:,.0f}")
+            col2.metric("總訂單數", f"{summary['orders']:,}")
+            col3.metric("平均訂單", f"${summary['average']:,.0f}")
+            col4.metric("總折扣", f"${summary['discount']:,.0f}")
+
+            sales = paginate("sales", lambda before: get_sales_page(before=before, **filters), summary["orders"],
+                             "筆銷售", tuple(filters.items()), SALES_PAGE_SIZE)
+        except Exception as e:
+            st.error(f"❌ 查詢失敗: {str(e)}")
+            sales = []
+        if sales:
+            sales = [tuple(s) for s in sales]
+            df = pd.DataFrame(sales, columns=["ID", "會員", "小計", "折扣", "總額", "收款", "找零", "方式", "時間", "會員名"])
+            st.dataframe(df, hide_index=True)
+
+            # 明細只在選取時讀取
+            sale = st.selectbox("查看明細", sales, index=None, placeholder="選擇銷售",
+                                format_func=lambda s: f"#{s[0]}　{s[8]}　${s[4]:,.0f}")
+            if sale is not None:
+                items = get_sale_items(sale[0], sale[8])
+                st.dataframe(pd.DataFrame([tuple(i)[2:] for i in items], columns=["商品ID", "商品名稱", "數量", "單價", "小計"]),
+                             hide_index=True)
+
+            # 圖表
+            st.subheader("📈 營收趨勢")
+            # 直接讀取每日彙總表，不需重新彙總所有銷售紀錄
+            daily = pd.DataFrame(get_daily_sales_trend(filters["start"] or "", filters["end"] or "9999-12-31"),
+                                 columns=["日期", "訂單數", "營收", "折扣", "件數"]).set_index("日期")
+            st.line_chart(daily["營收"])
             # 顯示數據
             st.write("每日營收：")
             st.dataframe(daily)
-        except Exception as e:
-            st.warning(f"無法顯示趨勢圖：{str(e)}")
+        else:
+            st.info("沒有符合條件的銷售")
+
+    # 分析報表只讀 analytics/ 下的 Parquet 檔，不查詢 pos.db
+    with tab_top:
+        analytics_sync_controls()
+        show_analytics(analytics.best_sellers, filters,
+                       {"product_id": "商品ID", "product_name": "商品", "category": "類別", "quantity": "數量", "revenue": "營收"},
+                       chart=("商品", "數量"))
+    with tab_margin:
+        show_analytics(analytics.margin_by_category, filters,
+                       {"category": "類別", "quantity": "數量", "revenue": "營收", "cost": "成本", "margin": "毛利",
+                        "margin_rate": "毛利率"}, chart=("類別", "毛利"))
+    with tab_hour:
+        show_analytics(analytics.sales_by_hour, filters,
+                       {"hour": "時段 (UTC)", "orders": "訂單數", "revenue": "營收", "average": "平均訂單"},
+                       chart=("時段 (UTC)", "訂單數"))
+    with tab_basket:
+        show_analytics(analytics.basket_sizes, filters,
+                       {"items": "件數", "orders": "訂單數", "average": "平均金額"}, chart=("件數", "訂單數"))
+
+    # 由庫存異動帳直接查出時點庫存，不需重播歷史
+    with st.expander("📦 庫存估值"):
+        valuation_date = st.date_input("估值日期", value=datetime.now().date())
+        valuation = get_inventory_valuation(valuation_date.isoformat())
+        if valuation:
+            df = pd.DataFrame(valuation, columns=["ID", "名稱", "類別", "成本", "庫存", "金額"])
+            st.metric("庫存總值（以目前成本計算）", f"${df['金額'].sum():,.0f}")
+            st.dataframe(df, hide_index=True)
+        else:
+            st.info("該日期沒有庫存")
 
 
 elif page == "資料管理":
+    import pandas as pd
     st.title("💾 資料管理")
     
     st.warning("⚠️ 以下操作會影響資料庫，請先備份！")
     
-    with st.expander("🗑️ 清除所有資料"):
-        st.write("此操作會清除所有銷售紀錄，但保留商品和會員資料。")
-        if st.button("確認清除銷售資料", type="primary"):
-            st.info("功能開發中...")
+    with st.expander("🔄 重建每日銷售彙總"):
+        st.write("由銷售紀錄重新計算側邊欄與營收趨勢使用的每日彙總。")
+        if st.button("重建彙總"):
+            rebuild_daily_sales_summary()
+            st.success("✅ 每日銷售彙總已重建")
+    
+    with st.expander("📦 封存舊銷售資料"):
+        st.write("把舊月份的銷售紀錄搬到 archive/ 目錄下的每月封存檔，保持資料庫精簡；匯出時仍會一併讀取封存資料。")
+        keep_months = st.number_input("保留月數（含本月）", min_value=1, value=3, step=1)
+        st.caption(f"將封存約 {count_archivable_sales(int(keep_months)):,} 筆銷售")
+        if st.button("開始封存", type="primary"):
+            status = st.empty()
+            try:
+                moved = archive_sales(int(keep_months),
+                                      progress=lambda month, count: status.write(f"{month}：已搬移 {count:,} 筆"))
+                status.empty()
+                st.success(f"✅ 已封存 {len(moved)} 個月份、{sum(moved.values()):,} 筆銷售")
+            except Exception as e:
+                st.error(f"❌ 封存失敗: {str(e)}")
+        archives = get_archives()
+        if archives:
+            st.dataframe(pd.DataFrame(archives, columns=['月份', '檔案', '銷售筆數', '明細筆數', '封存時間']),
+                         hide_index=True)
     
     with st.expander("💾 備份資料庫"):
-        st.write("下載完整的 SQLite 資料庫檔案")
-        if os.path.exists("pos.db"):
-            with open("pos.db", "rb") as f:
-                st.download_button(
-                    label="下載資料庫",
-                    data=f,
-                    file_name="pos_backup.db",
-                    mime="application/octet-stream"
-                )
+        st.write("以 SQLite 線上備份建立壓縮快照，備份期間收銀台可照常結帳；每份快照都會通過完整性檢查。")
+        if st.button("建立備份快照"):
+            bar = st.progress(0.0)
+            try:
+                result = backup.snapshot(progress=lambda done, total: bar.progress(done / total if total else 1.0))
+                st.success(f"✅ 已建立 {os.path.basename(result.path)}（{result.size / 1e6:,.1f} MB，{result.seconds:.1f} 秒）")
+            except Exception as e:
+                st.error(f"❌ 備份失敗: {str(e)}")
+        snapshots = backup.list_snapshots()
+        if snapshots:
+            names = {os.path.basename(path): path for path, _, _ in snapshots}
+            choice = st.selectbox("快照", list(names),
+                                  format_func=lambda name: f"{name}（{os.path.getsize(names[name]) / 1e6:,.1f} MB）")
+            # 下載按鈕會把整份快照讀進記憶體，只在按下準備下載的那次執行才建立；
+            # 大型快照請直接由 backups/ 目錄複製
+            if st.button("準備下載", key="backup_prepare"):
+                with open(names[choice], "rb") as f:
+                    st.download_button(label="下載快照", data=f, file_name=choice, mime="application/gzip")
         else:
-            st.info("資料庫尚未建立")
+            st.info("尚未建立備份快照")
+
+
+elif page == "效能診斷":
+    import pandas as pd
+    st.title("🩺 效能診斷")
+    st.caption("SQL 查詢與頁面繪製耗時（最近 1000 次的百分位數）；page.*.sql 為該頁花在 SQLite 的時間")
+    snapshot = metrics.snapshot()
+    if snapshot:
+        df = pd.DataFrame.from_dict(snapshot, orient="index")
+        df = df[["count", "rows", "p50_ms", "p95_ms", "p99_ms", "max_ms", "total_ms"]]
+        df.columns = ["次數", "列數", "p50 (ms)", "p95 (ms)", "p99 (ms)", "最大 (ms)", "累計 (ms)"]
+        st.dataframe(df.sort_values("累計 (ms)", ascending=False).round(3))
+    else:
+        st.info("尚無資料")
+    st.subheader("讀取快取")
+    cache = cache_stats()
+    if cache:
+        df = pd.DataFrame.from_dict(cache, orient="index")
+        df["命中率"] = (df["hits"] / (df["hits"] + df["misses"])).map("{:.0%}".format)
+        df.columns = ["命中", "未命中", "快取筆數", "命中率"]
+        st.dataframe(df)
+    c1, c2 = st.columns(2)
+    c1.download_button("下載 JSON", metrics.dump_json(cache=cache), file_name="pos_metrics.json",
+                       mime="application/json")
+    if c2.button("清除統計"):
+        metrics.reset()
+        st.rerun()
+
+page_timer.stop()
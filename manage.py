@@ -0,0 +1,161 @@
+"""POS 維護指令
+
+用法：
+    python manage.py migrate                          套用結構遷移
+    python manage.py rebuild-summary [--start DATE]   重建每日銷售彙總
+    python manage.py archive [--keep-months N] [--vacuum]
+                                                      封存舊月份的銷售資料
+    python manage.py backup [--output PATH|-] [--keep N] [--every MINUTES]
+                                                      線上備份（預設寫入 backups/ 快照）
+    python manage.py verify-backup PATH               檢查備份檔完整性
+    python manage.py analytics-sync [--rebuild]       更新分析用的 Parquet 檔
+    python manage.py journal-replay                   把結帳日誌中尚未寫入的銷售寫入資料庫
+    python manage.py export NAME [--format csv] [--start DATE] [--end DATE] --output PATH|-
+                                                      匯出資料表（記憶體用量固定，適合大量資料）
+"""
+import argparse
+import os
+import sys
+import time
+
+import analytics
+import backup
+import database
+import exporter
+import journal
+
+
+def cmd_migrate(args):
+    database.init_db()
+    print(f"✅ 結構版本 {database.get_schema_version()}")
+
+
+def cmd_rebuild_summary(args):
+    database.init_db()
+    database.rebuild_daily_sales_summary(args.start)
+    days = database.get_daily_sales_trend(args.start or "")
+    print(f"✅ 已重建 {len(days)} 天的每日銷售彙總")
+
+
+def cmd_archive(args):
+    database.init_db()
+    moved = database.archive_sales(args.keep_months,
+                                   progress=lambda month, count: print(f"  {month}: {count:,} 筆", end="\r"))
+    print(" " * 40, end="\r")
+    for month, count in moved.items():
+        print(f"  {month}: {count:,} 筆")
+    print(f"✅ 已封存 {len(moved)} 個月份、{sum(moved.values()):,} 筆銷售")
+    if args.vacuum:
+        # 刪除的空間在 VACUUM 後才會還給檔案系統
+        with database.get_connection() as conn:
+            conn.execute("VACUUM")
+        print("✅ 已壓縮資料庫")
+
+
+def cmd_backup(args):
+    if args.output == "-":
+        # 壓縮後的備份直接寫到標準輸出，例如導向 ssh 或物件儲存
+        backup.write_backup(sys.stdout.buffer)
+        return
+    while True:
+        if args.output:
+            result = backup.backup_to(args.output)
+        else:
+            result = backup.snapshot(keep=args.keep)
+        print(f"✅ {result.path}（{result.pages:,} 頁，{result.size / 1e6:,.1f} MB，{result.seconds:.1f} 秒）",
+              flush=True)
+        if not args.every:
+            return
+        time.sleep(args.every * 60)
+
+
+def cmd_verify_backup(args):
+    try:
+        backup.verify(args.path)
+    except backup.BackupError as e:
+        print(f"❌ {e}")
+        return 1
+    print(f"✅ {args.path} 完整性檢查通過")
+
+
+def cmd_analytics_sync(args):
+    database.init_db()
+    run = analytics.rebuild if args.rebuild else analytics.sync
+    counts = run(progress=lambda name, count: print(f"  {name}: {count:,} 筆", end="\r"))
+    print(" " * 40, end="\r")
+    status = analytics.status()
+    print(f"✅ 已同步 {counts['sales']:,} 筆銷售、{counts['sale_items']:,} 筆明細"
+          f"（共 {status['files']} 個檔案，{status['bytes'] / 1e6:,.1f} MB）")
+
+
+def cmd_journal_replay(args):
+    database.init_db()
+    sale_journal = journal.SaleJournal(database.DB_PATH + ".journal")
+    applied = sale_journal.flush()
+    print(f"✅ 已回放 {applied:,} 筆銷售")
+    if os.path.exists(sale_journal.failed_path):
+        print(f"⚠️ 無法寫入的記錄保留在 {sale_journal.failed_path}")
+        return 1
+
+
+def cmd_export(args):
+    database.init_db()
+    if args.output == "-":
+        exporter.export(args.name, args.format, sys.stdout.buffer, args.start, args.end)
+        return
+    # 先寫暫存檔，完成後才出現在目標路徑
+    with open(args.output + ".part", "wb") as out:
+        exporter.export(args.name, args.format, out, args.start, args.end)
+    os.replace(args.output + ".part", args.output)
+    print(f"✅ {args.output}（{os.path.getsize(args.output) / 1e6:,.1f} MB）")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="POS 維護指令")
+    parser.add_argument("--db", default=database.DB_PATH, help="資料庫路徑（預設 pos.db）")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("migrate", help="套用結構遷移").set_defaults(func=cmd_migrate)
+
+    rebuild = commands.add_parser("rebuild-summary", help="由銷售紀錄重建每日銷售彙總")
+    rebuild.add_argument("--start", help="只重建此日期（YYYY-MM-DD）之後的資料")
+    rebuild.set_defaults(func=cmd_rebuild_summary)
+
+    archive = commands.add_parser("archive", help="把舊月份的銷售與明細搬到 archive/ 下的每月封存檔")
+    archive.add_argument("--keep-months", type=int, default=3, help="保留在資料庫中的月數（含本月，預設 3）")
+    archive.add_argument("--vacuum", action="store_true", help="封存後壓縮資料庫檔案")
+    archive.set_defaults(func=cmd_archive)
+
+    backup_parser = commands.add_parser("backup", help="線上備份資料庫（不影響結帳）")
+    backup_parser.add_argument("--output", help="備份檔路徑（.gz 結尾時壓縮；- 表示壓縮後寫到標準輸出），"
+                                                "預設在 backups/ 建立快照")
+    backup_parser.add_argument("--keep", type=int, default=backup.KEEP, help="保留的快照份數")
+    backup_parser.add_argument("--every", type=float, help="每隔幾分鐘建立一次快照（持續執行）")
+    backup_parser.set_defaults(func=cmd_backup)
+
+    verify = commands.add_parser("verify-backup", help="檢查備份檔（.db 或 .db.gz）的完整性")
+    verify.add_argument("path")
+    verify.set_defaults(func=cmd_verify_backup)
+
+    sync = commands.add_parser("analytics-sync", help="把新的銷售增量同步到 analytics/ 的 Parquet 檔")
+    sync.add_argument("--rebuild", action="store_true", help="刪除既有分析檔並從頭同步")
+    sync.set_defaults(func=cmd_analytics_sync)
+
+    commands.add_parser("journal-replay", help="回放結帳日誌（介面與 API 啟動時也會自動回放）").set_defaults(
+        func=cmd_journal_replay)
+
+    export = commands.add_parser("export", help="以串流方式匯出資料表到檔案或標準輸出")
+    export.add_argument("name", choices=list(exporter.EXPORT_COLUMNS))
+    export.add_argument("--format", choices=list(exporter.FORMATS), default="csv")
+    export.add_argument("--start", help="開始日期（YYYY-MM-DD，含當日；sales / sale_items 適用）")
+    export.add_argument("--end", help="結束日期（YYYY-MM-DD，含當日）")
+    export.add_argument("--output", required=True, help="輸出檔路徑（- 表示標準輸出）")
+    export.set_defaults(func=cmd_export)
+
+    args = parser.parse_args(argv)
+    database.DB_PATH = args.db
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""POS 效能量測
+
+記錄 SQL 查詢與頁面繪製的耗時，以滾動視窗計算 p50 / p95 / p99。
+預設關閉；關閉時 timer() 只回傳共用的空 context manager，資料庫連線
+也不會掛上量測用的游標，幾乎沒有額外負擔。
+
+啟用方式：設定環境變數 POS_METRICS=1。
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+ENABLED = os.environ.get("POS_METRICS") == "1"
+
+# 每個項目保留最近幾筆樣本計算百分位數
+WINDOW = 1000
+
+
+class Histogram:
+    """單一項目的滾動樣本（秒）與累計次數"""
+
+    def __init__(self, window=WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.rows = 0
+
+    def add(self, seconds, rows=0):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.rows += rows
+
+    def summary(self):
+        """回傳次數、列數與毫秒統計（百分位數以視窗內樣本計算）"""
+        ordered = sorted(self.samples)
+
+        def pct(p):
+            # nearest-rank 百分位數
+            return ordered[max(0, -(-len(ordered) * p // 100) - 1)] * 1000 if ordered else 0.0
+
+        return {
+            "count": self.count, "rows": self.rows, "total_ms": self.total * 1000,
+            "mean_ms": self.total * 1000 / self.count if self.count else 0.0,
+            "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99),
+            "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+        }
+
+
+_histograms = {}
+_lock = threading.Lock()
+# 目前執行緒在頁面計時期間累計的 SQL 秒數
+_local = threading.local()
+
+
+def record(name, seconds, rows=0):
+    """記錄一筆耗時樣本"""
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(name, Histogram())
+    histogram.add(seconds, rows)
+
+
+def record_query(name, seconds, rows):
+    """記錄一次 SQL 查詢，並計入目前頁面的 SQL 時間"""
+    record("sql:" + name, seconds, rows)
+    _local.sql_seconds = getattr(_local, "sql_seconds", 0.0) + seconds
+
+
+class _Timer:
+    """區塊計時器，另外記錄區塊內的 SQL 時間（name + ".sql"）"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def start(self):
+        self._outer_sql = getattr(_local, "sql_seconds", 0.0)
+        _local.sql_seconds = 0.0
+        self._start = time.perf_counter()
+        return self
+
+    def stop(self):
+        elapsed = time.perf_counter() - self._start
+        sql = _local.sql_seconds
+        record(self.name, elapsed)
+        # 花在 SQLite 的時間，其餘為 pandas / Streamlit 元件
+        record(self.name + ".sql", sql)
+        _local.sql_seconds = self._outer_sql + sql
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _NullTimer:
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name):
+    """量測區塊耗時（with 區塊，或呼叫 start() / stop()）；未啟用時不做任何事"""
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(name)
+
+
+def snapshot():
+    """回傳所有項目的統計，依名稱排序"""
+    with _lock:
+        items = sorted(_histograms.items())
+    return {name: histogram.summary() for name, histogram in items}
+
+
+def dump_json(**extra):
+    """以 JSON 字串輸出目前的統計（供機器讀取），extra 的項目一併輸出"""
+    return json.dumps({"enabled": ENABLED, "time": time.time(), "metrics": snapshot(), **extra},
+                      ensure_ascii=False, indent=2)
+
+
+def reset():
+    """清除所有樣本"""
+    with _lock:
+        _histograms.clear()
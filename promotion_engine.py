@@ -0,0 +1,174 @@
+"""POS 整車促銷引擎
+
+把有效促銷編譯成依 product_id 排序的欄位式 NumPy 陣列，整台購物車
+以一次批次運算計價，不再逐項逐規則跑 Python 迴圈。
+
+規則語意：
+- 商品促銷（percent / fixed / bogo / second_discount）：依單品數量計算，
+  數量需達 min_quantity。
+- 整單促銷（amount 滿額折扣，或未指定商品的 percent / fixed）：
+  以整張購物車小計比對 min_amount；指定商品的滿額折扣需購物車內有該商品。
+- start_date / end_date（'YYYY-MM-DD'，含當日）以外的促銷不套用。
+- 同一商品（或整單）依 priority 由大到小排序：最優先的可套用促銷若為
+  exclusive 則只套用它，否則疊加所有非 exclusive 的可套用促銷。
+"""
+from collections import namedtuple
+from datetime import date
+
+import numpy as np
+
+import database
+
+LINE_TYPES = ('percent', 'fixed', 'bogo', 'second_discount')
+_PERCENT, _FIXED, _BOGO, _SECOND, _AMOUNT = range(5)
+_TYPE_CODES = {'percent': _PERCENT, 'fixed': _FIXED, 'bogo': _BOGO, 'second_discount': _SECOND, 'amount': _AMOUNT}
+
+# 整單促銷中「不限商品」的 product_id
+_ANY_PRODUCT = -1
+
+# 計價結果：每行折扣與促銷名稱、整單折扣與名稱、總折扣
+CartPricing = namedtuple("CartPricing", [
+    "line_discounts", "line_promotions", "basket_discount", "basket_promotions", "total_discount",
+])
+
+
+def in_window(rule, today):
+    """促銷是否在有效日期內（today 為 'YYYY-MM-DD'）"""
+    if rule.start_date and str(rule.start_date)[:10] > today:
+        return False
+    if rule.end_date and str(rule.end_date)[:10] < today:
+        return False
+    return True
+
+
+def _select_rules(groups, eligible, exclusive):
+    """依優先順序挑選要套用的促銷
+
+    groups 為各候選所屬群組（已依群組、優先順序排序），回傳 (keep 遮罩, 各群組第一個套用的候選位置)。
+    """
+    positions = np.flatnonzero(eligible)
+    group_ids, first_index = np.unique(groups[positions], return_index=True)
+    first = positions[first_index]
+    top_exclusive = np.zeros(groups.max() + 1 if len(groups) else 0, dtype=bool)
+    top_first = np.full(len(top_exclusive), -1)
+    top_exclusive[group_ids] = exclusive[first]
+    top_first[group_ids] = first
+    own = np.arange(len(groups))
+    keep = eligible & np.where(top_exclusive[groups], own == top_first[groups], ~exclusive)
+    return keep, top_first
+
+
+class PromotionEngine:
+    """編譯後的促銷規則表"""
+
+    def __init__(self, rules, today=None):
+        self.today = today or date.today().isoformat()
+        # 編譯來源（get_engine 用來判斷促銷索引是否已更新）
+        self.source = None
+        active = [r for r in rules if in_window(r, self.today)]
+        line = [r for r in active if r.type in LINE_TYPES and r.product_id is not None]
+        basket = [r for r in active if r.type == 'amount' or (r.product_id is None and r.type in ('percent', 'fixed'))]
+        line.sort(key=lambda r: (r.product_id, -r.priority, r.id))
+        basket.sort(key=lambda r: (-r.priority, r.id))
+        self.line_rules = line
+        self.basket_rules = basket
+        self._line = self._columns(line)
+        self._basket = self._columns(basket)
+
+    @staticmethod
+    def _columns(rules):
+        return {
+            'product_id': np.array([_ANY_PRODUCT if r.product_id is None else r.product_id for r in rules], dtype=np.int64),
+            'kind': np.array([_TYPE_CODES[r.type] for r in rules], dtype=np.int8),
+            'value': np.array([r.value for r in rules], dtype=np.float64),
+            'min_quantity': np.array([r.min_quantity for r in rules], dtype=np.int64),
+            'min_amount': np.array([r.min_amount for r in rules], dtype=np.float64),
+            'exclusive': np.array([bool(r.exclusive) for r in rules], dtype=bool),
+        }
+
+    def best_rule(self, product_id):
+        """商品最優先的促銷（商品列表顯示用），沒有則回傳 None"""
+        i = np.searchsorted(self._line['product_id'], product_id)
+        if i < len(self.line_rules) and self.line_rules[i].product_id == product_id:
+            return self.line_rules[i]
+        return None
+
+    def price_lines(self, product_ids, quantities, prices):
+        """批次計算每行的商品促銷，回傳 (折扣陣列, 套用的第一個規則索引陣列，-1 表示無)"""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        quantities = np.asarray(quantities, dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.float64)
+        n = len(product_ids)
+        cols = self._line
+        left = np.searchsorted(cols['product_id'], product_ids, side='left')
+        right = np.searchsorted(cols['product_id'], product_ids, side='right')
+        counts = right - left
+        if n == 0 or counts.sum() == 0:
+            return np.zeros(n), np.full(n, -1)
+
+        # 展開成（購物車行, 候選規則）配對
+        line = np.repeat(np.arange(n), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        rule = np.repeat(left, counts) + offset
+        qty = quantities[line]
+        price = prices[line]
+        kind = cols['kind'][rule]
+        value = cols['value'][rule]
+        discount = np.select(
+            [kind == _PERCENT, kind == _FIXED, kind == _BOGO, kind == _SECOND],
+            [price * qty * value / 100, value, (qty // 2) * price, np.where(qty >= 2, price * value / 100, 0)],
+            0.0)
+        eligible = qty >= cols['min_quantity'][rule]
+        keep, first = _select_rules(line, eligible, cols['exclusive'][rule])
+
+        discounts = np.bincount(line, weights=np.where(keep, discount, 0.0), minlength=n)
+        discounts = np.minimum(discounts, prices * quantities)
+        applied = np.full(n, -1)
+        first = np.pad(first, (0, n - len(first)), constant_values=-1)
+        applied[first >= 0] = rule[first[first >= 0]]
+        return np.round(discounts, 2), applied
+
+    def price_basket(self, subtotal, product_ids, line_discount=0.0):
+        """計算整單促銷，回傳 (折扣, 套用的規則清單)"""
+        cols = self._basket
+        if not self.basket_rules:
+            return 0.0, []
+        in_cart = (cols['product_id'] == _ANY_PRODUCT) | np.isin(cols['product_id'], np.asarray(product_ids, dtype=np.int64))
+        eligible = in_cart & (subtotal >= cols['min_amount'])
+        # 整單百分比折扣以扣除商品促銷後的金額計算，避免重複打折
+        discount = np.where(cols['kind'] == _PERCENT, (subtotal - line_discount) * cols['value'] / 100, cols['value'])
+        keep, _ = _select_rules(np.zeros(len(self.basket_rules), dtype=np.int64), eligible, cols['exclusive'])
+        total = min(float(discount[keep].sum()), max(subtotal - line_discount, 0.0))
+        return round(total, 2), [self.basket_rules[i] for i in np.flatnonzero(keep)]
+
+    def price_cart(self, cart):
+        """計算整台購物車（dict 清單，含 product_id / quantity / price / subtotal）"""
+        product_ids = [item['product_id'] for item in cart]
+        discounts, applied = self.price_lines(product_ids, [item['quantity'] for item in cart],
+                                              [item['price'] for item in cart])
+        line_discount = float(discounts.sum())
+        subtotal = sum(item['subtotal'] for item in cart)
+        basket_discount, basket_rules = self.price_basket(subtotal, product_ids, line_discount)
+        return CartPricing(
+            line_discounts=discounts.tolist(),
+            line_promotions=[self.line_rules[i] if i >= 0 else None for i in applied.tolist()],
+            basket_discount=basket_discount,
+            basket_promotions=basket_rules,
+            total_discount=round(line_discount + basket_discount, 2),
+        )
+
+
+_engine = None
+
+
+def get_engine():
+    """取得目前有效促銷的引擎；促銷異動或跨日時自動重新編譯"""
+    global _engine
+    index = database.get_promotion_index()
+    today = date.today().isoformat()
+    engine = _engine
+    if engine is None or engine.source is not index or engine.today != today:
+        engine = PromotionEngine([rule for rules in index.values() for rule in rules], today)
+        engine.source = index
+        _engine = engine
+    return engine
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """在暫存目錄建立新的資料庫並切換過去，結束後關閉連線"""
+    database.close_connections()
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "pos.db"))
+    database.init_db()
+    database.invalidate_cache()
+    database._barcode_map = None
+    yield database
+    database.close_connections()
+    database.invalidate_cache()
+    database._barcode_map = None
@@ -0,0 +1,80 @@
+import glob
+import os
+
+import pytest
+
+pytest.importorskip("pyarrow")
+duckdb = pytest.importorskip("duckdb")
+
+import analytics
+
+
+def _sale(product, key, created_at, quantity=1):
+    return {'member_id': None, 'subtotal': 50.0 * quantity, 'discount': 0, 'total': 50.0 * quantity,
+            'cash': 100, 'change_amount': 0, 'idempotency_key': key, 'created_at': created_at,
+            'items': [{'product_id': product, 'name': "咖啡", 'quantity': quantity, 'price': 50.0,
+                       'subtotal': 50.0 * quantity}]}
+
+
+def _mirrored(name):
+    pattern = os.path.join(analytics._directory(), name, "month=*", "*.parquet")
+    return sorted(row[0] for row in duckdb.sql(f"SELECT id FROM read_parquet('{pattern}')").fetchall())
+
+
+def _ids(db, name):
+    with db.get_connection() as conn:
+        return sorted(row[0] for row in conn.execute(f"SELECT id FROM {name}"))
+
+
+@pytest.fixture
+def product(db):
+    return db.add_product("咖啡", 50, 50, 30, 100, "C1", "飲料")
+
+
+def test_interleaved_months_are_all_mirrored(db, product):
+    # 回放保留原結帳時間：id 與月份交錯
+    db.apply_sales([_sale(product, "a", "2026-11-01 09:00:00"), _sale(product, "b", "2026-10-31 23:00:00"),
+                    _sale(product, "c", "2026-11-01 10:00:00", 2)])
+    assert analytics.sync() == {"sales": 3, "sale_items": 3}
+    assert _mirrored("sales") == _ids(db, "sales")
+    assert _mirrored("sale_items") == _ids(db, "sale_items")
+    assert analytics.sales_by_hour()["orders"].sum() == 3
+    assert sorted(os.listdir(os.path.join(analytics._directory(), "sales"))) == ["month=2026-10", "month=2026-11"]
+
+
+def test_sync_round_trip_and_incremental(db, product):
+    db.apply_sales([_sale(product, f"a{i}", f"2026-10-{i + 1:02d} 1{i}:00:00", i + 1) for i in range(5)])
+    assert analytics.sync(chunk_size=2) == {"sales": 5, "sale_items": 5}
+
+    best = analytics.best_sellers()
+    assert best["quantity"].tolist() == [15]
+    assert best["revenue"].tolist() == [750.0]
+    hours = analytics.sales_by_hour()
+    assert hours["hour"].tolist() == [10, 11, 12, 13, 14]
+    assert analytics.basket_sizes("2026-10-02", "2026-10-03")["items"].tolist() == [2, 3]
+    margin = analytics.margin_by_category()
+    assert margin["margin"].tolist() == [300.0]
+
+    files = glob.glob(os.path.join(analytics._directory(), "*", "month=*", "*.parquet"))
+    assert analytics.sync() == {"sales": 0, "sale_items": 0}
+    assert glob.glob(os.path.join(analytics._directory(), "*", "month=*", "*.parquet")) == files
+
+    db.apply_sales([_sale(product, "b", "2026-10-31 20:00:00")])
+    assert analytics.sync() == {"sales": 1, "sale_items": 1}
+    assert _mirrored("sales") == _ids(db, "sales")
+
+
+def test_sales_backdated_into_archived_months(db, product):
+    db.apply_sales([_sale(product, "old", "2024-01-10 10:00:00")])
+    db.create_sale(None, 50, 0, 50, 50, 0, [{'product_id': product, 'name': "咖啡", 'quantity': 1,
+                                             'price': 50, 'subtotal': 50}], idempotency_key="now")
+    assert db.archive_sales(keep_months=1) == {"2024-01": 1}
+    assert analytics.sync()["sales"] == 2
+
+    # 封存後才回放的一月銷售仍在 pos.db
+    db.apply_sales([_sale(product, "late", "2024-01-20 10:00:00"), _sale(product, "now2", "2099-01-01 10:00:00")])
+    assert analytics.sync()["sales"] == 2
+    db.archive_sales(keep_months=1)
+    assert analytics.sync()["sales"] == 0
+    assert _mirrored("sales") == [1, 2, 3, 4]
+    assert _mirrored("sale_items") == [1, 2, 3, 4]
@@ -0,0 +1,93 @@
+import http.client
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+from urllib.parse import urlsplit
+
+import pytest
+
+import database
+
+API = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api.py")
+
+
+@pytest.fixture
+def api(db):
+    db.add_product("咖啡", 100, 105, 60, 10, "C1", "飲料")
+    database.close_connections()
+    server = subprocess.Popen([sys.executable, API, "--port", "0", "--db", db.DB_PATH, "--workers", "2"],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    url = urlsplit(re.search(r"http://\S+", server.stdout.readline()).group(0))
+    yield server, url.hostname, url.port
+    if server.poll() is None:
+        server.kill()
+        server.wait()
+
+
+def _post(host, port, path, body):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    try:
+        conn.request("POST", path, json.dumps(body), {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def test_checkout_rejects_out_of_range_discount(api):
+    _, host, port = api
+    items = [{"barcode": "C1", "quantity": 2}]
+    for discount in (-10, 211):
+        status, body = _post(host, port, "/checkout", {"items": items, "discount": discount})
+        assert status == 400, body
+    status, body = _post(host, port, "/checkout", {"items": items, "discount": 10})
+    assert status == 200
+    assert body["total"] == 200
+
+
+def test_client_disconnect_mid_body_and_clean_shutdown(api):
+    server, host, port = api
+    with socket.create_connection((host, port)) as sock:
+        sock.sendall(b"POST /cart/price HTTP/1.1\r\nHost: x\r\nContent-Length: 100\r\n\r\n{\"items\"")
+    status, _ = _post(host, port, "/cart/price", {"items": [{"barcode": "C1"}]})
+    assert status == 200
+
+    server.send_signal(signal.SIGTERM)
+    _, stderr = server.communicate(timeout=15)
+    assert server.returncode == 0
+    assert "Traceback" not in stderr
+
+
+def test_promotion_index_picks_up_changes_from_other_processes(db, monkeypatch):
+    product = db.add_product("咖啡", 100, 105, 60, 10, "C1", "飲料")
+    assert db.get_promotion_index() == {}
+    # 其他行程寫入：本行程的世代不會遞增
+    with db.transaction() as cursor:
+        cursor.execute("INSERT INTO promotions (name, type, value, product_id, min_quantity, is_active) "
+                       "VALUES ('九折', 'percent', 10, ?, 1, 1)", (product,))
+    assert db.get_promotion_index() == {}
+    monkeypatch.setattr(database, "CACHE_TTL", 0)
+    assert [rule.name for rule in db.get_promotion_index()[product]] == ["九折"]
+
+
+def test_checkout_rejects_non_finite_numbers(api):
+    _, host, port = api
+    items = [{"barcode": "C1", "quantity": 1}]
+    for body in ({"cash": "inf"}, {"cash": "nan"}, {"discount": "nan"}, {"discount": "-inf"}):
+        status, response = _post(host, port, "/checkout", {"items": items, **body})
+        assert status == 400, (body, response)
+    # json 的 Infinity 常值
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    try:
+        conn.request("POST", "/checkout", '{"items": [{"barcode": "C1", "quantity": Infinity}], "cash": Infinity}',
+                     {"Content-Type": "application/json"})
+        assert conn.getresponse().status == 400
+    finally:
+        conn.close()
+    status, body = _post(host, port, "/checkout", {"items": items, "cash": 200})
+    assert status == 200
+    assert body["change"] == 95
@@ -0,0 +1,55 @@
+import io
+import os
+
+import database
+import exporter
+
+
+def _sale(product, key, created_at, quantity=1):
+    return {'member_id': None, 'subtotal': 50.0 * quantity, 'discount': 0, 'total': 50.0 * quantity,
+            'cash': 100, 'change_amount': 0, 'idempotency_key': key, 'created_at': created_at,
+            'items': [{'product_id': product, 'name': "咖啡", 'quantity': quantity, 'price': 50.0,
+                       'subtotal': 50.0 * quantity}]}
+
+
+def _export(name):
+    out = io.BytesIO()
+    exporter.export(name, "csv", out)
+    return out.getvalue()
+
+
+def _all_sales():
+    rows, cursor = database.get_sales_page(page_size=3)
+    while cursor is not None:
+        page, cursor = database.get_sales_page(before=cursor, page_size=3)
+        rows += page
+    return [row['id'] for row in rows]
+
+
+def test_archive_moves_old_months_and_keeps_reports(db):
+    product = db.add_product("咖啡", 50, 50, 30, 100, "C1", "飲料")
+    sales = [_sale(product, f"a{i}", f"2024-01-{10 + i:02d} 10:00:00", i + 1) for i in range(3)]
+    sales += [_sale(product, f"b{i}", f"2024-02-{10 + i:02d} 10:00:00") for i in range(3)]
+    db.apply_sales(sales)
+    db.create_sale(None, 50, 0, 50, 50, 0, [{'product_id': product, 'name': "咖啡", 'quantity': 1,
+                                             'price': 50, 'subtotal': 50}], idempotency_key="now")
+    db.invalidate_cache()
+
+    before = {name: _export(name) for name in ("sales", "sale_items")}
+    daily = db.get_daily_sales("2024-01-11")
+    ids = _all_sales()
+
+    assert db.archive_sales(keep_months=1, batch_size=2) == {"2024-01": 3, "2024-02": 3}
+    assert [row[0] for row in db.get_archives()] == ["2024-01", "2024-02"]
+    assert os.path.exists(db._archive_file("2024-01"))
+    with db.get_connection() as conn:
+        assert conn.execute("SELECT idempotency_key FROM sales").fetchall()[0][0] == "now"
+
+    # 報表、分頁與匯出合併封存檔後結果不變
+    assert {name: _export(name) for name in before} == before
+    assert db.get_daily_sales("2024-01-11") == daily
+    assert _all_sales() == ids
+
+    # 重新執行不會再搬移或重複
+    assert db.archive_sales(keep_months=1) == {}
+    assert {name: _export(name) for name in before} == before
@@ -0,0 +1,44 @@
+import gzip
+import os
+import sqlite3
+
+import pytest
+
+import backup
+
+
+@pytest.fixture
+def products(db):
+    for i in range(300):
+        db.add_product(f"商品{i:03d}", 10, 10.5, 5, i, f"B{i}", "雜貨")
+    return 300
+
+
+def test_snapshot_is_verified_and_restorable(db, products, tmp_path):
+    result = backup.snapshot()
+    assert [path for path, _, _ in backup.list_snapshots()] == [result.path]
+    backup.verify(result.path)
+
+    restored = tmp_path / "restored.db"
+    with gzip.open(result.path, "rb") as gz, open(restored, "wb") as out:
+        out.write(gz.read())
+    conn = sqlite3.connect(restored)
+    try:
+        assert conn.execute("SELECT COUNT(*), SUM(stock) FROM products").fetchone() == (products, sum(range(300)))
+    finally:
+        conn.close()
+
+
+def test_truncated_backups_fail_verification(db, products, tmp_path):
+    plain = backup.backup_to(str(tmp_path / "copy.db")).path
+    backup.verify(plain)
+    with open(plain, "r+b") as f:
+        f.truncate(os.path.getsize(plain) // 2)
+    with pytest.raises(backup.BackupError):
+        backup.verify(plain)
+
+    compressed = backup.snapshot().path
+    with open(compressed, "r+b") as f:
+        f.truncate(os.path.getsize(compressed) // 2)
+    with pytest.raises(backup.BackupError):
+        backup.verify(compressed)
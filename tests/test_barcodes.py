@@ -0,0 +1,17 @@
+def test_duplicate_barcodes_resolve_to_lowest_id(db):
+    # 舊資料庫有重複條碼時只有一般索引
+    with db.transaction() as cursor:
+        cursor.execute("DROP INDEX idx_products_barcode")
+        cursor.execute("CREATE INDEX idx_products_barcode ON products(barcode)")
+    first = db.add_product("咖啡", 100, 105, 60, 10, "C1", "飲料")
+    db.add_product("綠茶", 20, 21, 8, 10, "T1", "飲料")
+    with db.transaction() as cursor:
+        cursor.execute("INSERT INTO products (name, price_ex_tax, price_inc_tax, cost, stock, barcode, category) "
+                       "VALUES ('咖啡（重複）', 90, 94.5, 60, 5, 'C1', '飲料')")
+    db.invalidate_cache()
+
+    products = db.get_products_by_barcodes(["C1", "T1", " C1 ", "X9", ""])
+    assert sorted(products) == ["C1", "T1"]
+    assert products["C1"]["id"] == first
+    for code, product in products.items():
+        assert db.get_product_by_barcode(code)["id"] == product["id"]
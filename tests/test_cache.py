@@ -0,0 +1,32 @@
+import database
+
+
+def test_mutating_a_cached_result_does_not_change_the_cache(db):
+    db.add_member("王小明", "0912345678")
+    rows, cursor = db.get_members_page()
+    rows.append("x")
+    rows.clear()
+    assert [row["name"] for row in db.get_members_page()[0]] == ["王小明"]
+
+    stats = db.get_daily_sales()
+    stats["orders"] = 99
+    assert db.get_daily_sales()["orders"] == 0
+
+    trend = db.get_daily_sales_trend()
+    trend.append(("2025-01-01", 1, 1, 0, 1))
+    assert db.get_daily_sales_trend() == []
+    assert db.cache_stats()["get_daily_sales_trend"]["hits"] == 1
+
+
+def test_writes_bump_the_generation_and_evict_reads(db):
+    product = db.add_product("咖啡", 100, 105, 60, 10, "C1", "飲料")
+    assert [row["name"] for row in db.get_products_page()[0]] == ["咖啡"]
+    generation = database._generations["products"]
+
+    db.update_product(product, "拿鐵", 120, 126, 70, 10, "C1", "飲料")
+    assert database._generations["products"] > generation
+    assert [row["name"] for row in db.get_products_page()[0]] == ["拿鐵"]
+    assert db.count_products() == 1
+    db.add_product("綠茶", 20, 21, 8, 5, "T1", "飲料")
+    assert db.count_products() == 2
+    assert db.get_categories() == ["飲料"]
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from cart import Cart
+from database import PromotionRule
+from promotion_engine import PromotionEngine
+
+TODAY = "2025-06-15"
+
+
+def _engine(rng, products):
+    rules = [PromotionRule(i, f"促銷{i}", rng.choice(["percent", "fixed", "bogo", "second_discount"]),
+                           rng.randint(1, 5), rng.randint(1, products), rng.randint(1, 3), 0, None, None,
+                           rng.randint(0, 3), rng.random() < 0.2)
+             for i in range(1, 40)]
+    rules.append(PromotionRule(40, "滿 500 折 50", "amount", 50, None, 1, 500, None, None))
+    return PromotionEngine(rules, TODAY)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_incremental_pricing_matches_full_pricing(seed):
+    rng = random.Random(seed)
+    products = 20
+    prices = {product_id: float(rng.randint(10, 300)) for product_id in range(1, products + 1)}
+    engine = _engine(rng, products)
+    cart = Cart()
+    for step in range(200):
+        product_id = rng.randint(1, products)
+        op = rng.random()
+        if op < 0.5:
+            cart.add(product_id, f"商品{product_id}", prices[product_id], rng.randint(1, 3))
+        elif op < 0.8:
+            cart.update(product_id, rng.choice([-2, -1, 1]))
+        elif op < 0.95:
+            cart.remove(product_id)
+        else:
+            # 促銷規則重新編譯
+            engine = _engine(rng, products)
+
+        pricing = cart.price(engine)
+        items = [{'product_id': line.product_id, 'quantity': line.quantity, 'price': line.price,
+                  'subtotal': line.subtotal} for line in cart]
+        expected = engine.price_cart(items)
+        assert cart.subtotal == pytest.approx(sum(item['subtotal'] for item in items))
+        assert pricing.line_discounts == pytest.approx(expected.line_discounts)
+        assert [rule and rule.id for rule in pricing.line_promotions] == \
+               [rule and rule.id for rule in expected.line_promotions]
+        assert pricing.basket_discount == pytest.approx(expected.basket_discount)
+        assert pricing.total_discount == pytest.approx(expected.total_discount)
+
+
+def test_quantities_and_removal():
+    cart = Cart()
+    cart.add(1, "咖啡", 52.5)
+    cart.add(1, "咖啡", 52.5, 2)
+    cart.add(2, "綠茶", 21.0)
+    assert [(line.product_id, line.quantity) for line in cart] == [(1, 3), (2, 1)]
+    assert cart.subtotal == 178.5
+    assert cart.get(1)['subtotal'] == 157.5
+
+    cart.update(2, -1)
+    assert 2 not in cart and len(cart) == 1
+    cart.set_quantity(1, 1)
+    assert cart.subtotal == 52.5
+    cart.clear()
+    assert len(cart) == 0 and cart.subtotal == 0 and cart.line_discount == 0
+
+
+def test_price_is_reused_until_cart_or_engine_changes():
+    rules = [PromotionRule(1, "九折", "percent", 10, 1, 1, 0, None, None)]
+    engine = PromotionEngine(rules, TODAY)
+    cart = Cart()
+    cart.add(1, "咖啡", 100.0, 2)
+    first = cart.price(engine)
+    assert first.total_discount == 20
+    assert cart.price(engine) is first
+    cart.add(1, "咖啡", 100.0)
+    assert cart.price(engine).total_discount == 30
+    assert cart.price(PromotionEngine([], TODAY)).total_discount == 0
@@ -0,0 +1,13 @@
+import io
+
+import importer
+
+
+def test_fractional_stock_is_rejected(db):
+    csv = "名稱,售價含稅,庫存,條碼\n可樂,30,1.7,A1\n綠茶,25,3,A2\n紅茶,25,2.0,A3\n"
+    report = importer.import_products(io.BytesIO(csv.encode("utf-8")), "products.csv")
+    assert report.errors == [(2, "庫存 格式錯誤")]
+    assert report.imported == 2
+    assert db.get_product_by_barcode("A1") is None
+    assert db.get_product_by_barcode("A2")["stock"] == 3
+    assert db.get_product_by_barcode("A3")["stock"] == 2
@@ -0,0 +1,126 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+import database
+import journal
+
+
+@pytest.fixture
+def product(db):
+    return db.add_product("咖啡", 50, 52.5, 30, 100, "C1", "飲料")
+
+
+def _submit(sale_journal, product, key, quantity=1):
+    items = [{'product_id': product, 'name': "咖啡", 'quantity': quantity, 'price': 52.5,
+              'subtotal': 52.5 * quantity}]
+    return sale_journal.submit(None, 52.5 * quantity, 0, 52.5 * quantity, 100, 0, items, idempotency_key=key)
+
+
+def _sales(db):
+    with db.get_connection() as conn:
+        return conn.execute("SELECT idempotency_key, created_at, total FROM sales ORDER BY id").fetchall()
+
+
+def test_replay_after_crash(db, product):
+    path = db.DB_PATH + ".journal"
+    sale_journal = journal.SaleJournal(path)
+    _submit(sale_journal, product, "a")
+    _submit(sale_journal, product, "b", 2)
+    # 當機：最後一行只寫了一半，檢查點停在 0
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"idempotency_key": "c", "ite')
+
+    recovered = journal.SaleJournal(path)
+    assert recovered.flush() == 2
+    assert [row[0] for row in _sales(db)] == ["a", "b"]
+    assert db.get_product(product)["stock"] == 97
+    assert recovered.pending() == 0
+
+
+def test_replay_keeps_checkout_time(db, product):
+    sale_journal = journal.SaleJournal(db.DB_PATH + ".journal")
+    _submit(sale_journal, product, "a")
+    with open(sale_journal.path, encoding="utf-8") as f:
+        entry = json.loads(f.readline())
+    # 模擬兩天前留下的記錄
+    entry['created_at'] = "2024-01-02 10:00:00"
+    with open(sale_journal.path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+
+    sale_journal.flush()
+    assert _sales(db)[0][1] == "2024-01-02 10:00:00"
+    assert db.get_daily_sales("2024-01-02")["orders"] == 1
+
+
+def test_replay_is_idempotent(db, product):
+    sale_journal = journal.SaleJournal(db.DB_PATH + ".journal")
+    _submit(sale_journal, product, "a")
+    # 寫入資料庫後、推進檢查點前當機：整段重放
+    database.apply_sales([json.loads(line) for line in open(sale_journal.path, encoding="utf-8")])
+    assert sale_journal.flush() == 1
+    assert len(_sales(db)) == 1
+    assert db.get_product(product)["stock"] == 99
+
+
+def test_locked_database_is_retried_not_quarantined(db, product, monkeypatch):
+    sale_journal = journal.SaleJournal(db.DB_PATH + ".journal")
+    _submit(sale_journal, product, "a")
+    apply_sales = database.apply_sales
+
+    def locked(sales):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(database, "apply_sales", locked)
+    with pytest.raises(sqlite3.OperationalError):
+        sale_journal.flush()
+    assert not os.path.exists(sale_journal.failed_path)
+    assert sale_journal.pending() > 0
+
+    monkeypatch.setattr(database, "apply_sales", apply_sales)
+    assert sale_journal.flush() == 1
+    assert [row[0] for row in _sales(db)] == ["a"]
+
+
+def test_bad_entry_is_quarantined(db, product):
+    sale_journal = journal.SaleJournal(db.DB_PATH + ".journal")
+    _submit(sale_journal, product, "a")
+    with open(sale_journal.path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({'idempotency_key': "bad", 'items': []}) + "\n")
+    _submit(sale_journal, product, "b")
+
+    assert sale_journal.flush() == 3
+    assert [row[0] for row in _sales(db)] == ["a", "b"]
+    with open(sale_journal.failed_path, encoding="utf-8") as f:
+        assert json.loads(f.readline())['sale']['idempotency_key'] == "bad"
+
+
+def _worker(db_path, prefix, product, count):
+    database.close_connections()
+    database.DB_PATH = db_path
+    sale_journal = journal.SaleJournal(db_path + ".journal", batch_size=3)
+    for i in range(count):
+        _submit(sale_journal, product, f"{prefix}{i}")
+        if i % 4 == 0:
+            sale_journal.flush()
+    sale_journal.flush()
+    database.close_connections()
+
+
+
+@pytest.mark.skipif(journal.fcntl is None, reason="需要 fcntl")
+def test_processes_sharing_a_journal_lose_nothing(db, product):
+    import multiprocessing
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_worker, args=(db.DB_PATH, prefix, product, 40)) for prefix in "xyz"]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    journal.SaleJournal(db.DB_PATH + ".journal").flush()
+    assert len(_sales(db)) == 120
+    assert db.get_product(product)["stock"] == -20
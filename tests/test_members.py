@@ -0,0 +1,16 @@
+import database
+
+
+def test_member_lookups_do_not_expose_index_columns(db):
+    db.add_member("王小明", "0912345678", "ming@example.com")
+    db.add_member("王大同", "0987654678")
+    expected = {"id", "name", "phone", "email", "points", "total_spent", "created_at"}
+
+    for query in ("0912", "5678", "王"):
+        rows = db.search_members(query)
+        assert rows, query
+        assert all(set(row.keys()) == expected for row in rows)
+    assert {row["phone"] for row in db.search_members("678")} == {"0912345678", "0987654678"}
+    assert set(db.get_member_by_phone("0912345678").keys()) == expected
+    assert [tuple(row) for row in db.search_members("0912")] == [
+        tuple(row) for row in database.get_members() if row["phone"] == "0912345678"]
@@ -0,0 +1,56 @@
+import pytest
+
+
+def _walk(fetch):
+    rows, cursor = fetch(None)
+    pages = 1
+    while cursor is not None:
+        page, cursor = fetch(cursor)
+        rows += page
+        pages += 1
+    return rows, pages
+
+
+@pytest.fixture
+def products(db):
+    # 重複名稱與相同類別，排序鍵有大量平手
+    names = ["咖啡", "綠茶", "咖啡", "蛋糕", "咖啡", "綠茶", "咖啡", "蛋糕", "咖啡", "咖啡", "綠茶"]
+    for i, name in enumerate(names):
+        db.add_product(name, 10, 10.5, 5, 1, f"B{i}", "飲料" if name != "蛋糕" else "點心")
+    with db.get_connection() as conn:
+        return [tuple(row) for row in conn.execute("SELECT * FROM products")]
+
+
+@pytest.mark.parametrize("order_by", ["id", "name"])
+@pytest.mark.parametrize("category", [None, "飲料"])
+def test_product_pages_cover_every_row_once(db, products, order_by, category):
+    rows, pages = _walk(lambda after: db.get_products_page(after, order_by, category, page_size=3))
+    expected = [row for row in products if category in (None, row[7])]
+    key = (lambda row: row[0]) if order_by == "id" else (lambda row: (row[1], row[0]))
+    assert [tuple(row) for row in rows] == sorted(expected, key=key)
+    assert pages == -(-len(expected) // 3)
+
+
+def test_sale_pages_cover_every_row_once_with_tied_times(db, products):
+    product = products[0][0]
+    item = [{'product_id': product, 'name': "咖啡", 'quantity': 1, 'price': 10, 'subtotal': 10}]
+    sales = []
+    for i in range(10):
+        # 四筆同一秒、其餘兩兩同秒
+        created_at = "2025-03-01 10:00:00" if i < 4 else f"2025-03-0{i // 2} 09:00:00"
+        sales.append({'member_id': None, 'subtotal': 10 + i, 'discount': 0, 'total': 10 + i, 'cash': 100,
+                      'change_amount': 0, 'idempotency_key': f"s{i}", 'created_at': created_at,
+                      'payment_method': "cash" if i % 3 else "card", 'items': item})
+    db.apply_sales(sales)
+    with db.get_connection() as conn:
+        everything = [tuple(row) for row in conn.execute(
+            "SELECT id, created_at, payment_method FROM sales ORDER BY created_at DESC, id DESC")]
+
+    for page_size in (1, 3, 4, 10):
+        rows, _ = _walk(lambda before: db.get_sales_page(before=before, page_size=page_size))
+        assert [(row['id'], row['created_at'], row['payment_method']) for row in rows] == everything
+
+    rows, _ = _walk(lambda before: db.get_sales_page(payment_method="card", before=before, page_size=2))
+    assert [row['id'] for row in rows] == [row[0] for row in everything if row[2] == "card"]
+    rows, _ = _walk(lambda before: db.get_sales_page("2025-03-01", "2025-03-02", before=before, page_size=2))
+    assert [row['id'] for row in rows] == [row[0] for row in everything if row[1] < "2025-03-03"]
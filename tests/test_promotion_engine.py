@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+import database
+from database import PromotionRule
+from promotion_engine import PromotionEngine
+
+TODAY = "2025-06-15"
+
+
+def _cart(rng, products, lines):
+    cart = []
+    for product_id in rng.sample(range(1, products + 1), lines):
+        quantity = rng.randint(1, 6)
+        price = float(rng.randint(10, 300))
+        cart.append({'product_id': product_id, 'quantity': quantity, 'price': price, 'subtotal': quantity * price})
+    return cart
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_line_discounts_match_per_product_pricing(seed):
+    # 沒有優先順序、互斥與數量門檻時，商品促銷等於逐項疊加 calculate_promotion（引擎另以該行小計為上限）
+    rng = random.Random(seed)
+    products = 40
+    rules = [PromotionRule(i, f"促銷{i}", rng.choice(["percent", "fixed", "bogo", "second_discount"]),
+                           rng.randint(1, 5), rng.randint(1, products), 1, 0, None, None)
+             for i in range(1, 120)]
+    index = {}
+    for rule in rules:
+        index.setdefault(rule.product_id, []).append(rule)
+    engine = PromotionEngine(rules, TODAY)
+
+    cart = _cart(rng, products, 25)
+    pricing = engine.price_cart(cart)
+    expected = [min(database.calculate_promotion(item, index.get(item['product_id'])), item['subtotal'])
+                for item in cart]
+    assert pricing.line_discounts == pytest.approx(expected)
+    assert pricing.basket_discount == 0
+    assert pricing.total_discount == pytest.approx(sum(expected))
+
+
+def test_exclusive_rule_with_highest_priority_wins():
+    rules = [PromotionRule(1, "九折", "percent", 10, 7, 1, 0, None, None, 0, False),
+             PromotionRule(2, "折 5 元", "fixed", 5, 7, 1, 0, None, None, 0, False),
+             PromotionRule(3, "買一送一", "bogo", 0, 7, 1, 0, None, None, 5, True)]
+    pricing = PromotionEngine(rules, TODAY).price_cart(
+        [{'product_id': 7, 'quantity': 2, 'price': 100.0, 'subtotal': 200.0}])
+    assert pricing.line_discounts == [100.0]
+    assert pricing.line_promotions[0].id == 3
+
+
+def test_min_quantity_and_date_window():
+    rules = [PromotionRule(1, "三件九折", "percent", 10, 7, 3, 0, None, None),
+             PromotionRule(2, "過期", "fixed", 50, 7, 1, 0, None, "2025-06-14"),
+             PromotionRule(3, "未開始", "fixed", 50, 7, 1, 0, "2025-06-16", None)]
+    engine = PromotionEngine(rules, TODAY)
+    two = engine.price_cart([{'product_id': 7, 'quantity': 2, 'price': 100.0, 'subtotal': 200.0}])
+    three = engine.price_cart([{'product_id': 7, 'quantity': 3, 'price': 100.0, 'subtotal': 300.0}])
+    assert two.total_discount == 0
+    assert three.total_discount == 30
+
+
+def test_basket_rule_uses_cart_subtotal():
+    rules = [PromotionRule(1, "九折", "percent", 10, 7, 1, 0, None, None),
+             PromotionRule(2, "滿 500 折 50", "amount", 50, None, 1, 500, None, None)]
+    engine = PromotionEngine(rules, TODAY)
+    cart = [{'product_id': 7, 'quantity': 3, 'price': 100.0, 'subtotal': 300.0},
+            {'product_id': 8, 'quantity': 1, 'price': 250.0, 'subtotal': 250.0}]
+    pricing = engine.price_cart(cart)
+    assert pricing.line_discounts == [30.0, 0.0]
+    assert pricing.basket_discount == 50
+    assert [rule.id for rule in pricing.basket_promotions] == [2]
+    assert engine.price_cart(cart[:1]).basket_discount == 0
@@ -0,0 +1,12 @@
+import database
+
+
+def test_hot_queries_use_indexes(db):
+    assert database.check_query_plans() == []
+
+
+def test_checkout_statements_are_checked():
+    # 結帳交易中的每個讀取 / 更新都要登記，新增的寫入路徑才不會悄悄變成全表掃描
+    for name in ("create_sale(idempotency_key)", "create_sale(check_stock)", "create_sale(stock)",
+                 "create_sale(member)", "create_sale(daily_summary)", "record_movement", "apply_sales(stock)"):
+        assert name in database.HOT_QUERIES
@@ -0,0 +1,48 @@
+import pytest
+
+import database
+
+
+def _names(db, query):
+    return [row["name"] for row in db.search_products(query)]
+
+
+def _fts_rows(db, query):
+    with db.get_connection() as conn:
+        return [row[0] for row in conn.execute("SELECT rowid FROM products_fts WHERE products_fts MATCH ?",
+                                               ('"' + query + '"',))]
+
+
+def test_fts_triggers_follow_insert_update_delete(db):
+    with db.get_connection() as conn:
+        if not database._has_fts(conn):
+            pytest.skip("SQLite 不支援 FTS5 trigram")
+    latte = db.add_product("冰拿鐵咖啡", 100, 105, 60, 10, "4710001", "飲料")
+    db.add_product("綠茶", 20, 21, 8, 10, "4710002", "飲料")
+    assert _names(db, "拿鐵咖") == ["冰拿鐵咖啡"]
+    assert _names(db, "10001") == ["冰拿鐵咖啡"]
+    assert _fts_rows(db, "拿鐵咖") == [latte]
+
+    db.update_product(latte, "熱美式咖啡", 90, 94.5, 50, 10, "4710009", "咖啡")
+    assert _names(db, "拿鐵咖") == []
+    assert _fts_rows(db, "拿鐵咖") == []
+    assert _names(db, "美式咖") == ["熱美式咖啡"]
+    assert _names(db, "10009") == ["熱美式咖啡"]
+    assert _names(db, "10001") == []
+
+    db.delete_product(latte)
+    assert _names(db, "美式咖") == []
+    assert _fts_rows(db, "美式咖") == []
+    assert _names(db, "綠茶") == ["綠茶"]
+
+
+def test_short_queries_use_like(db):
+    db.add_product("冰拿鐵", 100, 105, 60, 10, "C1", "飲料")
+    tea = db.add_product("綠茶", 20, 21, 8, 10, "T1", "茶類")
+    assert _names(db, "拿鐵") == ["冰拿鐵"]
+    assert _names(db, "茶") == ["綠茶"]
+    db.update_product(tea, "紅茶", 20, 21, 8, 10, "T1", "茶類")
+    assert _names(db, "綠") == []
+    assert _names(db, "紅") == ["紅茶"]
+    db.delete_product(tea)
+    assert _names(db, "茶") == []
@@ -0,0 +1,58 @@
+import pytest
+
+import database
+
+
+def test_inventory_valuation_at_point_in_time(db):
+    coffee = db.add_product("咖啡", 100, 105, 60, 10, "C1", "飲料")
+    tea = db.add_product("綠茶", 20, 21, 8, 0, "T1", "飲料")
+    with db.transaction() as cursor:
+        cursor.execute("UPDATE stock_movements SET created_at = '2025-01-01 09:00:00'")
+    db.record_stock_movement(tea, "receipt", 5)
+    with db.transaction() as cursor:
+        cursor.execute("UPDATE stock_movements SET created_at = '2025-01-02 09:00:00' WHERE product_id = ? "
+                       "AND kind = 'receipt' AND note IS NULL", (tea,))
+
+    assert [tuple(row) for row in db.get_inventory_valuation("2025-01-01")] == [(coffee, "咖啡", "飲料", 60, 10, 600)]
+    rows = db.get_inventory_valuation("2025-01-02")
+    assert [(row[0], row[4], row[5]) for row in rows] == [(coffee, 10, 600), (tea, 5, 40)]
+    assert database.get_stock_at(tea, "2025-01-01") == 0
+
+
+def _items(*lines):
+    return [{'product_id': product, 'name': name, 'quantity': quantity, 'price': 10, 'subtotal': 10 * quantity}
+            for product, name, quantity in lines]
+
+
+def _snapshot(db):
+    with db.get_connection() as conn:
+        return {table: conn.execute(f"SELECT * FROM {table} ORDER BY 1").fetchall()
+                for table in ("sales", "sale_items", "stock_movements", "products", "members",
+                              "daily_sales_summary")}
+
+
+def test_insufficient_stock_rolls_back_the_whole_sale(db):
+    coffee = db.add_product("咖啡", 10, 10, 5, 10, "C1", "飲料")
+    tea = db.add_product("綠茶", 10, 10, 5, 2, "T1", "飲料")
+    db.add_member("王小明", "0912345678")
+    member = db.get_member_by_phone("0912345678")["id"]
+    before = [[tuple(row) for row in rows] for rows in _snapshot(db).values()]
+
+    with pytest.raises(database.InsufficientStockError) as error:
+        db.create_sale(member, 50, 0, 50, 50, 0, _items((coffee, "咖啡", 2), (tea, "綠茶", 3)),
+                       idempotency_key="short")
+    assert error.value.shortages == [(tea, "綠茶", 3, 2)]
+    assert [[tuple(row) for row in rows] for rows in _snapshot(db).values()] == before
+    assert db.get_product(coffee)["stock"] == 10
+
+
+def test_repeated_idempotency_key_records_one_sale(db):
+    coffee = db.add_product("咖啡", 10, 10, 5, 10, "C1", "飲料")
+    first = db.create_sale(None, 20, 0, 20, 20, 0, _items((coffee, "咖啡", 2)), idempotency_key="k1")
+    again = db.create_sale(None, 20, 0, 20, 20, 0, _items((coffee, "咖啡", 2)), idempotency_key="k1")
+    assert again == first
+    assert db.get_product(coffee)["stock"] == 8
+    with db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0] == 1
+        movements = conn.execute("SELECT quantity, sale_id FROM stock_movements WHERE kind = 'sale'").fetchall()
+    assert [tuple(row) for row in movements] == [(-2, first)]